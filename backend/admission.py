@@ -0,0 +1,341 @@
+"""
+Admission Control
+Sheds load on the inference endpoints before an upload is read, so a burst of requests
+cannot queue up model work or uploads the process has no memory for.
+
+Each request to /process_image, /process_batch or /process_video passes, in order:
+  1. a token bucket for its API key (a key listed in API_KEYS, sent in API_KEY_HEADER)
+     or, without a known key, for its client address  -> 429 with Retry-After
+  2. the in-flight limit: inference requests being served by this process
+     (MAX_INFLIGHT_INFERENCE)                          -> 503 with Retry-After
+  3. available memory (cgroup limit, else MemAvailable) minus the announced
+     Content-Length, against MIN_AVAILABLE_MEMORY_MB   -> 503 with Retry-After
+Only the request line and headers have been read at that point. Buckets and counters are
+in memory and per process; with several workers each one enforces its own share.
+"""
+
+import ipaddress
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import Counter, METRICS, register_gauges
+
+# Turn admission control on the inference endpoints on or off
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '1') == '1'
+
+# Requests per second and burst size allowed per client address (0 disables the limit)
+RATE_LIMIT_PER_CLIENT = float(os.getenv('RATE_LIMIT_PER_CLIENT', '2'))
+RATE_LIMIT_CLIENT_BURST = int(os.getenv('RATE_LIMIT_CLIENT_BURST', '10'))
+
+# Known API keys, comma-separated; requests carrying one are limited per key instead of per address
+API_KEYS = {key.strip() for key in os.getenv('API_KEYS', '').split(',') if key.strip()}
+API_KEY_HEADER = os.getenv('API_KEY_HEADER', 'X-API-Key')
+RATE_LIMIT_PER_KEY = float(os.getenv('RATE_LIMIT_PER_KEY', '10'))
+RATE_LIMIT_KEY_BURST = int(os.getenv('RATE_LIMIT_KEY_BURST', '40'))
+
+# Buckets kept per limiter; the least recently seen clients are forgotten first
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv('RATE_LIMIT_MAX_CLIENTS', '10000'))
+
+# Behind one trusted proxy (Cloud Run, a load balancer): take the client address from the
+# last X-Forwarded-For entry, the one that proxy appended
+TRUST_FORWARDED_FOR = os.getenv('TRUST_FORWARDED_FOR', '0') == '1'
+
+# Without TRUST_FORWARDED_FOR, warn once if this many requests in a row come from private or
+# link-local addresses: that is a proxy, and all its clients would share one bucket
+PROXY_WARNING_REQUESTS = 50
+
+# Inference requests served at once per process; the rest are turned away (0 disables).
+# Defaults to four per pooled detector: enough to keep them busy without a long queue.
+MAX_INFLIGHT_INFERENCE = int(os.getenv('MAX_INFLIGHT_INFERENCE',
+                                       str(4 * int(os.getenv('LANDMARKER_POOL_SIZE', '2')))))
+
+# Memory (MB) that must remain available after the upload is buffered (0 disables)
+MIN_AVAILABLE_MEMORY_MB = float(os.getenv('MIN_AVAILABLE_MEMORY_MB', '128'))
+
+# Paths admitted here (POST only)
+ADMISSION_PATHS = ('/process_image', '/process_batch', '/process_video')
+
+# Set in the WSGI environ by asgi.py for requests it has already admitted
+ADMITTED_ENVIRON_KEY = 'advance_filter.admitted'
+
+# Seconds a client is told to wait when the process is at capacity
+CAPACITY_RETRY_AFTER = 1
+
+# Available memory is re-read at most this often
+MEMORY_SAMPLE_SECONDS = 0.1
+
+MB = 1024 * 1024
+
+ADMISSION_REJECTIONS = Counter('admission_rejections', 'Inference requests turned away before reading the '
+                               'upload (client_rate, api_key_rate, in_flight, memory).', ('reason',))
+METRICS.append(ADMISSION_REJECTIONS)
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """Raised by AdmissionController.admit. `status` is 429 or 503; `retry_after` is in whole seconds."""
+
+    def __init__(self, status, reason, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token buckets by key: `rate` tokens per second up to `burst`, one token per request."""
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        # key -> [tokens, monotonic time of the last refill]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key, now=None):
+        """Take a token for `key`. Returns 0.0, or the seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now]
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0.0
+            return (1 - bucket[0]) / self.rate
+
+    def refund(self, key):
+        """Give back the token of a request that was turned away for another reason."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + 1)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def _read_int(path):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def read_available_memory():
+    """
+    Bytes this process can still allocate: the cgroup (v2, then v1) limit minus usage when
+    the container has a limit, else the host's MemAvailable. None when neither is readable.
+    """
+    limit = _read_int('/sys/fs/cgroup/memory.max')
+    if limit is not None:
+        usage = _read_int('/sys/fs/cgroup/memory.current')
+    else:
+        limit = _read_int('/sys/fs/cgroup/memory/memory.limit_in_bytes')
+        usage = _read_int('/sys/fs/cgroup/memory/memory.usage_in_bytes')
+    host = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    host = int(line.split()[1]) * 1024
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+    # An unlimited cgroup v1 reports a limit near 2**63
+    if limit is not None and usage is not None and (host is None or limit - usage < host):
+        return max(0, limit - usage)
+    return host
+
+
+class AdmissionController:
+    """Rate limits plus in-flight and memory checks for one process."""
+
+    def __init__(self, max_in_flight=MAX_INFLIGHT_INFERENCE, min_available_mb=MIN_AVAILABLE_MEMORY_MB,
+                 client_limiter=None, key_limiter=None, api_keys=API_KEYS, memory_reader=read_available_memory):
+        self.max_in_flight = max_in_flight
+        self.min_available = min_available_mb * MB
+        if client_limiter is None:
+            client_limiter = RateLimiter(RATE_LIMIT_PER_CLIENT, RATE_LIMIT_CLIENT_BURST)
+        if key_limiter is None:
+            key_limiter = RateLimiter(RATE_LIMIT_PER_KEY, RATE_LIMIT_KEY_BURST)
+        self.client_limiter = client_limiter
+        self.key_limiter = key_limiter
+        self.api_keys = api_keys
+        self._memory_reader = memory_reader
+        self._memory = None
+        self._memory_at = None
+        self._in_flight = 0
+        self._admitted = 0
+        self._lock = threading.Lock()
+
+    def available_memory(self):
+        now = time.monotonic()
+        if self._memory_at is None or now - self._memory_at > MEMORY_SAMPLE_SECONDS:
+            self._memory = self._memory_reader()
+            self._memory_at = now
+        return self._memory
+
+    def admit(self, client, api_key=None, content_length=None):
+        """Count a request in, or raise Rejected. Every admitted request must be release()d."""
+        if api_key in self.api_keys:
+            limiter, key, reason = self.key_limiter, api_key, 'api_key_rate'
+        else:
+            limiter, key, reason = self.client_limiter, client, 'client_rate'
+        wait = limiter.acquire(key)
+        if wait:
+            raise self._reject(Rejected(429, reason, 'Too many requests, please retry', max(1, math.ceil(wait))))
+
+        with self._lock:
+            if self.max_in_flight and self._in_flight >= self.max_in_flight:
+                rejection = Rejected(503, 'in_flight', 'Server at capacity, please retry', CAPACITY_RETRY_AFTER)
+            elif self.min_available and self._short_of_memory(content_length):
+                rejection = Rejected(503, 'memory', 'Server low on memory, please retry', CAPACITY_RETRY_AFTER)
+            else:
+                self._in_flight += 1
+                self._admitted += 1
+                return
+        limiter.refund(key)
+        raise self._reject(rejection)
+
+    def _short_of_memory(self, content_length):
+        available = self.available_memory()
+        if available is None:
+            return False
+        return available - (content_length or 0) < self.min_available
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+
+    @staticmethod
+    def _reject(rejection):
+        ADMISSION_REJECTIONS.inc(rejection.reason)
+        return rejection
+
+    def stats(self):
+        available = self.available_memory()
+        return {
+            'in_flight': self._in_flight,
+            'max_in_flight': self.max_in_flight,
+            'admitted': self._admitted,
+            'available_memory_mb': round(available / MB, 1) if available is not None else None,
+            'min_available_memory_mb': self.min_available / MB,
+            'tracked_clients': len(self.client_limiter),
+            'tracked_keys': len(self.key_limiter),
+        }
+
+
+def client_address(remote_addr, forwarded_for=None):
+    """The address requests are rate limited by."""
+    if TRUST_FORWARDED_FOR and forwarded_for:
+        return forwarded_for.split(',')[-1].strip()
+    if _internal_streak is not None:
+        _check_proxy(remote_addr)
+    return remote_addr or 'unknown'
+
+
+# Requests in a row from internal addresses; None once a public one was seen or the warning was logged
+_internal_streak = 0
+_internal_lock = threading.Lock()
+
+
+def _is_internal(address):
+    """Private or link-local (a proxy or load balancer in front of the app), but not loopback."""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return (ip.is_private or ip.is_link_local) and not ip.is_loopback
+
+
+def _check_proxy(remote_addr):
+    global _internal_streak
+    internal = remote_addr is not None and _is_internal(remote_addr)
+    with _internal_lock:
+        if _internal_streak is None:
+            return
+        if not internal:
+            _internal_streak = None
+            return
+        _internal_streak += 1
+        if _internal_streak < PROXY_WARNING_REQUESTS:
+            return
+        _internal_streak = None
+    logger.warning("The last %d requests all came from internal addresses (latest %s) and TRUST_FORWARDED_FOR "
+                   "is off: every client behind that proxy shares one rate-limit bucket. Set TRUST_FORWARDED_FOR=1 "
+                   "behind a single trusted proxy.", PROXY_WARNING_REQUESTS, remote_addr)
+
+
+def applies(method, path):
+    return ADMISSION_CONTROL and method == 'POST' and path in ADMISSION_PATHS
+
+
+def rejection_body(rejection):
+    """(JSON payload, extra headers) for a Rejected, as the endpoints answer a full job queue."""
+    return ({'error': str(rejection), 'retry_after': rejection.retry_after},
+            [('Retry-After', str(rejection.retry_after))])
+
+
+# ========================================
+# Process-wide controller
+# ========================================
+_controller = None
+_controller_pid = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Get or create this process's controller (a forked worker starts with its own counts)."""
+    global _controller, _controller_pid
+    if _controller is None or _controller_pid != os.getpid():
+        with _controller_lock:
+            if _controller is None or _controller_pid != os.getpid():
+                _controller = AdmissionController()
+                _controller_pid = os.getpid()
+    return _controller
+
+
+# ========================================
+# Flask integration
+# ========================================
+def install_admission(app):
+    """Admit inference requests in before_request, before Flask reads the body; release on teardown."""
+    from flask import g, jsonify, request
+
+    @app.before_request
+    def _admit_request():
+        if not applies(request.method, request.path) or request.environ.get(ADMITTED_ENVIRON_KEY):
+            return None
+        try:
+            get_admission_controller().admit(
+                client_address(request.remote_addr, request.headers.get('X-Forwarded-For')),
+                request.headers.get(API_KEY_HEADER), request.content_length)
+        except Rejected as e:
+            payload, headers = rejection_body(e)
+            return jsonify(payload), e.status, headers
+        g.admitted = True
+        return None
+
+    @app.teardown_request
+    def _release_request(exc):
+        if g.pop('admitted', False):
+            get_admission_controller().release()
+
+    register_gauges('admission', lambda: get_admission_controller().stats())
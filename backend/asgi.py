@@ -0,0 +1,408 @@
+"""
+ASGI Entry Point
+Serves the backend under an ASGI server so that slow clients and database calls do not
+hold a worker. Request bodies are received with await. Inference runs on a bounded thread
+pool sized to the landmarker pool, so every call gets a warm detector. MongoDB writes and
+the Flask routes run on a separate I/O pool. ASGI_MAX_CONCURRENCY caps the requests one
+process handles at once; later requests wait for a slot. Inference requests pass admission
+control (admission.py) first, from their headers alone, and are refused rather than queued.
+
+/process_image is served natively here, with the same parameters and responses as the
+Flask endpoint. Every other route is passed through to the Flask app in app.py.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8080
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+import asyncio
+import functools
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from dotenv import load_dotenv
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+# A long-lived server: buffer inserts off the request path unless configured otherwise.
+# Must be set before app (and write_behind) is imported.
+load_dotenv()
+if not os.getenv('WRITE_BEHIND_MODE'):
+    os.environ['WRITE_BEHIND_MODE'] = 'buffered'
+
+from admission import (ADMITTED_ENVIRON_KEY, API_KEY_HEADER, Rejected, applies, client_address,
+                       get_admission_controller, rejection_body)
+from app import (app as flask_app, measure_faces_and_store, measure_job, parse_frame_width_mm,
+                 save_face_measurements, save_measurements)
+from jobs import QueueFullError, get_job_queue
+from landmark_payload import BINARY_MIMETYPE, binary_body, build_faces_payload, build_payload, parse_options
+from landmarker_pool import warm_pools
+from measurement_logic import analyze_faces, analyze_image
+from metrics import ERRORS, METRICS_ENABLED, REQUEST_SECONDS, REQUESTS, register_gauges, span
+from request_io import UploadError, UploadParser, cors_origin, max_body_bytes
+
+# Requests handled at once per process; the rest wait for a slot
+ASGI_MAX_CONCURRENCY = int(os.getenv('ASGI_MAX_CONCURRENCY', '32'))
+
+# Threads running inference. Defaults to the landmarker pool size, so no call waits for a detector.
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', os.getenv('LANDMARKER_POOL_SIZE', '2')))
+
+# Threads for blocking I/O: MongoDB writes and the Flask routes (history, login, ...)
+IO_WORKERS = int(os.getenv('IO_WORKERS', '8'))
+
+# Metrics label for the native endpoint; matches the Flask endpoint's name
+PROCESS_IMAGE_ENDPOINT = 'process_image_endpoint'
+
+logger = logging.getLogger(__name__)
+
+_executors = None
+_executors_pid = None
+_executors_lock = threading.Lock()
+_slots = None
+_stats = {'in_flight': 0, 'waiting': 0}
+
+
+def _executor(kind):
+    """The 'inference' or 'io' thread pool of this process (rebuilt after a fork)."""
+    global _executors, _executors_pid
+    with _executors_lock:
+        if _executors is None or _executors_pid != os.getpid():
+            _executors = {
+                'inference': ThreadPoolExecutor(max(1, INFERENCE_WORKERS), thread_name_prefix='inference'),
+                'io': ThreadPoolExecutor(max(1, IO_WORKERS), thread_name_prefix='asgi-io'),
+            }
+            _executors_pid = os.getpid()
+        return _executors[kind]
+
+
+async def run_in(kind, fn, *args, **kwargs):
+    """Await fn(*args, **kwargs) on one of the thread pools."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor(kind), functools.partial(fn, *args, **kwargs))
+
+
+def asgi_stats():
+    stats = dict(_stats, max_concurrency=ASGI_MAX_CONCURRENCY)
+    if _executors is not None and _executors_pid == os.getpid():
+        for kind, executor in _executors.items():
+            stats[f'{kind}_queued'] = executor._work_queue.qsize()
+    return stats
+
+
+register_gauges('asgi', asgi_stats)
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    global _slots
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    native = scope['path'] == '/process_image' and scope['method'] == 'POST'
+    admitted = applies(scope['method'], scope['path'])
+    if admitted:
+        # Inference requests are turned away here, before waiting for a slot or receiving the body
+        rejection = admit(scope)
+        if rejection is not None:
+            await _send_response(send, *rejection)
+            return
+
+    if _slots is None:
+        _slots = asyncio.Semaphore(ASGI_MAX_CONCURRENCY)
+    acquired = False
+    try:
+        # A request cancelled while it waits for a slot must still give back its admission
+        _stats['waiting'] += 1
+        try:
+            await _slots.acquire()
+        finally:
+            _stats['waiting'] -= 1
+        acquired = True
+        _stats['in_flight'] += 1
+        if native:
+            await process_image(scope, receive, send)
+        else:
+            await call_flask(scope, receive, send, admitted)
+    finally:
+        if acquired:
+            _stats['in_flight'] -= 1
+            _slots.release()
+        if admitted:
+            get_admission_controller().release()
+
+
+def admit(scope):
+    """Admit an inference request: None, or the 429/503 response to send instead."""
+    headers = _headers(scope)
+    client = scope.get('client')
+    try:
+        get_admission_controller().admit(client_address(client[0] if client else None,
+                                                        headers.get('x-forwarded-for')),
+                                         headers.get(API_KEY_HEADER.lower()), _content_length(headers))
+    except Rejected as e:
+        payload, extra = rejection_body(e)
+        if METRICS_ENABLED:
+            # Labelled as the Flask endpoints are (process_image_endpoint, process_batch_endpoint, ...)
+            endpoint = f"{scope['path'].lstrip('/')}_endpoint"
+            REQUESTS.inc(endpoint, str(e.status))
+            ERRORS.inc(endpoint, 'server' if e.status >= 500 else 'client')
+        return _json(e.status, payload, extra + _cors(headers))
+    return None
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Build the detectors before taking traffic, as gunicorn's post_fork does
+            await run_in('inference', warm_pools)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _executors is not None:
+                for executor in _executors.values():
+                    executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+# ========================================
+# Native /process_image
+# ========================================
+async def process_image(scope, receive, send):
+    """Await the upload, run inference on the inference pool and the database insert on the I/O pool."""
+    start = time.perf_counter()
+    result = await _process_image(scope, receive)
+    if result is None:
+        # The client disconnected before sending the whole upload
+        return
+    status, content_type, body, headers = result
+    headers = headers + _cors(_headers(scope))
+    elapsed = time.perf_counter() - start
+    if METRICS_ENABLED:
+        REQUEST_SECONDS.observe(elapsed, PROCESS_IMAGE_ENDPOINT)
+        REQUESTS.inc(PROCESS_IMAGE_ENDPOINT, str(status))
+        if status >= 400:
+            ERRORS.inc(PROCESS_IMAGE_ENDPOINT, 'server' if status >= 500 else 'client')
+        headers = headers + [('Server-Timing', f'total;dur={elapsed * 1000:.2f}')]
+    await _send_response(send, status, content_type, body, headers)
+
+
+async def _process_image(scope, receive):
+    """(status, content type, body, extra headers) for a /process_image request, or None on disconnect."""
+    headers = _headers(scope)
+    args = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    try:
+        parser = UploadParser(headers.get('content-type'), _content_length(headers), 'image',
+                              validators={'frame_width_mm': parse_frame_width_mm}, required=('frame_width_mm',))
+        # A bad field or image header is rejected as soon as its bytes arrive
+        with span('parse_upload'):
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return None
+                parser.feed(message.get('body', b''))
+                if not message.get('more_body', False):
+                    break
+            upload = parser.finish()
+    except UploadError as e:
+        logger.warning("Upload rejected: %s", e)
+        return _json(e.status, {'error': str(e)})
+
+    frame_width_mm = upload.values['frame_width_mm']
+    # Query string first, form fields override it, as in the Flask endpoint
+    values = {**args, **upload.fields}
+    user_id = values.get('user_id', None)
+    user_name = values.get('user_name', None)
+    user_phone = values.get('user_phone', None)
+
+    try:
+        accept = parse_accept_header(headers.get('accept'), MIMEAccept)
+        landmark_options = parse_options(values, accept)
+    except ValueError as e:
+        return _json(400, {'error': str(e)})
+
+    multi_face = values.get('multi_face') == '1'
+
+    if values.get('async') == '1':
+        job_options = dict(landmark_options, encoding='base64')
+        try:
+            job_id = get_job_queue().submit(measure_faces_and_store if multi_face else measure_job,
+                                            upload.file.getvalue(), frame_width_mm,
+                                            user_id, user_name, user_phone, job_options)
+        except QueueFullError as e:
+            logger.warning("Measurement queue full, rejecting request.")
+            return _json(429, {'error': 'Server busy, please retry', 'retry_after': e.retry_after},
+                         [('Retry-After', str(e.retry_after))])
+        logger.info("Queued measurement job %s", job_id)
+        return _json(202, {'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'},
+                     [('Location', f'/jobs/{job_id}')])
+
+    try:
+        logger.info("Analyzing image with frame width: %smm", frame_width_mm)
+        if multi_face:
+            faces, frame_dims = await run_in('inference', analyze_faces, upload.file, frame_width_mm=frame_width_mm)
+            if user_id:
+                await run_in('io', save_face_measurements, faces, frame_width_mm, user_id, user_name, user_phone,
+                             frame_dims)
+            with span('encode_landmarks'):
+                payload = build_faces_payload(faces, frame_dims, landmark_options)
+            with span('serialize'):
+                return _json(200, payload)
+
+        measurements, landmarks, frame_dims = await run_in('inference', analyze_image, upload.file,
+                                                           frame_width_mm=frame_width_mm)
+        if user_id:
+            await run_in('io', save_measurements, measurements, frame_width_mm, user_id, user_name, user_phone,
+                         landmarks, frame_dims)
+        with span('encode_landmarks'):
+            payload, raw = build_payload(measurements, landmarks, frame_dims, landmark_options)
+        with span('serialize'):
+            if raw is None:
+                return _json(200, payload)
+            return 200, BINARY_MIMETYPE, binary_body(payload, raw), []
+    except Exception as e:
+        logger.error(f"Analysis failed for {upload.filename}: {e}", exc_info=True)
+        return _json(500, {'error': f"Analysis Failed: {e}"})
+
+
+def _json(status, payload, headers=None):
+    body = json.dumps(payload, separators=(',', ':')).encode('utf-8') + b'\n'
+    return status, 'application/json', body, headers or []
+
+
+def _cors(headers):
+    """The CORS headers flask_cors adds to the Flask routes (see request_io.configure_app)."""
+    origin = cors_origin(headers.get('origin'))
+    if origin is None:
+        return []
+    extra = [('Access-Control-Allow-Origin', origin), ('Access-Control-Expose-Headers', 'Retry-After')]
+    if origin != '*':
+        extra.append(('Vary', 'Origin'))
+    return extra
+
+
+async def _send_response(send, status, content_type, body, headers):
+    header_list = [(b'content-type', content_type.encode('latin-1')),
+                   (b'content-length', str(len(body)).encode('latin-1'))]
+    header_list += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    await send({'type': 'http.response.start', 'status': status, 'headers': header_list})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _headers(scope):
+    return {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope.get('headers', [])}
+
+
+def _content_length(headers):
+    try:
+        return int(headers['content-length'])
+    except (KeyError, ValueError):
+        return None
+
+
+# ========================================
+# Flask Passthrough
+# ========================================
+async def call_flask(scope, receive, send, admitted=False):
+    """
+    Run a Flask route on the I/O pool. The body is received first, so the route never waits on
+    the client; response chunks (e.g. the streamed /history page) are sent as the route yields them.
+    `admitted` tells the Flask admission hook that app() has already admitted the request.
+    """
+    limit = max_body_bytes(scope['path'])
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+        body += message.get('body', b'')
+        if len(body) > limit:
+            await _send_response(send, 413, 'application/json',
+                                 json.dumps({'error': f"Upload larger than {limit} bytes"}).encode(),
+                                 _cors(_headers(scope)))
+            return
+        if not message.get('more_body', False):
+            break
+
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    environ = _wsgi_environ(scope, bytes(body))
+    environ[ADMITTED_ENVIRON_KEY] = admitted
+    done = loop.run_in_executor(_executor('io'), _run_wsgi, environ, loop, events)
+    while True:
+        kind, value = await events.get()
+        if kind == 'start':
+            status, headers = value
+            await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                        'headers': [(name.lower().encode('latin-1'), header.encode('latin-1'))
+                                    for name, header in headers]})
+        elif kind == 'body':
+            await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+        else:
+            break
+    # Re-raises anything the WSGI call raised outside Flask's own error handling
+    await done
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def _run_wsgi(environ, loop, events):
+    """Call the Flask app and iterate its response in one thread (Flask's request context is per thread)."""
+    def emit(kind, value=None):
+        loop.call_soon_threadsafe(events.put_nowait, (kind, value))
+
+    def start_response(status, headers, exc_info=None):
+        emit('start', (status, headers))
+        return lambda data: emit('body', data)
+
+    try:
+        response = flask_app(environ, start_response)
+        try:
+            for chunk in response:
+                if chunk:
+                    emit('body', chunk)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+    finally:
+        emit('end')
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif key != 'CONTENT_LENGTH':
+            key = f'HTTP_{key}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
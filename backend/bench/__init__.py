@@ -0,0 +1 @@
+"""Benchmarks for the measurement backend. See bench/common.py for usage."""
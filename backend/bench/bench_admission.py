@@ -0,0 +1,203 @@
+"""
+Admission control load test: latency of /process_image on the ASGI app (asgi.py, called
+in-process) when requests arrive faster than inference can serve them, with admission
+control off and on.
+
+Requests arrive open-loop (Poisson, each from its own client address) at multiples of the
+capacity, INFERENCE_WORKERS / service time. Without admission control they queue for a
+concurrency slot and an inference thread, so latency grows with the backlog for as long as
+the overload lasts. With it, requests over MAX_INFLIGHT_INFERENCE get an immediate 503 and
+admitted ones keep a bounded latency. The flood scenario adds one client sending at a
+multiple of capacity next to normal traffic; its per-client token bucket turns it away with 429.
+
+Inference is a --service-ms sleep by default, so the queueing is measured and not the model;
+--model runs the real pipeline on a sample MP4 frame.
+
+    python -m bench.bench_admission --load 0.5 1 2 4 --seconds 5
+    python -m bench.bench_admission --model --load 2 --seconds 10
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+
+from bench.bench_serving import BOUNDARY, upload_body
+from bench.common import encode_jpeg, sample_frames, summarize
+
+FRAME_DIMS = {'width': 1280, 'height': 720}
+FLOOD_CLIENT = '192.0.2.1'
+
+
+def simulated_inference(service_ms):
+    """Stand-in for analyze_image holding an inference thread for `service_ms`."""
+    landmarks = np.zeros((478, 3), dtype=np.float32)
+
+    def analyze_image(source, frame_width_mm=None):
+        source.read()
+        time.sleep(service_ms / 1000)
+        return {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0}, landmarks, FRAME_DIMS
+
+    return analyze_image
+
+
+def service_time_ms(analyze_image, image, calls=5):
+    """Median time of one analyze_image call, after a warm-up call."""
+    analyze_image(io.BytesIO(image), frame_width_mm=140.0)
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        analyze_image(io.BytesIO(image), frame_width_mm=140.0)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+async def post(app, body, client):
+    """(status, latency ms) of one /process_image request sent straight to the ASGI app."""
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/process_image', 'query_string': b'',
+        'http_version': '1.1', 'scheme': 'http', 'server': ('127.0.0.1', 8080), 'client': (client, 40000),
+        'headers': [(b'host', b'bench'), (b'content-length', str(len(body)).encode()),
+                    (b'content-type', f'multipart/form-data; boundary={BOUNDARY}'.encode())],
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop() if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    return sent[0]['status'], (time.perf_counter() - start) * 1000
+
+
+def arrivals(rate, seconds, rng):
+    """Poisson arrival times (s) at `rate` per second over `seconds`."""
+    times, t = [], 0.0
+    while rate > 0:
+        t += rng.exponential(1 / rate)
+        if t >= seconds:
+            break
+        times.append(t)
+    return times
+
+
+def client_address(i):
+    return f'10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}'
+
+
+def outcome(results, elapsed):
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    served = [latency for status, latency in results if status == 200]
+    rejected = [latency for status, latency in results if status in (429, 503)]
+    report = {'requests': len(results), 'status_codes': dict(sorted(statuses.items())),
+              'goodput_per_sec': round(len(served) / elapsed, 2)}
+    if served:
+        report['served_latency'] = summarize(served)
+    if rejected:
+        report['rejection_latency'] = summarize(rejected)
+    return report
+
+
+async def run_load(app, body, rate, seconds, flood_rate=0.0, seed=0):
+    """Offer `rate` req/s from distinct clients (plus `flood_rate` from one client); report per traffic kind."""
+    rng = np.random.default_rng(seed)
+    schedule = [(t, client_address(i), 'clients') for i, t in enumerate(arrivals(rate, seconds, rng))]
+    schedule += [(t, FLOOD_CLIENT, 'flood') for t in arrivals(flood_rate, seconds, rng)]
+    schedule.sort()
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+    for t, client, kind in schedule:
+        delay = start + t - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append((kind, asyncio.ensure_future(post(app, body, client))))
+    results = {}
+    for kind, task in tasks:
+        results.setdefault(kind, []).append(await task)
+    elapsed = loop.time() - start
+    return {kind: outcome(kind_results, elapsed) for kind, kind_results in results.items()}
+
+
+def configure_admission(enabled, max_in_flight):
+    """Switch admission control and give this process a fresh controller (empty buckets, no requests)."""
+    import admission
+
+    admission.ADMISSION_CONTROL = enabled
+    admission._controller = admission.AdmissionController(max_in_flight=max_in_flight)
+    admission._controller_pid = os.getpid()
+
+
+async def scenarios(app, body, capacity, args):
+    report = {'overload': [], 'flood': {}}
+    for load in args.load:
+        row = {'load': load, 'offered_per_sec': round(load * capacity, 2)}
+        for mode in ('off', 'on'):
+            configure_admission(mode == 'on', args.max_in_flight)
+            row[f'admission_{mode}'] = (await run_load(app, body, load * capacity, args.seconds))['clients']
+        report['overload'].append(row)
+
+    report['flood']['clients_per_sec'] = round(0.5 * capacity, 2)
+    report['flood']['flood_per_sec'] = round(args.flood * capacity, 2)
+    for mode in ('off', 'on'):
+        configure_admission(mode == 'on', args.max_in_flight)
+        report['flood'][f'admission_{mode}'] = await run_load(app, body, 0.5 * capacity, args.seconds,
+                                                              flood_rate=args.flood * capacity)
+    return report
+
+
+def main():
+    import admission
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--load', type=float, nargs='+', default=[0.5, 1, 2, 4],
+                        help='offered load as multiples of capacity')
+    parser.add_argument('--seconds', type=float, default=5, help='duration of each run')
+    parser.add_argument('--service-ms', type=float, default=50, help='simulated inference time')
+    parser.add_argument('--model', action='store_true', help='run the real pipeline instead of a sleep')
+    parser.add_argument('--max-in-flight', type=int, default=admission.MAX_INFLIGHT_INFERENCE)
+    parser.add_argument('--flood', type=float, default=3, help='flood client rate as a multiple of capacity')
+    args = parser.parse_args()
+
+    # No database writes and no background connection attempts while timing
+    os.environ['MONGODB_URI'] = ''
+    import asgi
+    from bench.bench_pipeline import disable_result_cache
+
+    image = encode_jpeg(sample_frames(1)[0])
+    if args.model:
+        disable_result_cache()
+    else:
+        asgi.analyze_image = simulated_inference(args.service_ms)
+    service_ms = service_time_ms(asgi.analyze_image, image)
+    capacity = asgi.INFERENCE_WORKERS * 1000 / service_ms
+
+    report = {
+        'benchmark': 'admission',
+        'inference': 'model' if args.model else 'simulated',
+        'service_ms': round(service_ms, 2),
+        'inference_workers': asgi.INFERENCE_WORKERS,
+        'capacity_per_sec': round(capacity, 2),
+        'max_in_flight': args.max_in_flight,
+        'asgi_max_concurrency': asgi.ASGI_MAX_CONCURRENCY,
+        'rate_limit_per_client': [admission.RATE_LIMIT_PER_CLIENT, admission.RATE_LIMIT_CLIENT_BURST],
+        'seconds': args.seconds,
+    }
+    report.update(asyncio.run(scenarios(asgi.app, upload_body(image), capacity, args)))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Throughput benchmark: analyze_images images/sec against the number of worker processes.
+
+    python -m bench.bench_batch --images 32 --workers 1 2 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import measurement_logic
+from bench.common import sample_frames
+
+
+def run(images, workers):
+    context = multiprocessing.get_context(measurement_logic.MEASUREMENT_MP_START)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=measurement_logic._init_worker) as executor:
+        # Warm every worker before timing so model load is excluded
+        measurement_logic.analyze_images(images[:workers], 60.0, executor=executor)
+        start = time.perf_counter()
+        results = measurement_logic.analyze_images(images, 60.0, executor=executor)
+        elapsed = time.perf_counter() - start
+    return {
+        'workers': workers,
+        'images': len(images),
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(len(images) / elapsed, 2),
+        'failed': sum(1 for r in results if not r['success']),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--images', type=int, default=32)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, max(1, (os.cpu_count() or 1) // 2), os.cpu_count() or 1}))
+    args = parser.parse_args()
+
+    frames = sample_frames(min(args.images, 11))
+    images = [frames[i % len(frames)] for i in range(args.images)]
+
+    rows = [run(images, workers) for workers in args.workers]
+    baseline = rows[0]['images_per_sec']
+    for row in rows:
+        row['scaling'] = round(row['images_per_sec'] / baseline, 2) if baseline else None
+
+    print(json.dumps({'benchmark': 'batch', 'cpu_count': os.cpu_count(), 'runs': rows}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Upload decode benchmark: temp-file round trip vs. in-memory decode under concurrent load.
+
+    python -m bench.bench_decode_path --requests 200 --concurrency 8 [--inference]
+"""
+
+import argparse
+import io
+import json
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import encode_jpeg, sample_frames, summarize
+from measurement_logic import analyze_image, load_image_rgb
+
+
+def read_proc_io():
+    """Return this process's I/O counters from /proc (Linux only), or an empty dict."""
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def via_temp_file(payload, handler):
+    # Mirrors the previous endpoint: save upload to /tmp, reopen by path, delete
+    image_path = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()) + '.jpg')
+    with open(image_path, 'wb') as f:
+        f.write(payload)
+    try:
+        handler(image_path)
+    finally:
+        os.remove(image_path)
+
+
+def in_memory(payload, handler):
+    handler(io.BytesIO(payload))
+
+
+def run(mode, payload, handler, requests, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        mode(payload, handler)
+        return (time.perf_counter() - start) * 1000
+
+    io_before = read_proc_io()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    io_after = read_proc_io()
+
+    result = summarize(latencies)
+    result['requests_per_sec'] = round(requests / elapsed, 2)
+    result['io'] = {key: io_after[key] - io_before[key]
+                    for key in ('wchar', 'syscr', 'syscw', 'write_bytes') if key in io_after}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--inference', action='store_true',
+                        help='run the full analyze_image instead of decode only')
+    args = parser.parse_args()
+
+    payload = encode_jpeg(sample_frames(1)[0])
+    handler = (lambda src: analyze_image(src, 60.0)) if args.inference else load_image_rgb
+
+    print(json.dumps({
+        'benchmark': 'decode_path',
+        'payload_bytes': len(payload),
+        'concurrency': args.concurrency,
+        'stage': 'analyze_image' if args.inference else 'decode',
+        'temp_file': run(via_temp_file, payload, handler, args.requests, args.concurrency),
+        'in_memory': run(in_memory, payload, handler, args.requests, args.concurrency),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Frame-quality benchmark on a synthetic frame set: cost of the pre-inference blur check
+and of vectorized landmark scoring, and how well each check matches the synthetic labels.
+
+    python -m bench.bench_frame_quality --frames 1000
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+import frame_quality
+
+def synthetic_landmarks(frames, rng):
+    """Open-eyed frontal faces, a third with closed eyes and a third with turned heads."""
+    faces = rng.uniform(0.3, 0.7, size=(frames, 478, 3)).astype(np.float32)
+    faces[:, frame_quality.LEFT_EYE, 0] = 0.40
+    faces[:, frame_quality.RIGHT_EYE, 0] = 0.60
+    faces[:, frame_quality.NOSE_TIP, 0] = 0.50 + rng.normal(0, 0.003, frames)
+    for top, bottom in ((frame_quality.LEFT_EYE_TOP, frame_quality.LEFT_EYE_BOTTOM),
+                        (frame_quality.RIGHT_EYE_TOP, frame_quality.RIGHT_EYE_BOTTOM)):
+        faces[:, top, 1] = 0.45
+        faces[:, bottom, 1] = 0.47
+    labels = np.array([''] * frames, dtype=object)
+    closed = np.arange(frames) % 3 == 1
+    turned = np.arange(frames) % 3 == 2
+    faces[closed, frame_quality.LEFT_EYE_BOTTOM, 1] = 0.455
+    faces[turned, frame_quality.NOSE_TIP, 0] = 0.56
+    labels[closed] = 'eyes_closed'
+    labels[turned] = 'head_turned'
+    return faces, labels
+
+
+def synthetic_crops(count, rng):
+    """Textured 256x256 face-sized crops, every other one Gaussian-blurred."""
+    crops, labels = [], []
+    for i in range(count):
+        # Detail at several scales, roughly like skin, lashes and hair in a face crop
+        texture = sum(np.kron(rng.uniform(0, 255 / 3, size=(256 // k, 256 // k, 3)), np.ones((k, k, 1)))
+                      for k in (2, 8, 32))
+        crop = Image.fromarray(texture.astype(np.uint8))
+        blurred = i % 2 == 1
+        if blurred:
+            crop = crop.filter(ImageFilter.GaussianBlur(4))
+        crops.append(np.asarray(crop))
+        labels.append(blurred)
+    return crops, np.array(labels)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--crops', type=int, default=20)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    faces, labels = synthetic_landmarks(args.frames, rng)
+    start = time.perf_counter()
+    scores = frame_quality.score_landmarks(faces)
+    stacked_us = (time.perf_counter() - start) / args.frames * 1e6
+
+    crops, blurred = synthetic_crops(args.crops, rng)
+    start = time.perf_counter()
+    sharpness = np.array([frame_quality.sharpness(crop) for crop in crops])
+    sharpness_us = (time.perf_counter() - start) / len(crops) * 1e6
+    flagged = sharpness < frame_quality.MIN_SHARPNESS
+
+    print(json.dumps({
+        'benchmark': 'frame_quality',
+        'landmark_scoring': {
+            'frames': args.frames,
+            'us_per_frame': round(stacked_us, 3),
+            'label_agreement': float(np.mean(scores['reason'] == labels.astype(str))),
+        },
+        'blur_check': {
+            'crops': len(crops),
+            'us_per_crop': round(sharpness_us, 1),
+            'threshold': frame_quality.MIN_SHARPNESS,
+            'sharp_median': float(np.median(sharpness[~blurred])) if (~blurred).any() else None,
+            'blurred_median': float(np.median(sharpness[blurred])) if blurred.any() else None,
+            'label_agreement': float(np.mean(flagged == blurred)),
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+/history benchmark: the previous whole-collection read against keyset pages, on a
+seeded mongomock collection (pip install mongomock) or a real MongoDB via --uri.
+
+    python -m bench.bench_history --records 5000
+    python -m bench.bench_history --uri mongodb://localhost:27017 --records 50000
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+import history
+from storage import MongoCollection
+
+
+def legacy_history(collection):
+    """The previous /history body: whole collection, every field, one payload."""
+    records = []
+    for m in list(collection.find().sort('created_at', -1)):
+        records.append({
+            'id': str(m['_id']),
+            'user_id': m.get('user_id'),
+            'user_name': m.get('user_name', 'Unknown'),
+            'user_phone': m.get('user_phone', 'N/A'),
+            'frame_width_mm': m.get('frame_width_mm'),
+            'measurements': m.get('measurements', {}),
+            'created_at': m.get('created_at').isoformat() if m.get('created_at') else None,
+        })
+    return json.dumps({'success': True, 'history': records, 'count': len(records)})
+
+
+def paged_history(collection, args):
+    """Consume one streamed page and return (body, next_cursor)."""
+    body = ''.join(history.stream_history(MongoCollection(collection), args))
+    return body, json.loads(body)['next_cursor']
+
+
+def measure(fn):
+    """Run fn once and return (result, milliseconds, peak traced KiB)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = (time.perf_counter() - start) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, round(elapsed, 2), round(peak / 1024, 1)
+
+
+def seed(collection, records):
+    base = datetime(2025, 1, 1)
+    batch = []
+    for i in range(records):
+        batch.append({
+            '_id': ObjectId(),
+            'user_id': f'user-{i % 500}',
+            'user_name': f'Customer {i}',
+            'user_phone': '9999999999',
+            'frame_width_mm': 140.0,
+            'measurements': {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0},
+            'landmarks': [[0.5, 0.5, 0.0]] * 478,
+            'created_at': base + timedelta(seconds=i),
+        })
+        if len(batch) == 1000:
+            collection.insert_many(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--limit', type=int, default=history.HISTORY_PAGE_SIZE)
+    parser.add_argument('--uri', help='benchmark a real MongoDB instead of mongomock')
+    args = parser.parse_args()
+
+    if args.uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.uri)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            raise SystemExit("mongomock is not installed: pip install mongomock, or pass --uri")
+        client = mongomock.MongoClient()
+    collection = client.bench_advance_filter.measurements
+    collection.drop()
+    seed(collection, args.records)
+    collection.create_index([('created_at', -1), ('_id', -1)])
+    collection.create_index([('user_id', 1), ('created_at', -1), ('_id', -1)])
+
+    report = {'benchmark': 'history', 'backend': 'mongodb' if args.uri else 'mongomock',
+              'records': args.records, 'limit': args.limit}
+
+    body, ms, kib = measure(lambda: legacy_history(collection))
+    report['legacy_full'] = {'ms': ms, 'peak_kib': kib, 'bytes': len(body)}
+
+    (body, cursor), ms, kib = measure(lambda: paged_history(collection, {'limit': args.limit}))
+    report['first_page'] = {'ms': ms, 'peak_kib': kib, 'bytes': len(body)}
+
+    # Walk nine pages in, then time the tenth: keyset pages cost the same at any depth
+    for _ in range(8):
+        if cursor:
+            _, cursor = paged_history(collection, {'limit': args.limit, 'cursor': cursor})
+    if cursor:
+        (body, _), ms, kib = measure(lambda: paged_history(collection, {'limit': args.limit, 'cursor': cursor}))
+        report['tenth_page'] = {'ms': ms, 'peak_kib': kib, 'bytes': len(body)}
+
+    (body, _), ms, kib = measure(lambda: paged_history(
+        collection, {'limit': args.limit, 'user_id': 'user-7', 'fields': 'measurements,created_at'}))
+    report['user_page_projected'] = {'ms': ms, 'peak_kib': kib, 'bytes': len(body)}
+
+    collection.drop()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
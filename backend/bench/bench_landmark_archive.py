@@ -0,0 +1,134 @@
+"""
+Landmark archive benchmark: bytes per record and load time of landmarks kept in the
+landmark archive (int16 and float16 slots, memory-mapped) against the same landmarks stored
+as JSON lists inside the MongoDB record (BSON-decoded and turned back into an array).
+Also the append rate and the measurement error the quantization introduces.
+
+    python -m bench.bench_landmark_archive --records 5000 --reads 2000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import bson
+import numpy as np
+from bson import ObjectId
+
+from bench.bench_measurement_kernel import synthetic_faces
+from landmark_archive import FORMATS, LandmarkArchive
+from measurement_logic import compute_measurements
+
+FRAME_DIMS = {'width': 1280, 'height': 720}
+FRAME_WIDTH_MM = 140.0
+
+# Where the measured landmarks sit on a frontal face filling about a third of the frame
+# (normalized x, y): references, pupils, lower lid, forehead, chin, nose tip
+FACE_TEMPLATE = {127: (0.36, 0.45), 356: (0.64, 0.45), 468: (0.44, 0.44), 473: (0.56, 0.44),
+                 27: (0.56, 0.47), 10: (0.50, 0.25), 152: (0.50, 0.78), 1: (0.50, 0.55)}
+
+
+def faces_with_geometry(records, seed=0):
+    """Synthetic faces whose measured landmarks are where a real face has them, with some jitter."""
+    rng = np.random.default_rng(seed)
+    faces = synthetic_faces(records, seed)
+    for index, (x, y) in FACE_TEMPLATE.items():
+        faces[:, index, :2] = np.array([x, y]) + rng.normal(0, 0.01, (records, 2))
+    return faces
+
+
+def per_read_us(fn, keys):
+    start = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return round((time.perf_counter() - start) / len(keys) * 1e6, 2)
+
+
+def error_stats(errors):
+    errors = np.abs(errors)
+    return {'mean': float(errors.mean()), 'max': float(errors.max())}
+
+
+def bson_records(faces, ids):
+    """The measurement documents as MongoDB would hold them with a 'landmarks' list of lists."""
+    return [bson.encode({'_id': _id, 'user_id': 'user-1', 'frame_width_mm': FRAME_WIDTH_MM,
+                         'measurements': {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0},
+                         'landmarks': face.tolist(), 'frameDimensions': FRAME_DIMS})
+            for _id, face in zip(ids, faces)]
+
+
+def json_lists(faces, ids, reads, rng):
+    documents = bson_records(faces, ids)
+    without = len(bson.encode({'_id': ids[0], 'user_id': 'user-1', 'frame_width_mm': FRAME_WIDTH_MM,
+                               'measurements': {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0}}))
+    picks = rng.integers(0, len(documents), reads)
+    return {
+        'bytes_per_record': round(float(np.mean([len(document) for document in documents])) - without, 1),
+        'json_text_bytes': len(json.dumps(faces[0].tolist())),
+        'load_us': per_read_us(
+            lambda i: np.asarray(bson.decode(documents[i])['landmarks'], dtype=np.float32), picks),
+    }
+
+
+def archive_runs(fmt, faces, ids, reads, rng):
+    with tempfile.TemporaryDirectory() as directory:
+        archive = LandmarkArchive(directory, fmt)
+        # One record at a time, as the request path appends
+        start = time.perf_counter()
+        for _id, face in zip(ids, faces):
+            archive.append(_id, face, FRAME_DIMS)
+        append_s = time.perf_counter() - start
+
+        picks = rng.integers(0, len(faces), reads)
+        # A fresh handle: lookups start from an unmapped file and an empty index
+        archive = LandmarkArchive(directory)
+        start = time.perf_counter()
+        archive.slot_of(ids[-1])
+        index_ms = (time.perf_counter() - start) * 1000
+        lookups = [ids[i] for i in picks]
+
+        start = time.perf_counter()
+        decoded, _, _ = archive.decode(archive.slots()[:])
+        bulk_s = time.perf_counter() - start
+
+        reference = compute_measurements(faces, FRAME_DIMS['width'], FRAME_DIMS['height'], FRAME_WIDTH_MM)
+        stored = compute_measurements(decoded, FRAME_DIMS['width'], FRAME_DIMS['height'], FRAME_WIDTH_MM)
+        result = {
+            'bytes_per_record': archive.dtype.itemsize,
+            'file_mb': round(os.path.getsize(archive.path) / 1e6, 2),
+            'appends_per_s': round(len(faces) / append_s, 1),
+            'index_build_ms': round(index_ms, 2),
+            'slot_of_us': per_read_us(archive.slot_of, lookups),
+            'view_us': per_read_us(archive.record, picks),
+            'load_us': per_read_us(archive.read, picks),
+            'bulk_decode_records_per_s': round(len(faces) / bulk_s, 1),
+            'max_abs_error': float(np.abs(decoded - faces).max()),
+            'pd_error_mm': error_stats(stored['pd'] - reference['pd']),
+            'fh_error_mm': error_stats(stored['fh'] - reference['fh']),
+        }
+        archive.close()
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--reads', type=int, default=2000, help='random single-record loads per store')
+    args = parser.parse_args()
+
+    faces = faces_with_geometry(args.records)
+    ids = [ObjectId() for _ in range(args.records)]
+    report = {
+        'benchmark': 'landmark_archive',
+        'records': args.records,
+        'mongodb_json_lists': json_lists(faces, ids, args.reads, np.random.default_rng(0)),
+    }
+    for fmt in FORMATS:
+        report[f'archive_{fmt}'] = archive_runs(fmt, faces, ids, args.reads, np.random.default_rng(0))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
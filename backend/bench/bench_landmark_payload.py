@@ -0,0 +1,76 @@
+"""
+Landmark payload benchmark: response size, serialization time and round-trip error for
+each landmark format, subset and encoding of /process_image.
+
+    python -m bench.bench_landmark_payload --repeat 200
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import struct
+
+import numpy as np
+
+from bench.bench_measurement_kernel import FRAME_HEIGHT, FRAME_WIDTH, synthetic_faces
+from bench.common import summarize, time_calls
+from landmark_payload import FORMATS, SUBSETS, VIEWER_LANDMARKS, binary_body, build_payload, dequantize
+
+MEASUREMENTS = {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0}
+FRAME_DIMS = {'width': FRAME_WIDTH, 'height': FRAME_HEIGHT}
+
+
+def serialize(landmarks, options):
+    """The response body /process_image sends for these options."""
+    payload, raw = build_payload(MEASUREMENTS, landmarks, FRAME_DIMS, options)
+    if raw is None:
+        return json.dumps(payload).encode('utf-8')
+    return binary_body(payload, raw)
+
+
+def decode(body, options):
+    """Landmarks as the client reconstructs them, in float64."""
+    if options['encoding'] == 'binary':
+        (header_length,) = struct.unpack_from('<I', body)
+        payload = json.loads(body[4:4 + header_length])
+        return dequantize(payload['landmarks'], body[4 + header_length:])
+    landmarks = json.loads(body)['landmarks']
+    if options['format'] == 'json':
+        return np.asarray(landmarks, dtype=np.float64)
+    return dequantize(landmarks, base64.b64decode(landmarks['data']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    landmarks = synthetic_faces(1)[0]
+    variants = [{'format': fmt, 'subset': subset, 'encoding': 'base64'} for fmt in FORMATS for subset in SUBSETS]
+    variants += [{'format': fmt, 'subset': subset, 'encoding': 'binary'}
+                 for fmt in FORMATS if fmt != 'json' for subset in SUBSETS]
+
+    rows = []
+    for options in variants:
+        body = serialize(landmarks, options)
+        reference = landmarks if options['subset'] == 'all' else landmarks[VIEWER_LANDMARKS]
+        error_px = np.abs(decode(body, options) - reference)[:, :2] * [FRAME_WIDTH, FRAME_HEIGHT]
+        rows.append({
+            **options,
+            'bytes': len(body),
+            'gzip_bytes': len(gzip.compress(body)),
+            'serialize': summarize(time_calls(lambda: serialize(landmarks, options), args.repeat)),
+            'max_error_px': round(float(error_px.max()), 4),
+        })
+
+    baseline = rows[0]['bytes']
+    for row in rows:
+        row['size_vs_json'] = round(row['bytes'] / baseline, 3)
+
+    print(json.dumps({'benchmark': 'landmark_payload', 'landmarks': len(landmarks),
+                      'repeat': args.repeat, 'variants': rows}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Latency benchmark: cold per-call FaceLandmarker construction vs. pooled warm detectors.
+
+    python -m bench.bench_landmarker_pool --repeat 20
+"""
+
+import argparse
+import json
+
+import mediapipe as mp
+
+from bench.common import sample_frames, summarize, time_calls
+from landmarker_pool import LandmarkerPool
+from measurement_logic import create_landmarker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    image_rgb = sample_frames(1)[0]
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=image_rgb)
+
+    def cold_call():
+        detector = create_landmarker()
+        try:
+            detector.detect(mp_image)
+        finally:
+            detector.close()
+
+    pool = LandmarkerPool(create_landmarker, size=1)
+    pool.warm()
+
+    def pooled_call():
+        with pool.detector() as detector:
+            detector.detect(mp_image)
+
+    cold = summarize(time_calls(cold_call, args.repeat))
+    pooled = summarize(time_calls(pooled_call, args.repeat))
+    pool.shutdown()
+
+    print(json.dumps({
+        'benchmark': 'landmarker_pool',
+        'image': {'width': image_rgb.shape[1], 'height': image_rgb.shape[0]},
+        'cold_per_call': cold,
+        'pooled': pooled,
+        'speedup_p50': round(cold['p50_ms'] / pooled['p50_ms'], 2) if pooled['p50_ms'] else None,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Micro-benchmark: the vectorized measurement kernel vs. the previous per-object path.
+
+    python -m bench.bench_measurement_kernel --frames 256
+"""
+
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+from measurement_logic import (CHIN, FITTING_HEIGHT_OFFSET, FOREHEAD, LEFT_EYE_LOWER_LID, LEFT_PUPIL,
+                               LEFT_REFERENCE, NOSE_TIP, RIGHT_PUPIL, RIGHT_REFERENCE,
+                               compute_measurements)
+
+FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM = 1280, 720, 140.0
+
+
+def legacy_measurements(face, frame_width_px, frame_height_px, frame_width_mm):
+    """The pre-vectorization implementation: one Python object per landmark, scalar math."""
+    class LandmarkWrapper:
+        def __init__(self, lm):
+            self.x = lm[0]
+            self.y = lm[1]
+            self.z = lm[2]
+
+    landmarks = [LandmarkWrapper(lm) for lm in face]
+    left_ref_pt = landmarks[LEFT_REFERENCE]
+    right_ref_pt = landmarks[RIGHT_REFERENCE]
+    ref_width_px = math.sqrt(((right_ref_pt.x - left_ref_pt.x) * frame_width_px)**2 +
+                             ((right_ref_pt.y - left_ref_pt.y) * frame_height_px)**2)
+    mm_per_pixel = frame_width_mm / ref_width_px
+    left_pupil_pt = landmarks[LEFT_PUPIL]
+    right_pupil_pt = landmarks[RIGHT_PUPIL]
+    pd_px = math.sqrt(((right_pupil_pt.x - left_pupil_pt.x) * frame_width_px)**2 +
+                      ((right_pupil_pt.y - left_pupil_pt.y) * frame_height_px)**2)
+    eye_height_px = abs(landmarks[LEFT_EYE_LOWER_LID].y - left_pupil_pt.y) * frame_height_px
+    tilt_deg = abs(math.degrees(math.atan2(landmarks[CHIN].z - landmarks[FOREHEAD].z, 0.2)))
+    vertex_mm = (abs(landmarks[NOSE_TIP].z) * 100) + 8
+    measurements = {"pd": pd_px * mm_per_pixel, "fh": eye_height_px * mm_per_pixel + FITTING_HEIGHT_OFFSET,
+                    "tilt": min(tilt_deg, 15.0), "vertex": min(vertex_mm, 14.0)}
+    landmarks_for_3d = [[lm.x, lm.y, lm.z] for lm in landmarks]
+    return measurements, landmarks_for_3d
+
+
+def synthetic_faces(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    faces = rng.uniform(0.2, 0.8, size=(frames, 478, 3)) * [1, 1, 0.1]
+    return faces.astype(np.float32)
+
+
+def per_frame_us(fn, frames, repeat=5):
+    """Best-of-`repeat` wall time of fn, divided per frame, in microseconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best / frames * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=256)
+    args = parser.parse_args()
+
+    faces = synthetic_faces(args.frames)
+    face_lists = faces.tolist()
+
+    legacy = [legacy_measurements(face, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM)[0] for face in face_lists]
+    stacked = compute_measurements(faces, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM)
+    max_abs_diff = max(float(np.max(np.abs(stacked[key] - [m[key] for m in legacy]))) for key in stacked)
+
+    print(json.dumps({
+        'benchmark': 'measurement_kernel',
+        'frames': args.frames,
+        'us_per_frame': {
+            'legacy_per_object': per_frame_us(
+                lambda: [legacy_measurements(f, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM) for f in face_lists],
+                args.frames),
+            'vectorized_single': per_frame_us(
+                lambda: [(compute_measurements(f, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM), f.tolist())
+                         for f in faces],
+                args.frames),
+            'vectorized_stack': per_frame_us(
+                lambda: compute_measurements(faces, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM),
+                args.frames),
+        },
+        'max_abs_diff_mm': max_abs_diff,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Metrics overhead benchmark: cost of one span, a counter increment, a /metrics render,
+and a request through the Flask hooks with and without instrumentation.
+
+    python -m bench.bench_metrics --spans 200000
+"""
+
+import argparse
+import json
+import threading
+import time
+
+from flask import Flask, jsonify
+
+import metrics
+from bench.common import summarize, time_calls
+
+
+def per_call_ns(fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return round((time.perf_counter() - start) / calls * 1e9, 1)
+
+
+def empty_span():
+    with metrics.span('bench'):
+        pass
+
+
+def request_latency(instrumented, requests):
+    app = Flask(__name__)
+    if instrumented:
+        metrics.instrument_app(app)
+
+    @app.route('/ping')
+    def ping():
+        with metrics.span('bench'):
+            return jsonify({'ok': True})
+
+    client = app.test_client()
+    return summarize(time_calls(lambda: client.get('/ping'), requests))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--spans', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    report = {
+        'benchmark': 'metrics',
+        'span_ns': per_call_ns(empty_span, args.spans),
+        'counter_inc_ns': per_call_ns(lambda: metrics.FACES_NOT_FOUND.inc(), args.spans),
+    }
+
+    # Contention: the same span from several threads at once
+    per_thread = args.spans // args.threads
+    threads = [threading.Thread(target=per_call_ns, args=(empty_span, per_thread)) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report['span_ns_contended'] = round((time.perf_counter() - start) / (per_thread * args.threads) * 1e9, 1)
+
+    report['render'] = summarize(time_calls(metrics.render, 200))
+    report['request_plain'] = request_latency(False, args.requests)
+    report['request_instrumented'] = request_latency(True, args.requests)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
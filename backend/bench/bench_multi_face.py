@@ -0,0 +1,92 @@
+"""
+Multi-face benchmark: one analyze_faces pass over a group image vs. N sequential single-face
+analyze_image calls, one per person, plus the measurement math alone for a stack of faces.
+
+The group image is N frames of the sample MP4 tiled side by side, so the single-face
+baseline measures exactly the same faces.
+
+    python -m bench.bench_multi_face --faces 2 4 6 --repeat 5
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+import measurement_logic
+import result_cache
+from bench.bench_measurement_kernel import synthetic_faces
+from bench.common import encode_jpeg, sample_frames, summarize, time_calls
+
+
+def group_image(frames):
+    """Tile frames left to right into one RGB image (frames share the sample clip's size)."""
+    return np.ascontiguousarray(np.concatenate(frames, axis=1))
+
+
+def math_only(faces, repeat):
+    stack = synthetic_faces(faces)
+    stack[:, measurement_logic.RIGHT_REFERENCE, 0] = 0.9
+    return {
+        'vectorized_stack': summarize(time_calls(
+            lambda: measurement_logic.compute_measurements(stack, 1280, 720, 140.0), repeat)),
+        'sequential_single': summarize(time_calls(
+            lambda: [measurement_logic.compute_measurements(face, 1280, 720, 140.0) for face in stack], repeat)),
+    }
+
+
+def inference(frames, repeat):
+    singles = [encode_jpeg(frame) for frame in frames]
+    group = encode_jpeg(group_image(frames))
+
+    # Warm both pools so model load is excluded
+    faces, _ = measurement_logic.analyze_faces(group, 140.0)
+    measurement_logic.analyze_image(singles[0], 140.0)
+
+    multi = time_calls(lambda: measurement_logic.analyze_faces(group, 140.0), repeat)
+    sequential = time_calls(lambda: [measurement_logic.analyze_image(image, 140.0) for image in singles], repeat)
+
+    # Tiles are ordered left to right, as analyze_faces orders its faces
+    agreement = None
+    if len(faces) == len(frames):
+        single_pd = [measurement_logic.analyze_image(image, 140.0)[0]['pd'] for image in singles]
+        multi_pd = [face.get('measurements', {}).get('pd', float('nan')) for face in faces]
+        agreement = round(float(np.nanmax(np.abs(np.subtract(single_pd, multi_pd)))), 4)
+
+    multi_summary, sequential_summary = summarize(multi), summarize(sequential)
+    return {
+        'faces_found': len(faces),
+        'multi_face': multi_summary,
+        'sequential_single': sequential_summary,
+        'speedup': round(sequential_summary['p50_ms'] / multi_summary['p50_ms'], 2),
+        'faces_per_sec_multi': round(len(faces) * 1000 / multi_summary['p50_ms'], 2),
+        'faces_per_sec_sequential': round(len(frames) * 1000 / sequential_summary['p50_ms'], 2),
+        'pd_max_diff_mm': agreement,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--faces', type=int, nargs='+', default=[2, 4, 6])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # Every call must run inference
+    result_cache._result_cache = result_cache.ResultCache(max_bytes=0)
+    frames = sample_frames(max(args.faces), stride=15)
+
+    rows = []
+    for count in args.faces:
+        row = {'faces': count, 'math': math_only(count, args.repeat * 100)}
+        try:
+            row['inference'] = inference(frames[:count], args.repeat)
+        except Exception as e:
+            row['inference'] = {'error': f"{type(e).__name__}: {e}"}
+        rows.append(row)
+
+    print(json.dumps({'benchmark': 'multi_face', 'max_faces': measurement_logic.MULTI_FACE_MAX_FACES,
+                      'runs': rows}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
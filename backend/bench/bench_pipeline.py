@@ -0,0 +1,194 @@
+"""
+End-to-end pipeline benchmark: analyze_image latency percentiles, /process_image throughput
+under concurrency through the Flask test client, peak memory, and PD/FH drift between runs.
+
+Images are frames from the sample MP4 plus synthetic variants of them (rescaled, recompressed,
+PNG, darkened, mirrored). The result cache is disabled so every call runs inference.
+
+    python -m bench.bench_pipeline --frames 8 --concurrency 1 4 8 --output pipeline.json
+    python -m bench.bench_pipeline --baseline pipeline.json   # drift against an earlier run
+"""
+
+import argparse
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageOps
+
+from bench.common import encode_jpeg, peak_rss_mb, sample_frames, summarize
+
+FRAME_WIDTH_MM = 140.0
+
+
+def _encode(image, fmt='JPEG', **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+# Synthetic variants of a recorded frame: name -> PIL image -> encoded bytes
+VARIANTS = {
+    'half': lambda im: _encode(im.resize((im.width // 2, im.height // 2), Image.BILINEAR), quality=90),
+    'large': lambda im: _encode(im.resize((im.width * 3, im.height * 3), Image.BICUBIC), quality=90),
+    'q50': lambda im: _encode(im, quality=50),
+    'png': lambda im: _encode(im, 'PNG'),
+    'dark': lambda im: _encode(ImageEnhance.Brightness(im).enhance(0.6), quality=90),
+    'mirror': lambda im: _encode(ImageOps.mirror(im), quality=90),
+}
+
+
+def image_corpus(frames, synthetic):
+    """[(image id, encoded bytes)]: recorded frames, then up to `synthetic` variants of them."""
+    recorded = sample_frames(frames, stride=15)
+    corpus = [(f'frame-{i:03d}', encode_jpeg(frame)) for i, frame in enumerate(recorded)]
+    variants = [(i, name) for i in range(len(recorded)) for name in VARIANTS][:synthetic]
+    for i, name in variants:
+        corpus.append((f'frame-{i:03d}-{name}', VARIANTS[name](Image.fromarray(recorded[i]))))
+    return corpus
+
+
+def disable_result_cache():
+    import result_cache
+    result_cache._result_cache = result_cache.ResultCache(max_bytes=0)
+
+
+def measure_latency(corpus, repeat):
+    """Time analyze_image on every image, `repeat` passes. Returns (report, measurements per pass)."""
+    from measurement_logic import analyze_image
+
+    passes, latencies, errors, failed = [], [], {}, 0
+    for _ in range(repeat):
+        measured = {}
+        for image_id, payload in corpus:
+            start = time.perf_counter()
+            try:
+                measurements, _, _ = analyze_image(payload, FRAME_WIDTH_MM)
+            except Exception as e:
+                errors[image_id] = str(e)
+                failed += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            measured[image_id] = {key: measurements[key] for key in ('pd', 'fh')}
+        passes.append(measured)
+
+    report = {'calls': repeat * len(corpus), 'errors': failed}
+    if errors:
+        report['error_examples'] = dict(list(errors.items())[:3])
+    if latencies:
+        # The first call per process also pays for model load; report it separately
+        report['first_call_ms'] = round(latencies[0], 3)
+        report['latency'] = summarize(latencies[1:] or latencies)
+    return report, passes
+
+
+def drift(a, b):
+    """Largest and mean absolute PD/FH difference over images measured in both runs."""
+    common = sorted(set(a) & set(b))
+    if not common:
+        return None
+    result = {'images': len(common)}
+    for key in ('pd', 'fh'):
+        diffs = np.abs([a[image_id][key] - b[image_id][key] for image_id in common])
+        result[f'{key}_max_mm'] = round(float(diffs.max()), 4)
+        result[f'{key}_mean_mm'] = round(float(diffs.mean()), 4)
+    return result
+
+
+def measure_concurrency(corpus, levels, requests):
+    """/process_image throughput and latency at each concurrency level, one test client per thread."""
+    from app import app
+
+    rows = []
+    for concurrency in levels:
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+        counter = iter(range(requests))
+
+        def worker():
+            client = app.test_client()
+            while True:
+                with lock:
+                    index = next(counter, None)
+                if index is None:
+                    return
+                image_id, payload = corpus[index % len(corpus)]
+                start = time.perf_counter()
+                response = client.post('/process_image', content_type='multipart/form-data', data={
+                    'image': (io.BytesIO(payload), f'{image_id}.jpg'),
+                    'frame_width_mm': str(FRAME_WIDTH_MM),
+                })
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        rows.append({
+            'concurrency': concurrency,
+            'requests': requests,
+            'requests_per_sec': round(requests / elapsed, 2),
+            'status_codes': {str(code): count for code, count in sorted(statuses.items())},
+            'latency': summarize(latencies),
+            'peak_rss_mb': peak_rss_mb(),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=8, help='frames taken from the sample MP4')
+    parser.add_argument('--synthetic', type=int, default=8, help='synthetic variants of those frames')
+    parser.add_argument('--repeat', type=int, default=3, help='passes over the images (drift between passes)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--requests', type=int, default=64, help='requests per concurrency level')
+    parser.add_argument('--baseline', help='report of an earlier run to compute PD/FH drift against')
+    parser.add_argument('--output', help='also write the report to this file')
+    args = parser.parse_args()
+
+    # No database writes and no background connection attempts while timing
+    os.environ['MONGODB_URI'] = ''
+    # The test clients all come from one address; measure the pipeline, not the rate limits
+    os.environ['ADMISSION_CONTROL'] = '0'
+    disable_result_cache()
+
+    report = {'benchmark': 'pipeline', 'cpu_count': os.cpu_count(), 'peak_rss_mb': {'start': peak_rss_mb()}}
+    corpus = image_corpus(args.frames, args.synthetic)
+    report['images'] = {'count': len(corpus), 'bytes': sum(len(payload) for _, payload in corpus)}
+    report['peak_rss_mb']['corpus'] = peak_rss_mb()
+
+    latency, passes = measure_latency(corpus, args.repeat)
+    report['analyze_image'] = latency
+    report['peak_rss_mb']['analyze_image'] = peak_rss_mb()
+
+    # Same process, same inputs: anything above zero is nondeterminism in the pipeline
+    report['drift_between_passes'] = drift(passes[0], passes[-1]) if len(passes) > 1 else None
+    report['measurements'] = passes[-1] if passes else {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        # A bench_pipeline report, or a run_all report containing one
+        measured = baseline.get('measurements') or baseline.get('results', {}).get('pipeline', {}).get('measurements', {})
+        report['drift_vs_baseline'] = drift(measured, report['measurements'])
+
+    report['process_image'] = measure_concurrency(corpus, args.concurrency, args.requests)
+    report['peak_rss_mb']['end'] = peak_rss_mb()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Pose-correction benchmark: extra per-frame cost of measuring in a pose-normalized frame and
+the repeatability gained, with and without the facial transformation matrix.
+
+- synthetic: a face rotated by known yaw/pitch/roll; PD/FH error against the frontal face,
+  uncorrected vs. corrected (needs no model)
+- kernel: compute_measurements per frame with and without `pose` on a stack of faces
+- video: frames of the sample MP4 measured both ways; the spread of PD/FH across frames is
+  the repeatability (one person, one session). Also times detect() with and without the
+  matrix output.
+
+    python -m bench.bench_pose_correction --frames 30 --stride 5
+"""
+
+import argparse
+import json
+
+import numpy as np
+
+from bench.bench_measurement_kernel import per_frame_us, synthetic_faces
+from bench.common import sample_frames, summarize, time_calls
+from measurement_logic import compute_measurements, create_landmarker
+
+FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM = 1280, 720, 140.0
+
+# (yaw, pitch, roll) in degrees
+POSES = [(5, 0, 0), (10, 0, 0), (20, 0, 0), (0, 10, 0), (0, 0, 10), (15, -8, 5)]
+
+
+def rotation(yaw, pitch, roll):
+    y, p, r = np.radians([yaw, pitch, roll])
+    rx = np.array([[1, 0, 0], [0, np.cos(p), -np.sin(p)], [0, np.sin(p), np.cos(p)]])
+    ry = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    rz = np.array([[np.cos(r), -np.sin(r), 0], [np.sin(r), np.cos(r), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+
+def rotate_face(face, matrix):
+    """Turn a normalized face by `matrix`, the inverse of measurement_logic.pose_normalize."""
+    scale = np.array([FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH], dtype=np.float64)
+    center = np.zeros(3)
+    center[:2] = face[:, :2].mean(axis=0)
+    flip = np.array([1.0, -1.0, -1.0])
+    return ((face - center) * scale * flip) @ matrix.T * flip / scale + center
+
+
+def synthetic():
+    face = synthetic_faces(1)[0].astype(np.float64)
+    frontal = compute_measurements(face, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM)
+    rows = []
+    for pose in POSES:
+        matrix = np.eye(4)
+        matrix[:3, :3] = rotation(*pose)
+        turned = rotate_face(face, matrix[:3, :3])
+        plain = compute_measurements(turned, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM)
+        corrected = compute_measurements(turned, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM, pose=matrix)
+        rows.append({
+            'pose': 'yaw={} pitch={} roll={}'.format(*pose),
+            'pd_error_mm': round(abs(plain['pd'] - frontal['pd']), 4),
+            'pd_error_corrected_mm': round(abs(corrected['pd'] - frontal['pd']), 4),
+            'fh_error_mm': round(abs(plain['fh'] - frontal['fh']), 4),
+            'fh_error_corrected_mm': round(abs(corrected['fh'] - frontal['fh']), 4),
+        })
+    return rows
+
+
+def kernel(frames):
+    faces = synthetic_faces(frames)
+    poses = np.tile(np.eye(4, dtype=np.float32), (frames, 1, 1))
+    poses[:, :3, :3] = rotation(10, 5, 2)
+    return {
+        'plain_us_per_frame': per_frame_us(
+            lambda: compute_measurements(faces, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM), frames),
+        'corrected_us_per_frame': per_frame_us(
+            lambda: compute_measurements(faces, FRAME_WIDTH, FRAME_HEIGHT, FRAME_WIDTH_MM, pose=poses), frames),
+    }
+
+
+def spread(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'std_mm': round(float(values.std()), 4),
+        'range_mm': round(float(values.max() - values.min()), 4),
+        'p95_abs_dev_mm': round(float(np.percentile(np.abs(values - np.median(values)), 95)), 4),
+    }
+
+
+def video(frame_count, stride, repeat):
+    import mediapipe as mp
+
+    frames = sample_frames(frame_count, stride=stride)
+    height, width = frames[0].shape[:2]
+    images = [mp.Image(image_format=mp.ImageFormat.SRGB, data=frame) for frame in frames]
+    with_matrix = create_landmarker(transformation_matrix=True)
+    without_matrix = create_landmarker(transformation_matrix=False)
+
+    plain, corrected, yaw = {'pd': [], 'fh': []}, {'pd': [], 'fh': []}, []
+    for image in images:
+        result = with_matrix.detect(image)
+        if not result.face_landmarks or not result.facial_transformation_matrixes:
+            continue
+        landmarks = np.array([(lm.x, lm.y, lm.z) for lm in result.face_landmarks[0]])
+        pose = np.asarray(result.facial_transformation_matrixes[0])
+        a = compute_measurements(landmarks, width, height, FRAME_WIDTH_MM)
+        b = compute_measurements(landmarks, width, height, FRAME_WIDTH_MM, pose=pose)
+        for key in ('pd', 'fh'):
+            plain[key].append(a[key])
+            corrected[key].append(b[key])
+        yaw.append(abs(b['yaw']))
+
+    detect_plain = time_calls(lambda: [without_matrix.detect(image) for image in images], repeat)
+    detect_matrix = time_calls(lambda: [with_matrix.detect(image) for image in images], repeat)
+    return {
+        'frames': len(images),
+        'measured': len(yaw),
+        'abs_yaw_deg': summarize(yaw) if yaw else None,
+        'pd': {'plain': spread(plain['pd']), 'corrected': spread(corrected['pd'])} if yaw else None,
+        'fh': {'plain': spread(plain['fh']), 'corrected': spread(corrected['fh'])} if yaw else None,
+        'detect_ms_per_frame': {
+            'without_matrix': round(np.median(detect_plain) / len(images), 3),
+            'with_matrix': round(np.median(detect_matrix) / len(images), 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=30, help='sample MP4 frames measured')
+    parser.add_argument('--stride', type=int, default=5)
+    parser.add_argument('--kernel-frames', type=int, default=256)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    report = {'benchmark': 'pose_correction', 'synthetic': synthetic(), 'kernel': kernel(args.kernel_frames)}
+    try:
+        report['video'] = video(args.frames, args.stride, args.repeat)
+    except Exception as e:
+        report['video'] = {'error': f"{type(e).__name__}: {e}"}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Preprocessing benchmark: full-resolution decode vs. reduced-scale decode, at several input sizes.
+Reports decode latency and tracemalloc peak memory; with --inference also end-to-end
+analyze_image latency with and without the face-ROI crop.
+
+    python -m bench.bench_preprocess --sizes 640 1280 2000 4000 [--inference]
+"""
+
+import argparse
+import json
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+import preprocess
+from bench.common import encode_jpeg, sample_frames, summarize, time_calls
+from measurement_logic import analyze_image, load_image_rgb
+
+
+def peak_memory(fn):
+    """Peak traced allocation, in MiB, of a single call to fn."""
+    tracemalloc.start()
+    try:
+        fn()
+        return round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+    finally:
+        tracemalloc.stop()
+
+
+def measure(fn, repeat):
+    result = summarize(time_calls(fn, repeat))
+    result['peak_mib'] = peak_memory(fn)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[640, 1280, 2000, 4000])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--inference', action='store_true')
+    args = parser.parse_args()
+
+    frame = Image.fromarray(sample_frames(1)[0])
+    rows = []
+    for size in args.sizes:
+        # Upscale the sample frame so the longest side equals `size`
+        ratio = size / max(frame.size)
+        scaled = frame.resize((round(frame.width * ratio), round(frame.height * ratio)), Image.BICUBIC)
+        payload = encode_jpeg(np.asarray(scaled))
+
+        row = {
+            'size': list(scaled.size),
+            'payload_bytes': len(payload),
+            'full_decode': measure(lambda: load_image_rgb(payload), args.repeat),
+            'reduced_decode': measure(lambda: preprocess.decode_for_inference(payload), args.repeat),
+        }
+        if args.inference:
+            preprocess.FACE_ROI_CROP = False
+            row['analyze_no_roi'] = measure(lambda: analyze_image(payload, 60.0), args.repeat)
+            preprocess.FACE_ROI_CROP = True
+            row['analyze_roi'] = measure(lambda: analyze_image(payload, 60.0), args.repeat)
+        rows.append(row)
+
+    print(json.dumps({'benchmark': 'preprocess', 'max_dim': preprocess.INFERENCE_MAX_DIM,
+                      'runs': rows}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+Pupil refinement benchmark: latency added by pupil_refine.refine_pupils and the reduction in
+pupil-centre and PD variance across repeated frames of the same eyes.
+
+- synthetic: rendered eyes (dark pupil in a textured iris, sub-pixel centres, sensor noise)
+  with landmarks jittered as the model's are; error and spread against the true centres,
+  raw landmarks vs. refined (needs no model)
+- eyelid occlusion: the same eyes with dark lashes hanging over the top of the iris and
+  exact landmarks; the vertical bias the lashes put on the refined centre (should be ~0)
+- video: consecutive frames of the sample MP4; PD spread with and without refinement
+  and the stage's time on real eye crops
+
+    python -m bench.bench_pupil_refinement --frames 200 --video-frames 30
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+import pupil_refine
+from bench.common import sample_frames, summarize
+from preprocess import PreparedImage
+
+FRAME_WIDTH, FRAME_HEIGHT = 1280, 720
+FRAME_WIDTH_MM = 140.0
+IRIS_RADIUS_PX = 14.0
+# True iris centres (right eye, left eye), deliberately off the pixel grid
+TRUE_CENTERS = np.array([[560.37, 360.81], [720.64, 361.22]])
+SKIN, IRIS, PUPIL = 185.0, 95.0, 25.0
+# Upper-lid margin above the centre, as a fraction of the iris radius
+LID_OFFSET = 0.8
+# Lashes: as dark as the pupil, hanging this many px below the lid margin
+LASHES, LASH_LENGTH_PX = 20.0, 3.0
+
+
+def render_eyes(rng, noise=6.0, supersample=4, lashes=False):
+    """
+    An RGB frame with two eyes; pixels near the irises are supersampled for sub-pixel edges.
+    With `lashes`, a dark band hangs from the upper lid over the top of each iris.
+    """
+    image = np.full((FRAME_HEIGHT, FRAME_WIDTH), SKIN, dtype=np.float32)
+    half = int(IRIS_RADIUS_PX * 2)
+    for cx, cy in TRUE_CENTERS:
+        top, left = int(cy) - half, int(cx) - half
+        offsets = (np.arange(2 * half * supersample) + 0.5) / supersample
+        ys, xs = top + offsets[:, np.newaxis], left + offsets[np.newaxis, :]
+        distance = np.hypot(xs - cx, ys - cy)
+        angle = np.arctan2(ys - cy, xs - cx)
+        # Radial iris texture, a darker pupil, and an upper lid covering the top of the iris
+        patch = np.where(distance < IRIS_RADIUS_PX, IRIS + 12 * np.sin(9 * angle), SKIN)
+        patch = np.where(distance < 0.4 * IRIS_RADIUS_PX, PUPIL, patch)
+        lid = cy - LID_OFFSET * IRIS_RADIUS_PX
+        patch = np.where(ys < lid, SKIN - 20, patch)
+        if lashes:
+            patch = np.where((ys >= lid - LASH_LENGTH_PX) & (ys < lid + LASH_LENGTH_PX), LASHES, patch)
+        patch = patch.reshape(2 * half, supersample, 2 * half, supersample).mean(axis=(1, 3))
+        image[top:top + 2 * half, left:left + 2 * half] = patch
+    image += rng.normal(0, noise, image.shape)
+    return np.repeat(np.clip(image, 0, 255).astype(np.uint8)[..., np.newaxis], 3, axis=2)
+
+
+def jittered_landmarks(rng, jitter_px):
+    """
+    478 normalized landmarks whose iris points scatter around the truth like model output does,
+    plus the upper-lid margin above each iris.
+    """
+    landmarks = np.zeros((478, 3), dtype=np.float32)
+    angles = np.array([0, np.pi / 2, np.pi, 3 * np.pi / 2])
+    for indices, lid, center in zip((pupil_refine.RIGHT_IRIS, pupil_refine.LEFT_IRIS), pupil_refine.UPPER_LIDS,
+                                    TRUE_CENTERS):
+        lid_y = center[1] - LID_OFFSET * IRIS_RADIUS_PX + rng.normal(0, jitter_px)
+        landmarks[lid, :2] = center[0] / FRAME_WIDTH, lid_y / FRAME_HEIGHT
+        noisy = center + rng.normal(0, jitter_px, 2)
+        ring = noisy + IRIS_RADIUS_PX * np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+        points = np.vstack([noisy, ring + rng.normal(0, jitter_px / 2, ring.shape)])
+        landmarks[indices, 0] = points[:, 0] / FRAME_WIDTH
+        landmarks[indices, 1] = points[:, 1] / FRAME_HEIGHT
+    return landmarks
+
+
+def centers_px(landmarks):
+    indices = [pupil_refine.RIGHT_IRIS[0], pupil_refine.LEFT_IRIS[0]]
+    return landmarks[indices, :2].astype(np.float64) * [FRAME_WIDTH, FRAME_HEIGHT]
+
+
+def spread(errors):
+    """Centre error (px) statistics over frames: mean distance, and std of x/y around the mean."""
+    errors = np.asarray(errors)
+    return {
+        'mean_error_px': round(float(np.linalg.norm(errors, axis=-1).mean()), 4),
+        'std_px': round(float(errors.std(axis=0).mean()), 4),
+    }
+
+
+def synthetic(frames, jitter_px, seed=0):
+    rng = np.random.default_rng(seed)
+    raw_errors, refined_errors, raw_pd, refined_pd, latencies = [], [], [], [], []
+    for _ in range(frames):
+        prepared = PreparedImage(render_eyes(rng), FRAME_WIDTH, FRAME_HEIGHT)
+        landmarks = jittered_landmarks(rng, jitter_px)
+        start = time.perf_counter()
+        refined = pupil_refine.refine_pupils(prepared, landmarks)
+        latencies.append((time.perf_counter() - start) * 1000)
+        raw, better = centers_px(landmarks), centers_px(refined)
+        raw_errors.append(raw - TRUE_CENTERS)
+        refined_errors.append(better - TRUE_CENTERS)
+        raw_pd.append(np.linalg.norm(raw[1] - raw[0]))
+        refined_pd.append(np.linalg.norm(better[1] - better[0]))
+
+    true_pd = np.linalg.norm(TRUE_CENTERS[1] - TRUE_CENTERS[0])
+    # Pixels to mm as if the reference width spanned 600 px
+    mm_per_px = FRAME_WIDTH_MM / 600
+    return {
+        'frames': frames,
+        'landmark_jitter_px': jitter_px,
+        'latency': summarize(latencies),
+        'raw': spread(np.concatenate(raw_errors)),
+        'refined': spread(np.concatenate(refined_errors)),
+        'pd_std_mm': {'raw': round(float(np.std(raw_pd) * mm_per_px), 4),
+                      'refined': round(float(np.std(refined_pd) * mm_per_px), 4)},
+        'pd_bias_mm': {'raw': round(float((np.mean(raw_pd) - true_pd) * mm_per_px), 4),
+                       'refined': round(float((np.mean(refined_pd) - true_pd) * mm_per_px), 4)},
+    }
+
+
+def eyelid_occlusion(frames, seed=0):
+    rng = np.random.default_rng(seed)
+    raw_errors, refined_errors = [], []
+    for _ in range(frames):
+        prepared = PreparedImage(render_eyes(rng, lashes=True), FRAME_WIDTH, FRAME_HEIGHT)
+        landmarks = jittered_landmarks(rng, 0.0)
+        refined = pupil_refine.refine_pupils(prepared, landmarks)
+        raw_errors.append(centers_px(landmarks) - TRUE_CENTERS)
+        refined_errors.append(centers_px(refined) - TRUE_CENTERS)
+    # Negative y bias: the centre is pulled up towards the lashes
+    return {
+        'frames': frames,
+        'lash_length_px': LASH_LENGTH_PX,
+        'y_bias_px': {'raw': round(float(np.concatenate(raw_errors)[:, 1].mean()), 4),
+                      'refined': round(float(np.concatenate(refined_errors)[:, 1].mean()), 4)},
+        'refined': spread(np.concatenate(refined_errors)),
+    }
+
+
+def video(frame_count):
+    import measurement_logic
+    from preprocess import prepare_image
+
+    frames = sample_frames(frame_count, stride=1)
+    plain, refined, latencies = [], [], []
+    for frame in frames:
+        measurement_logic.PUPIL_REFINEMENT = False
+        landmarks, frame_dims = measurement_logic.detect_landmarks(frame)
+        prepared, _ = prepare_image(frame, roi_crop=False)
+        start = time.perf_counter()
+        better = pupil_refine.refine_pupils(prepared, landmarks)
+        latencies.append((time.perf_counter() - start) * 1000)
+        for target, points in ((plain, landmarks), (refined, better)):
+            target.append(measurement_logic.compute_measurements(
+                points, frame_dims['width'], frame_dims['height'], FRAME_WIDTH_MM)['pd'])
+    return {
+        'frames': len(frames),
+        'latency': summarize(latencies),
+        'pd_std_mm': {'raw': round(float(np.std(plain)), 4), 'refined': round(float(np.std(refined)), 4)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=200, help='synthetic frames')
+    parser.add_argument('--jitter', type=float, default=0.8, help='landmark jitter (px, std) in synthetic frames')
+    parser.add_argument('--video-frames', type=int, default=30, help='consecutive sample MP4 frames')
+    args = parser.parse_args()
+
+    report = {'benchmark': 'pupil_refinement', 'budget_ms': pupil_refine.PUPIL_REFINE_BUDGET_MS,
+              'synthetic': synthetic(args.frames, args.jitter),
+              'eyelid_occlusion': eyelid_occlusion(args.frames)}
+    try:
+        report['video'] = video(args.video_frames)
+    except Exception as e:
+        report['video'] = {'error': f"{type(e).__name__}: {e}"}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
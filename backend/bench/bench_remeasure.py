@@ -0,0 +1,120 @@
+"""
+Re-measurement benchmark: records per second of remeasure.run over saved landmarks (no
+inference) at several write batch sizes, against the SQLite backend and MongoDB (--uri, or
+mongomock if installed), plus the images mode on sample MP4 frames when the model is available.
+
+    python -m bench.bench_remeasure --records 5000 --batch-sizes 100 500 2000
+    python -m bench.bench_remeasure --images 40 --workers 1 4
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from bson import ObjectId
+
+import remeasure
+import storage
+from bench.bench_measurement_kernel import synthetic_faces
+from bench.common import encode_jpeg, peak_rss_mb, sample_frames
+from result_cache import CacheEntry, save_entry
+
+FRAME_DIMS = {'width': 1280, 'height': 720}
+
+
+def seed(collection, directory, records):
+    """Records for all but a tenth of the files, so the run both updates and inserts."""
+    ids = [ObjectId() for _ in range(records)]
+    collection.insert_many([{
+        '_id': _id,
+        'user_id': f'user-{i % 500}',
+        'frame_width_mm': 140.0,
+        'measurements': {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0},
+        'created_at': datetime(2025, 1, 1),
+    } for i, _id in enumerate(ids[:records - records // 10])])
+    for _id, face in zip(ids, synthetic_faces(records)):
+        save_entry(os.path.join(directory, f'{_id}.npz'), CacheEntry(face, FRAME_DIMS))
+
+
+def landmark_runs(collection, records, batch_sizes):
+    with tempfile.TemporaryDirectory() as directory:
+        seed(collection, directory, records)
+        runs = []
+        for batch_size in batch_sizes:
+            report = remeasure.run('landmarks', directory, frame_width_mm=140.0, batch_size=batch_size,
+                                   collection=collection, progress=False)
+            runs.append({key: report[key] for key in ('processed', 'updated', 'inserted', 'failed',
+                                                      'seconds', 'records_per_sec')}
+                        | {'batch_size': batch_size})
+        return runs
+
+
+def image_runs(images, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, 'images')
+        os.makedirs(directory)
+        for frame in sample_frames(images, stride=3):
+            with open(os.path.join(directory, f'{ObjectId()}.jpg'), 'wb') as f:
+                f.write(encode_jpeg(frame))
+        collection = storage.SQLiteStorage(os.path.join(tmp, 'bench.sqlite3')).measurements
+        runs = []
+        for count in workers:
+            report = remeasure.run('images', directory, frame_width_mm=140.0, workers=count,
+                                   collection=collection, progress=False)
+            if report['failures'] and report['failed'] == report['processed']:
+                raise RuntimeError(report['failures'][0]['error'])
+            runs.append({'workers': count, 'processed': report['processed'], 'failed': report['failed'],
+                         'records_per_sec': report['records_per_sec']})
+        return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--images', type=int, default=20, help='sample MP4 frames for the images mode (0 skips)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--uri', help='benchmark a real MongoDB instead of mongomock')
+    args = parser.parse_args()
+
+    report = {'benchmark': 'remeasure', 'records': args.records, 'landmarks': {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = storage.SQLiteStorage(os.path.join(tmp, 'bench.sqlite3'))
+        report['landmarks']['sqlite'] = landmark_runs(sqlite.measurements, args.records, args.batch_sizes)
+
+    if args.uri:
+        from pymongo import MongoClient
+        client, backend = MongoClient(args.uri), 'mongodb'
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            mongomock = None
+        client, backend = (mongomock.MongoClient(), 'mongomock') if mongomock else (None, None)
+    if client is not None:
+        collection = client.bench_advance_filter.remeasure
+        collection.drop()
+        try:
+            report['landmarks'][backend] = landmark_runs(storage.MongoCollection(collection), args.records,
+                                                         args.batch_sizes)
+        except Exception as e:
+            # mongomock lags behind pymongo's bulk write operations
+            report['landmarks'][backend] = {'error': f"{type(e).__name__}: {e}"}
+        collection.drop()
+    else:
+        report['landmarks']['mongodb'] = 'skipped: pass --uri or pip install mongomock'
+
+    if args.images:
+        try:
+            report['images'] = image_runs(args.images, args.workers)
+        except Exception as e:
+            report['images'] = {'error': f"{type(e).__name__}: {e}"}
+    report['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
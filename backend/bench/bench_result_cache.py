@@ -0,0 +1,77 @@
+"""
+Result-cache benchmark: cost of a resubmitted image served from the cache (same and new
+frame_width_mm, memory and disk hits) against the work a miss has to redo.
+
+    python -m bench.bench_result_cache --repeat 200
+    python -m bench.bench_result_cache --inference   # time real misses (needs the model)
+"""
+
+import argparse
+import json
+import tempfile
+
+import numpy as np
+
+import measurement_logic
+import result_cache
+from preprocess import decode_for_inference
+from bench.common import encode_jpeg, sample_frames, summarize, time_calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--inference', action='store_true',
+                        help='also time full analyze_image misses (downloads the model)')
+    args = parser.parse_args()
+
+    image_bytes = encode_jpeg(sample_frames(1)[0])
+    frame_dims = {'width': 480, 'height': 848}
+    landmarks = np.random.default_rng(0).uniform(0.2, 0.8, size=(478, 3)).astype(np.float32)
+    landmarks[measurement_logic.RIGHT_REFERENCE, 0] = 0.9
+
+    cache = result_cache.ResultCache(max_bytes=64 * 1024 * 1024)
+    result_cache._result_cache = cache
+    key, _ = result_cache.image_key(image_bytes)
+    cache.put(key, landmarks, frame_dims)
+    widths = iter(np.linspace(120.0, 160.0, args.repeat * 2))
+
+    report = {
+        'benchmark': 'result_cache',
+        'image_bytes': len(image_bytes),
+        'latency': {
+            'hash_only': summarize(time_calls(lambda: result_cache.image_key(image_bytes), args.repeat)),
+            'hit_same_width': summarize(time_calls(
+                lambda: measurement_logic.analyze_image(image_bytes, 140.0), args.repeat)),
+            'hit_new_width': summarize(time_calls(
+                lambda: measurement_logic.analyze_image(image_bytes, next(widths)), args.repeat)),
+            # Lower bound for a miss: decoding alone, before any inference
+            'miss_decode_only': summarize(time_calls(lambda: decode_for_inference(image_bytes), args.repeat)),
+        },
+    }
+
+    # Disk spill: a one-entry memory budget pushes every other entry to disk
+    with tempfile.TemporaryDirectory() as spill_dir:
+        spill = result_cache.ResultCache(max_bytes=landmarks.nbytes + result_cache.ENTRY_OVERHEAD_BYTES,
+                                         spill_dir=spill_dir)
+        keys = [f'{i:032x}' for i in range(2)]
+        for k in keys:
+            spill.put(k, landmarks, frame_dims)
+        # Alternating gets: each one is a disk hit that spills the other entry
+        flip = iter(range(args.repeat))
+        report['latency']['hit_from_disk'] = summarize(time_calls(
+            lambda: spill.get(keys[next(flip) % 2]), args.repeat))
+        report['spill_stats'] = spill.stats()
+
+    if args.inference:
+        miss_cache = result_cache.ResultCache(max_bytes=0)
+        result_cache._result_cache = miss_cache
+        report['latency']['miss_full_inference'] = summarize(time_calls(
+            lambda: measurement_logic.analyze_image(image_bytes, 140.0), args.repeat))
+
+    report['cache_stats'] = cache.stats()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
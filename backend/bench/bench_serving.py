@@ -0,0 +1,184 @@
+"""
+Serving load test: requests per second and p50/p99 latency of /process_image under the
+gunicorn sync setup (gunicorn.conf.py, app:app) and the ASGI entry point (uvicorn, asgi:app),
+at several concurrency levels. --slow-upload-ms sends each upload in pieces with pauses,
+like a client on a slow link; sync workers are held for the whole upload, the ASGI server is not.
+
+Each server is started on a free local port and stopped afterwards. Servers already running
+elsewhere can be measured instead with --url name=http://host:port.
+
+    python -m bench.bench_serving --concurrency 1 8 32 --requests 200
+    python -m bench.bench_serving --servers asgi --slow-upload-ms 200 --concurrency 16
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from bench.common import BACKEND_DIR, encode_jpeg, sample_frames, summarize
+
+BOUNDARY = 'bench-serving'
+
+# Server name -> command line, given the port
+SERVERS = {
+    'sync': lambda port: [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', 'app:app'],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1',
+                          '--port', str(port), '--log-level', 'warning'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def upload_body(image, frame_width_mm=140.0):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="frame_width_mm"\r\n\r\n{frame_width_mm}\r\n'
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="frame.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n').encode() + image + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def start_server(name, startup_timeout):
+    """(process, base url) once /health answers; raises RuntimeError if it never does."""
+    port = free_port()
+    # gunicorn.conf.py binds to $PORT
+    # Admission control is off unless asked for: every request comes from this one address
+    env = dict(os.environ, PORT=str(port), MONGODB_URI=os.getenv('MONGODB_URI', ''),
+               MODEL_DOWNLOAD=os.getenv('MODEL_DOWNLOAD', '0'),
+               ADMISSION_CONTROL=os.getenv('ADMISSION_CONTROL', '0'))
+    # Server logs go to a file: an unread pipe would fill up and stall the server mid-run
+    log = tempfile.TemporaryFile(mode='w+')
+    process = subprocess.Popen(SERVERS[name](port), cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=log, text=True)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            log.seek(0)
+            raise RuntimeError((log.read().strip().splitlines() or ['exited'])[-1])
+        try:
+            urllib.request.urlopen(f'{url}/health', timeout=2).read()
+            return process, url
+        except OSError:
+            time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f'not ready after {startup_timeout}s')
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def post_upload(connection, body, slow_upload_ms, pieces):
+    """Send one /process_image request on a kept-alive connection. Returns the status code."""
+    connection.putrequest('POST', '/process_image')
+    connection.putheader('Content-Type', f'multipart/form-data; boundary={BOUNDARY}')
+    connection.putheader('Content-Length', str(len(body)))
+    connection.endheaders()
+    if slow_upload_ms:
+        step = -(-len(body) // pieces)
+        for offset in range(0, len(body), step):
+            connection.send(body[offset:offset + step])
+            time.sleep(slow_upload_ms / 1000 / pieces)
+    else:
+        connection.send(body)
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def load(url, body, concurrency, requests, slow_upload_ms, pieces):
+    parsed = urllib.parse.urlsplit(url)
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def worker():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=300)
+        while True:
+            with lock:
+                if next(counter, None) is None:
+                    break
+            start = time.perf_counter()
+            try:
+                status = post_upload(connection, body, slow_upload_ms, pieces)
+            except (OSError, http.client.HTTPException):
+                status = 'connection_error'
+                connection.close()
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=300)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'requests_per_sec': round(requests / elapsed, 2),
+        'status_codes': {str(code): count for code, count in sorted(statuses.items(), key=str)},
+        'latency': summarize(latencies),
+    }
+
+
+def run_target(url, body, args):
+    return [load(url, body, concurrency, args.requests, args.slow_upload_ms, args.pieces)
+            for concurrency in args.concurrency]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['sync', 'asgi'])
+    parser.add_argument('--url', nargs='*', default=[], help='name=http://host:port of an already running server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='requests per concurrency level')
+    parser.add_argument('--slow-upload-ms', type=float, default=0, help='spread each upload over this long')
+    parser.add_argument('--pieces', type=int, default=8, help='pieces a slow upload is sent in')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    body = upload_body(encode_jpeg(sample_frames(1)[0]))
+    report = {'benchmark': 'serving', 'body_bytes': len(body), 'slow_upload_ms': args.slow_upload_ms,
+              'servers': {}}
+
+    for name in args.servers:
+        try:
+            process, url = start_server(name, args.startup_timeout)
+        except (OSError, RuntimeError) as e:
+            report['servers'][name] = {'error': str(e)}
+            continue
+        try:
+            report['servers'][name] = {'runs': run_target(url, body, args)}
+        finally:
+            stop_server(process)
+
+    for target in args.url:
+        name, _, url = target.partition('=')
+        report['servers'][name] = {'url': url, 'runs': run_target(url, body, args)}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Cold-start benchmark: app import, MediaPipe import, model resolve and checksum,
+detector creation and first inference, each timed in a fresh interpreter.
+
+    python -m bench.bench_startup --runs 3
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from bench.common import BACKEND_DIR
+
+# Runs in a fresh interpreter; prints one JSON object of phase timings in milliseconds
+CHILD = r'''
+import json, sys, time
+timings = {}
+
+def phase(name, fn):
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except Exception as e:
+        timings[name] = None
+        timings[name + '_error'] = f"{type(e).__name__}: {e}"
+        return None
+    timings[name] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+phase('import_app', lambda: __import__('app'))
+timings['mediapipe_imported_by_app'] = 'mediapipe' in sys.modules
+phase('import_mediapipe', lambda: __import__('mediapipe'))
+
+import model_assets
+phase('model_resolve_and_checksum', lambda: model_assets.model_path('face_landmarker'))
+
+import measurement_logic
+detector = phase('model_load', measurement_logic.create_landmarker)
+if detector is not None:
+    import mediapipe as mp
+    from bench.common import sample_frames
+    frame = sample_frames(1)[0]
+    image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame)
+    phase('first_inference', lambda: detector.detect(image))
+    phase('second_inference', lambda: detector.detect(image))
+print(json.dumps(timings))
+'''
+
+
+def run_child():
+    env = dict(os.environ, MONGODB_URI='', MODEL_DOWNLOAD=os.getenv('MODEL_DOWNLOAD', '0'))
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [run_child() for _ in range(args.runs)]
+    phases = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs]
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            phases[name] = {'median_ms': round(statistics.median(values), 2), 'runs_ms': values}
+        else:
+            phases[name] = values[0]
+
+    print(json.dumps({'benchmark': 'startup', 'runs': args.runs, 'phases': phases}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
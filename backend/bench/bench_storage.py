@@ -0,0 +1,111 @@
+"""
+Storage benchmark: insert and history-read throughput of the SQLite and MongoDB backends
+on the same workload. MongoDB is a real server via --uri, or mongomock if installed.
+
+    python -m bench.bench_storage --records 5000
+    python -m bench.bench_storage --uri mongodb://localhost:27017 --records 50000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import history
+import storage
+
+
+def documents(records, start=0):
+    base = datetime(2025, 1, 1)
+    return [{
+        'user_id': f'user-{i % 500}',
+        'user_name': f'Customer {i}',
+        'user_phone': '9999999999',
+        'frame_width_mm': 140.0,
+        'measurements': {'pd': 62.0, 'fh': 22.0, 'tilt': 3.0, 'vertex': 12.0},
+        'created_at': base + timedelta(seconds=i),
+    } for i in range(start, start + records)]
+
+
+def read_page(collection, args):
+    body = ''.join(history.stream_history(collection, args))
+    return json.loads(body)['next_cursor']
+
+
+def run_workload(collection, records, batch_size, pages, limit):
+    result = {}
+
+    # Single-document inserts, as the request path issues them without write-behind
+    singles = min(records, 1000)
+    start = time.perf_counter()
+    for document in documents(singles):
+        collection.insert_one(document)
+    result['insert_one_per_s'] = round(singles / (time.perf_counter() - start), 1)
+
+    # Batched inserts, as the write-behind flusher issues them
+    start = time.perf_counter()
+    for offset in range(singles, records, batch_size):
+        collection.insert_many(documents(min(batch_size, records - offset), offset))
+    elapsed = time.perf_counter() - start
+    result['insert_many_per_s'] = round((records - singles) / elapsed, 1) if records > singles else None
+
+    # Walk newest-first pages with the keyset cursor
+    start = time.perf_counter()
+    cursor, read = None, 0
+    for _ in range(pages):
+        cursor = read_page(collection, {'limit': limit, **({'cursor': cursor} if cursor else {})})
+        read += limit
+        if not cursor:
+            break
+    result['history_records_per_s'] = round(read / (time.perf_counter() - start), 1)
+
+    start = time.perf_counter()
+    for i in range(pages):
+        read_page(collection, {'limit': limit, 'user_id': f'user-{i}', 'fields': 'measurements,created_at'})
+    result['user_pages_per_s'] = round(pages / (time.perf_counter() - start), 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=history.HISTORY_PAGE_SIZE)
+    parser.add_argument('--uri', help='benchmark a real MongoDB instead of mongomock')
+    args = parser.parse_args()
+
+    report = {'benchmark': 'storage', 'records': args.records, 'batch_size': args.batch_size, 'backends': {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sqlite = storage.SQLiteStorage(os.path.join(tmp, 'bench.sqlite3'))
+        report['backends']['sqlite'] = run_workload(sqlite.measurements, args.records, args.batch_size,
+                                                    args.pages, args.limit)
+
+    if args.uri:
+        from pymongo import MongoClient
+        client, backend = MongoClient(args.uri), 'mongodb'
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            mongomock = None
+        client, backend = (mongomock.MongoClient(), 'mongomock') if mongomock else (None, None)
+    if client is not None:
+        collection = client.bench_advance_filter.measurements
+        collection.drop()
+        collection.create_index([('created_at', -1), ('_id', -1)])
+        collection.create_index([('user_id', 1), ('created_at', -1), ('_id', -1)])
+        report['backends'][backend] = run_workload(storage.MongoCollection(collection), args.records,
+                                                   args.batch_size, args.pages, args.limit)
+        collection.drop()
+    else:
+        report['backends']['mongodb'] = 'skipped: pass --uri or pip install mongomock'
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
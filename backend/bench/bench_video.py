@@ -0,0 +1,35 @@
+"""
+Video throughput benchmark: analyze_video frames/sec on the sample clip at several sampling rates.
+
+    python -m bench.bench_video --sample-fps 5 10 30
+"""
+
+import argparse
+import json
+
+from bench.common import SAMPLE_VIDEO
+from video_measurement import analyze_video
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--video', default=SAMPLE_VIDEO)
+    parser.add_argument('--sample-fps', type=float, nargs='+', default=[5.0, 10.0, 30.0])
+    args = parser.parse_args()
+
+    runs = []
+    for sample_fps in args.sample_fps:
+        result = analyze_video(args.video, 140.0, sample_fps=sample_fps)
+        runs.append({
+            'sample_fps': sample_fps,
+            'frames': result['frames'],
+            'processing_fps': result['processing_fps'],
+            'pd': result['statistics']['pd'],
+            'fh': result['statistics']['fh'],
+        })
+
+    print(json.dumps({'benchmark': 'video', 'video': args.video, 'runs': runs}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Write-behind benchmark: request-side insert latency for each durability mode against a
+MongoDB stand-in with simulated round-trip time, plus flush latency and outage recovery.
+Needs mongomock (pip install mongomock).
+
+    python -m bench.bench_write_behind --inserts 500 --rtt-ms 20
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import write_behind
+from bench.common import summarize, time_calls
+
+
+class SlowCollection:
+    """mongomock collection that sleeps one round trip per call, and can be taken down."""
+
+    def __init__(self, collection, rtt_ms):
+        self._collection = collection
+        self.rtt = rtt_ms / 1000.0
+        self.down = False
+
+    def _round_trip(self):
+        time.sleep(self.rtt)
+        if self.down:
+            raise ConnectionError("simulated outage")
+
+    def insert_one(self, document):
+        self._round_trip()
+        return self._collection.insert_one(document)
+
+    def insert_many(self, documents, ordered=True):
+        self._round_trip()
+        return self._collection.insert_many(documents, ordered=ordered)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+def document(i):
+    return {'user_id': f'user-{i}', 'measurements': {'pd': 62.0, 'fh': 22.0}, 'frame_width_mm': 140.0}
+
+
+def wait_until(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--inserts', type=int, default=500)
+    parser.add_argument('--rtt-ms', type=float, default=20.0)
+    args = parser.parse_args()
+
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("mongomock is not installed: pip install mongomock")
+
+    report = {'benchmark': 'write_behind', 'inserts': args.inserts, 'rtt_ms': args.rtt_ms, 'modes': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('sync', 'buffered', 'journaled'):
+            slow = SlowCollection(mongomock.MongoClient().db.measurements, args.rtt_ms)
+            counter = iter(range(args.inserts))
+            if mode == 'sync':
+                latencies = time_calls(lambda: slow.insert_one(document(next(counter))), args.inserts)
+                report['modes'][mode] = {'insert': summarize(latencies)}
+                continue
+
+            writer = write_behind.WriteBehindWriter(
+                mode=mode, journal_path=os.path.join(tmp, f'{mode}.jsonl'), get_collection=lambda name: slow)
+            collection = write_behind.WriteBehindCollection(slow, writer)
+            latencies = time_calls(lambda: collection.insert_one(document(next(counter))), args.inserts)
+            wait_until(lambda: slow.count_documents({}) == args.inserts)
+            stats = writer.stats()
+            report['modes'][mode] = {'insert': summarize(latencies), 'flush_ms': stats.get('flush_ms'),
+                                     'flushes': stats['flushes'], 'stored': slow.count_documents({})}
+
+            # Outage: inserts keep succeeding, land in the journal and are replayed on recovery
+            slow.down = True
+            writer.retry_seconds = 0.2
+            for i in range(50):
+                collection.insert_one(document(args.inserts + i))
+            wait_until(lambda: writer.stats()['failed_flushes'] > 0)
+            slow.down = False
+            start = time.perf_counter()
+            wait_until(lambda: slow.count_documents({}) == args.inserts + 50)
+            report['modes'][mode]['outage'] = {
+                'recovered_ms': round((time.perf_counter() - start) * 1000, 1),
+                'stored': slow.count_documents({}),
+                'journaled': writer.stats()['journaled'],
+            }
+            writer.shutdown()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Shared helpers for the backend benchmarks.
+Run benchmarks from the backend/ directory, e.g. `python -m bench.bench_landmarker_pool`.
+"""
+
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_VIDEO = os.path.join(BACKEND_DIR, 'uploads', 'WhatsApp_Video_2025-10-13_at_7.10.28_AM.mp4')
+
+
+def sample_frames(count=1, stride=10, video_path=SAMPLE_VIDEO):
+    """Extract `count` RGB frames from the sample MP4, `stride` frames apart."""
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    frames = []
+    index = 0
+    try:
+        while len(frames) < count:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            if index % stride == 0:
+                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            index += 1
+    finally:
+        capture.release()
+    if not frames:
+        raise RuntimeError(f"Could not read frames from {video_path}")
+    return frames
+
+
+def encode_jpeg(image_rgb, quality=90):
+    """Encode an RGB array as JPEG bytes."""
+    buffer = io.BytesIO()
+    Image.fromarray(image_rgb).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def write_sample_jpeg(path, image_rgb=None):
+    """Write a sample frame to `path` as JPEG and return the path."""
+    if image_rgb is None:
+        image_rgb = sample_frames(1)[0]
+    with open(path, 'wb') as f:
+        f.write(encode_jpeg(image_rgb))
+    return path
+
+
+def time_calls(fn, repeat):
+    """Call `fn` `repeat` times and return the per-call latencies in milliseconds."""
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies_ms):
+    """Return mean and percentile summary for a list of latencies in milliseconds."""
+    ordered = sorted(latencies_ms)
+    return {
+        'n': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered), 3),
+        'p50_ms': round(float(np.percentile(ordered, 50)), 3),
+        'p95_ms': round(float(np.percentile(ordered, 95)), 3),
+        'p99_ms': round(float(np.percentile(ordered, 99)), 3),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, in MB (Linux reports KB, macOS bytes)."""
+    import resource
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
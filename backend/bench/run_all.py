@@ -0,0 +1,172 @@
+"""
+Run the benchmark suite and write one JSON report, so runs can be compared between commits.
+Each benchmark runs in its own interpreter with short settings; one that fails (for example
+because the model cannot be downloaded) is recorded with its error and the rest still run.
+
+    python -m bench.run_all --output bench-$(git rev-parse --short HEAD).json
+    python -m bench.run_all --only pipeline measurement_kernel --compare bench-old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from bench.common import BACKEND_DIR
+
+# Benchmark name -> arguments for a quick run. pipeline, multi_face, the video parts of pose_correction
+# and pupil_refinement, and the last three need the MediaPipe model (bundled in models/ or already
+# downloaded: runs never download it, MODEL_DOWNLOAD=0).
+SUITE = {
+    'measurement_kernel': ['--frames', '256'],
+    'frame_quality': ['--frames', '500'],
+    'landmark_payload': ['--repeat', '100'],
+    'landmark_archive': ['--records', '2000', '--reads', '500'],
+    'upload': ['--image-mb', '2', '--repeat', '10'],
+    'metrics': ['--spans', '50000', '--requests', '500'],
+    'result_cache': ['--repeat', '100'],
+    'preprocess': ['--sizes', '1280', '4000', '--repeat', '5'],
+    'decode_path': ['--requests', '100', '--concurrency', '4'],
+    'history': ['--records', '2000'],
+    'storage': ['--records', '2000'],
+    'write_behind': ['--inserts', '200'],
+    'remeasure': ['--records', '1000', '--batch-sizes', '100', '500', '--images', '0'],
+    'startup': ['--runs', '2'],
+    'serving': ['--concurrency', '1', '8', '--requests', '40'],
+    'admission': ['--load', '0.5', '2', '--seconds', '2'],
+    'pipeline': ['--frames', '4', '--synthetic', '6', '--repeat', '2', '--concurrency', '1', '4',
+                 '--requests', '32'],
+    'multi_face': ['--faces', '2', '4', '--repeat', '3'],
+    'pose_correction': ['--frames', '10', '--kernel-frames', '128'],
+    'pupil_refinement': ['--frames', '100', '--video-frames', '10'],
+    'landmarker_pool': ['--repeat', '10'],
+    'batch': ['--images', '16', '--workers', '1', '2'],
+    'video': ['--sample-fps', '10'],
+}
+
+# Units in a leaf's name or its parent's: lower is better for times, memory and sizes,
+# higher for rates. Other leaves are reported without a verdict.
+LOWER_IS_BETTER = ('_ms', '_ns', 'us_per', '_mb', 'bytes')
+HIGHER_IS_BETTER = ('per_sec', '_per_s')
+
+
+def parse_report(stdout):
+    """The benchmark's JSON report: the last top-level '{' ... end of output (models may log first)."""
+    lines = stdout.splitlines()
+    starts = [i for i, line in enumerate(lines) if line == '{']
+    if not starts:
+        raise ValueError('no JSON report in output')
+    return json.loads('\n'.join(lines[starts[-1]:]))
+
+
+def run_benchmark(name, extra_args, timeout):
+    env = dict(os.environ, MONGODB_URI='', MODEL_DOWNLOAD=os.getenv('MODEL_DOWNLOAD', '0'))
+    command = [sys.executable, '-m', f'bench.bench_{name}', *extra_args]
+    start = time.perf_counter()
+    try:
+        completed = subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True,
+                                   timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'error': f'timed out after {timeout}s'}
+    elapsed = round(time.perf_counter() - start, 2)
+    if completed.returncode != 0:
+        return {'error': (completed.stderr.strip().splitlines() or ['failed'])[-1], 'seconds': elapsed}
+    try:
+        report = parse_report(completed.stdout)
+    except ValueError as e:
+        return {'error': str(e), 'seconds': elapsed}
+    report['seconds'] = elapsed
+    return report
+
+
+def flatten(value, path=''):
+    """Numeric leaves of a report as ('a.b.c', number) pairs."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        # Rows are keyed by their first scalar field (e.g. concurrency, workers) when present
+        items = []
+        for i, row in enumerate(value):
+            key = i
+            if isinstance(row, dict):
+                first = next((k for k, v in row.items() if isinstance(v, (int, float, str))), None)
+                if first is not None:
+                    key = f'{first}={row[first]}'
+            items.append((key, row))
+    else:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+        return
+    for key, child in items:
+        yield from flatten(child, f'{path}.{key}' if path else str(key))
+
+
+def compare(old, new, threshold):
+    """Leaves that moved by more than `threshold` (relative), with a verdict where the direction is known."""
+    old_values, changes = dict(flatten(old)), {}
+    for key, value in flatten(new):
+        before = old_values.get(key)
+        if not before or key.endswith('.seconds'):
+            continue
+        change = (value - before) / abs(before)
+        if abs(change) < threshold:
+            continue
+        entry = {'before': before, 'after': value, 'change': round(change, 3)}
+        leaf = '.'.join(key.split('.')[-2:])
+        if any(unit in leaf for unit in HIGHER_IS_BETTER):
+            entry['verdict'] = 'regression' if change < 0 else 'improvement'
+        elif any(unit in leaf for unit in LOWER_IS_BETTER):
+            entry['verdict'] = 'regression' if change > 0 else 'improvement'
+        changes[key] = entry
+    return changes
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--only', nargs='+', choices=sorted(SUITE), help='run only these benchmarks')
+    parser.add_argument('--timeout', type=int, default=600, help='seconds allowed per benchmark')
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--compare', help='earlier run_all report to diff against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change worth reporting')
+    args = parser.parse_args()
+
+    report = {
+        'suite': 'backend',
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': {},
+    }
+    for name in args.only or SUITE:
+        print(f'Running {name}...', file=sys.stderr)
+        report['results'][name] = run_benchmark(name, SUITE[name], args.timeout)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        report['compared_to'] = baseline.get('commit')
+        report['changes'] = compare(baseline.get('results', {}), report['results'], args.threshold)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
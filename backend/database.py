@@ -1,36 +1,151 @@
 """
 MongoDB Database Connection Module
 Handles connection to MongoDB and provides collection accessors.
+The client is created with explicit pool sizing and timeouts, warmed up in the
+background, and its health is checked on an interval so /health never waits on it.
 """
 
 import os
+import threading
+import time
+from collections import deque
+
 from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Connection pool size per process
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '20'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '2'))
+
+# Timeouts (ms): TCP connect, finding a usable server, socket reads, waiting for a pooled connection
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '10000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '2000'))
+
+# Seconds between background health pings
+MONGO_HEALTH_INTERVAL = float(os.getenv('MONGO_HEALTH_INTERVAL', '15'))
+
 # MongoDB connection
 _client = None
+_client_pid = None
 _db = None
+_client_lock = threading.Lock()
+
+
+class PoolMetrics(ConnectionPoolListener):
+    """
+    Connection pool listener recording how long operations wait to check out a
+    connection. Checkouts happen on the calling thread, so the start time is thread-local.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._waits_ms = deque(maxlen=1024)
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.checked_out = 0
+        self.created = 0
+        self.closed = 0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            if started is not None:
+                self._waits_ms.append((time.perf_counter() - started) * 1000)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failed_checkouts += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    # Events this module does not track
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            stats = {
+                'checkouts': self.checkouts,
+                'failed_checkouts': self.failed_checkouts,
+                'checked_out': self.checked_out,
+                'open': self.created - self.closed,
+                'max_pool_size': MONGO_MAX_POOL_SIZE,
+            }
+        if waits:
+            stats['checkout_wait_ms'] = {
+                'p50': round(waits[len(waits) // 2], 3),
+                'p95': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3),
+                'max': round(waits[-1], 3),
+            }
+        return stats
+
+
+pool_metrics = PoolMetrics()
 
 
 def get_client():
-    """Get or create MongoDB client."""
-    global _client
-    if _client is None:
-        mongodb_uri = os.getenv('MONGODB_URI')
-        if not mongodb_uri:
-            raise ValueError("MONGODB_URI environment variable is not set")
-        _client = MongoClient(mongodb_uri)
+    """Get or create MongoDB client (a new one after a fork, since clients are not fork-safe)."""
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                mongodb_uri = os.getenv('MONGODB_URI')
+                if not mongodb_uri:
+                    raise ValueError("MONGODB_URI environment variable is not set")
+                _client = MongoClient(
+                    mongodb_uri,
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=[pool_metrics],
+                )
+                _client_pid = os.getpid()
     return _client
 
 
 def get_db():
     """Get database instance."""
     global _db
-    if _db is None:
-        client = get_client()
+    client = get_client()
+    if _db is None or _db.client is not client:
         # Use 'advance_filter' as the database name
         _db = client.advance_filter
     return _db
@@ -58,3 +173,55 @@ def test_connection():
     except Exception as e:
         print(f"MongoDB connection failed: {e}")
         return False
+
+
+def ensure_indexes():
+    """Create the indexes used by /history. Safe to call repeatedly."""
+    measurements = get_measurements_collection()
+    # Newest-first pages, keyset on (created_at, _id)
+    measurements.create_index([('created_at', -1), ('_id', -1)], name='created_at_id')
+    # Per-user history pages
+    measurements.create_index([('user_id', 1), ('created_at', -1), ('_id', -1)], name='user_id_created_at_id')
+
+
+# ========================================
+# Background warm-up and health
+# ========================================
+_health = {'status': 'starting', 'checked_at': None, 'latency_ms': None}
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+def _ping_once():
+    global _health
+    start = time.perf_counter()
+    ok = test_connection()
+    _health = {
+        'status': 'connected' if ok else 'disconnected',
+        'checked_at': time.time(),
+        'latency_ms': round((time.perf_counter() - start) * 1000, 2) if ok else None,
+    }
+
+
+def _monitor():
+    # The first ping also opens minPoolSize connections, so the first request finds them warm
+    while True:
+        _ping_once()
+        time.sleep(MONGO_HEALTH_INTERVAL)
+
+
+def start_monitor():
+    """Start the warm-up and health thread for this process (again after a fork)."""
+    global _monitor_pid
+    if _monitor_pid == os.getpid():
+        return
+    with _monitor_lock:
+        if _monitor_pid != os.getpid():
+            _monitor_pid = os.getpid()
+            threading.Thread(target=_monitor, name='mongo-health', daemon=True).start()
+
+
+def database_health():
+    """Last background health check plus pool metrics. Never touches the network."""
+    start_monitor()
+    return dict(_health, pool=pool_metrics.stats())
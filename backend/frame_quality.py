@@ -0,0 +1,110 @@
+"""
+Frame Quality
+Server-side port of the frontend's calculateFrameScore heuristic, vectorized over
+landmark stacks, plus a blur check that runs on pixels before any inference.
+Batch and video paths use it to drop bad frames early and to pick the best frame.
+"""
+
+import os
+
+import numpy as np
+
+# --- Landmark Indices (same as calculateFrameScore in frontend/index.html) ---
+NOSE_TIP = 1
+LEFT_EYE = 33
+RIGHT_EYE = 263
+LEFT_EYE_TOP = 159
+LEFT_EYE_BOTTOM = 145
+RIGHT_EYE_TOP = 386
+RIGHT_EYE_BOTTOM = 374
+
+# Eye openness (normalized lid gap) below which an eye counts as closed, as in the frontend
+MIN_EYE_OPENNESS = 0.01
+
+# Frontend yaw term relative to the eye distance above which the head counts as turned
+MAX_YAW_RATIO = float(os.getenv('FRAME_MAX_YAW_RATIO', '0.25'))
+
+# Variance of the Laplacian on the downsampled face crop below which the frame is blurred
+MIN_SHARPNESS = float(os.getenv('FRAME_MIN_SHARPNESS', '10'))
+
+# The blur check works on a grayscale copy at most this many pixels on its longest side
+SHARPNESS_MAX_DIM = 256
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class FrameRejectedError(ValueError):
+    """Raised when a frame fails a quality check. `reason` is 'blurred', 'eyes_closed' or 'head_turned'."""
+
+    def __init__(self, reason):
+        super().__init__(f"Frame rejected: {reason.replace('_', ' ')}")
+        self.reason = reason
+
+
+def sharpness(image_rgb):
+    """
+    Variance of the 4-neighbour Laplacian on a strided grayscale view of the image.
+    Costs well under a millisecond for a face crop, so it runs before inference.
+    """
+    step = max(1, -(-max(image_rgb.shape[:2]) // SHARPNESS_MAX_DIM))
+    gray = image_rgb[::step, ::step] @ _LUMA
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    laplacian = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                 - 4.0 * gray[1:-1, 1:-1])
+    return float(laplacian.var())
+
+
+def check_sharpness(image_rgb, min_sharpness=None):
+    """Raise FrameRejectedError if the image is too blurred to be worth running inference on."""
+    min_sharpness = MIN_SHARPNESS if min_sharpness is None else min_sharpness
+    value = sharpness(image_rgb)
+    if value < min_sharpness:
+        raise FrameRejectedError('blurred')
+    return value
+
+
+def score_landmarks(landmarks):
+    """
+    Score one face (N, 3) or a stack of faces (B, N, 3).
+    Returns a dict of arrays (or floats for a single face):
+      score         - calculateFrameScore from the frontend; higher is better, -1 for closed eyes
+      yaw_ratio     - the frontend yaw term divided by the horizontal eye distance
+      eye_openness  - the smaller of the two lid gaps
+      reason        - '' for usable frames, otherwise 'eyes_closed' or 'head_turned'
+    """
+    landmarks = np.asarray(landmarks)
+    single = landmarks.ndim == 2
+    if single:
+        landmarks = landmarks[np.newaxis]
+
+    picked = landmarks[:, [NOSE_TIP, LEFT_EYE, RIGHT_EYE, LEFT_EYE_TOP, LEFT_EYE_BOTTOM,
+                           RIGHT_EYE_TOP, RIGHT_EYE_BOTTOM], :2].astype(np.float64)
+    nose, left_eye, right_eye, left_top, left_bottom, right_top, right_bottom = (
+        picked[:, i] for i in range(picked.shape[1]))
+
+    yaw = np.abs((nose[:, 0] - left_eye[:, 0]) - (right_eye[:, 0] - nose[:, 0]))
+    eye_distance = np.abs(right_eye[:, 0] - left_eye[:, 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yaw_ratio = np.where(eye_distance > 0, yaw / eye_distance, np.inf)
+
+    left_open = np.abs(left_top[:, 1] - left_bottom[:, 1])
+    right_open = np.abs(right_top[:, 1] - right_bottom[:, 1])
+    eyes_closed = (left_open < MIN_EYE_OPENNESS) | (right_open < MIN_EYE_OPENNESS)
+
+    with np.errstate(divide='ignore'):
+        blink = 1.0 / (left_open + right_open)
+    score = np.where(eyes_closed, -1.0, 1.0 / (yaw + blink * 0.1 + 0.001))
+
+    reason = np.where(eyes_closed, 'eyes_closed', np.where(yaw_ratio > MAX_YAW_RATIO, 'head_turned', ''))
+
+    result = {
+        'score': score,
+        'yaw_ratio': yaw_ratio,
+        'eye_openness': np.minimum(left_open, right_open),
+        'reason': reason,
+    }
+    if single:
+        return {key: (str(value[0]) if key == 'reason' else float(value[0])) for key, value in result.items()}
+    return result
+
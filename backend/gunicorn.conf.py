@@ -0,0 +1,50 @@
+"""
+Gunicorn configuration.
+The app is preloaded in the master so MediaPipe is imported and the model files are
+verified once; forked workers share those pages. Detector instances, MongoClient and the
+write-behind flusher are not fork-safe, so the app skips starting them at import and each
+worker starts its own in post_fork, before it takes traffic.
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '1'))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# Import the app (and MediaPipe) once in the master instead of once per worker
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+# Workers are long-lived, so inserts are buffered off the request path (write_behind.py)
+# unless the environment or .env picks a WRITE_BEHIND_MODE
+load_dotenv()
+if not os.getenv('WRITE_BEHIND_MODE'):
+    os.environ['WRITE_BEHIND_MODE'] = 'buffered'
+
+# The storage bootstrap and the write-behind flusher start in post_fork, not when app.py is imported
+os.environ['STARTUP_IN_POST_FORK'] = '1'
+
+
+def on_starting(server):
+    import mediapipe  # noqa: F401  (heavy import, shared with the workers after fork)
+    from model_assets import MODELS, model_path
+
+    for name in MODELS:
+        try:
+            model_path(name)
+        except Exception as e:
+            server.log.warning(f"Model {name} unavailable at startup: {e}")
+
+
+def post_fork(server, worker):
+    from landmarker_pool import warm_pools
+    from storage import bootstrap_in_background
+    from write_behind import start_write_behind
+
+    # Connections and background threads from the master do not survive the fork
+    bootstrap_in_background()
+    start_write_behind()
+    warm_pools()
@@ -0,0 +1,124 @@
+"""
+Measurement History
+Keyset-paginated, projected reads of the measurements collection for /history.
+Pages are ordered newest first on (created_at, _id), so each page is an index range
+scan no matter how deep the client pages, and records are serialized one at a time
+into a streamed JSON body instead of one large in-memory payload. The query itself
+is run by the storage backend (storage.py).
+"""
+
+import base64
+import json
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Records per page when the client does not ask for a limit, and the largest limit accepted
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '100'))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv('HISTORY_MAX_PAGE_SIZE', '1000'))
+
+# Fields a client may request with ?fields=; 'id' is always included
+HISTORY_FIELDS = ('user_id', 'user_name', 'user_phone', 'frame_width_mm', 'measurements', 'created_at',
+                  'landmark_slot')
+
+# Defaults for records written before a field existed (same as the previous /history)
+FIELD_DEFAULTS = {'user_name': 'Unknown', 'user_phone': 'N/A', 'measurements': {}, 'landmark_slot': None}
+
+
+def encode_cursor(doc):
+    """Opaque cursor pointing just past `doc` in (created_at, _id) order."""
+    created_at = doc.get('created_at')
+    raw = f"{created_at.isoformat() if created_at else ''}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at or None, ObjectId) for a cursor from encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, _, object_id = raw.partition('|')
+        return (datetime.fromisoformat(created_at) if created_at else None), ObjectId(object_id)
+    except (ValueError, InvalidId, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+def parse_date(value, name):
+    """Parse an ISO date or datetime query parameter."""
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: expected an ISO date such as 2025-01-31.")
+
+
+def parse_args(args):
+    """
+    Turn /history query parameters into a backend-neutral spec:
+    {'limit', 'fields', 'user_id', 'date_from', 'date_to', 'after': (created_at, _id) or None}.
+    Raises ValueError for malformed parameters.
+    """
+    try:
+        limit = int(args.get('limit', HISTORY_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer.")
+
+    fields = HISTORY_FIELDS
+    if args.get('fields'):
+        fields = tuple(f.strip() for f in args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in HISTORY_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    return {
+        'limit': max(1, min(limit, HISTORY_MAX_PAGE_SIZE)),
+        'fields': fields,
+        'user_id': args.get('user_id') or None,
+        'date_from': parse_date(args['date_from'], 'date_from') if args.get('date_from') else None,
+        'date_to': parse_date(args['date_to'], 'date_to') if args.get('date_to') else None,
+        'after': decode_cursor(args['cursor']) if args.get('cursor') else None,
+    }
+
+
+def to_record(doc, fields=HISTORY_FIELDS):
+    """Convert a measurement document to its JSON-safe /history record."""
+    record = {'id': str(doc['_id'])}
+    for field in fields:
+        value = doc.get(field, FIELD_DEFAULTS.get(field))
+        if field == 'created_at':
+            value = value.isoformat() if value else None
+        record[field] = value
+    return record
+
+
+def stream_history(collection, args):
+    """
+    Validate the query and return a generator of JSON text chunks for one page:
+    {"success": true, "history": [...], "count": n, "next_cursor": "..." | null}
+    `collection` is a storage collection (see storage.py).
+    Raises ValueError before anything is streamed if the parameters are malformed.
+    """
+    spec = parse_args(args)
+    limit, fields = spec['limit'], spec['fields']
+    # One extra record tells whether another page exists
+    cursor = collection.history(spec, limit + 1)
+
+    def generate():
+        yield '{"success": true, "history": ['
+        count = 0
+        last = None
+        has_more = False
+        try:
+            for doc in cursor:
+                if count == limit:
+                    has_more = True
+                    break
+                yield (',' if count else '') + json.dumps(to_record(doc, fields), default=str)
+                count += 1
+                last = doc
+            next_cursor = encode_cursor(last) if has_more else None
+        finally:
+            cursor.close()
+        yield f'], "count": {count}, "next_cursor": {json.dumps(next_cursor)}}}'
+
+    return generate()
@@ -1,22 +1,50 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
 import uuid
 import tempfile
 import logging
 from datetime import datetime
+from request_io import UploadError, configure_app, stream_upload
 
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Enable CORS for all origins
-CORS(app)
+# Keep uploads in memory, cap the request size and allow the CORS_ORIGINS origins
+configure_app(app)
 
-# Use /tmp for Vercel serverless functions
-UPLOAD_FOLDER = tempfile.gettempdir()
+# Upper bound on images accepted by /process_batch in a single request
+MAX_BATCH_IMAGES = int(os.getenv('MAX_BATCH_IMAGES', '16'))
 
 # Import measurement logic
-from measurement_logic import analyze_image
+from measurement_logic import analyze_faces, analyze_image, analyze_images
+from landmarker_pool import pool_health
+from video_measurement import analyze_video
+from jobs import QueueFullError, get_job_queue
+from result_cache import get_result_cache
+from history import stream_history
+from landmark_archive import attach_slots, get_landmark_archive
+from landmark_payload import (DEFAULT_OPTIONS, build_faces_payload, build_payload, parse_options,
+                              payload_response)
+from metrics import get_profile, instrument_app, register_gauges, render as render_metrics, span
+from storage import bootstrap_in_background, get_storage, storage_health
+from write_behind import start_write_behind, write_behind, write_behind_stats
+from admission import install_admission
+
+# Connect, warm the pool and build the /history indexes in the background, so startup
+# never waits on the database, and replay measurements journaled while MongoDB was unreachable.
+# Under gunicorn each worker does this in post_fork; the (preloading) master must not.
+if os.getenv('STARTUP_IN_POST_FORK') != '1':
+    bootstrap_in_background()
+    start_write_behind()
+
+# Request timing, Server-Timing headers and ?profile=1; queue, pool and cache gauges for /metrics
+instrument_app(app)
+# Rate limits, in-flight and memory checks on the inference endpoints, before the upload is read
+install_admission(app)
+register_gauges('job_queue', lambda: get_job_queue().stats())
+register_gauges('landmarker_pool', pool_health, label='kind')
+register_gauges('result_cache', lambda: get_result_cache().stats())
+register_gauges('write_behind', write_behind_stats)
 
 # ========================================
 # Database Helper Functions
@@ -24,8 +52,10 @@ from measurement_logic import analyze_image
 def get_db_collections():
     """Safely get database collections. Returns None if DB not configured."""
     try:
-        from database import get_users_collection, get_measurements_collection
-        return get_users_collection(), get_measurements_collection()
+        # MongoDB or the embedded SQLite store (see storage.py); inserts are buffered
+        # and flushed in the background (see write_behind.py)
+        storage = get_storage()
+        return write_behind(storage.users), write_behind(storage.measurements)
     except Exception as e:
         app.logger.warning(f"Database not available: {e}")
         return None, None
@@ -38,23 +68,47 @@ def home():
 
 @app.route('/health')
 def health():
-    # Check database connection
-    db_status = "not_configured"
-    try:
-        from database import test_connection
-        if test_connection():
-            db_status = "connected"
-        else:
-            db_status = "disconnected"
-    except Exception:
-        db_status = "not_configured"
+    # Cached by the storage backend, so health probes never wait on the database
+    storage_backend, db_health = storage_health()
     
     return jsonify({
         'message': 'API is working fine on Vercel!',
-        'database': db_status
+        'database': db_health['status'],
+        'storage': storage_backend,
+        'database_health': db_health,
+        'landmarker_pool': pool_health(),
+        'job_queue': get_job_queue().stats(),
+        'result_cache': get_result_cache().stats(),
+        'write_behind': write_behind_stats()
     })
 
 
+@app.route('/metrics', methods=['GET', 'OPTIONS'])
+def metrics():
+    """
+    Prometheus text-format metrics for this process: per-stage and per-endpoint latency
+    histograms, request, error and no-face counters, and queue, pool and cache gauges.
+    """
+    # Handle CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/profiles/<profile_id>', methods=['GET', 'OPTIONS'])
+def get_sampling_profile(profile_id):
+    """Collapsed-stack profile of a request sent with ?profile=1 (needs PROFILER_ENABLED=1)."""
+    # Handle CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    profile = get_profile(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Unknown or expired profile id'}), 404
+    return Response(profile, mimetype='text/plain')
+
+
 # ========================================
 # HARDCODED CREDENTIALS
 # ========================================
@@ -159,8 +213,10 @@ def save_user():
 @app.route('/history', methods=['GET', 'OPTIONS'])
 def get_history():
     """
-    Fetch all measurements from MongoDB.
-    Returns list of all tested users with their measurements.
+    Fetch one page of measurements from MongoDB, most recent first.
+    Query parameters: limit, cursor (next_cursor from the previous page), fields
+    (comma-separated projection), user_id, date_from and date_to (ISO dates).
+    The JSON body is streamed record by record.
     """
     # Handle CORS preflight
     if request.method == 'OPTIONS':
@@ -175,104 +231,367 @@ def get_history():
                 'success': True,
                 'history': [],
                 'count': 0,
+                'next_cursor': None,
                 'message': 'Database not configured'
             }), 200
         
-        # Fetch all measurements, sorted by most recent first
-        measurements = list(measurements_collection.find().sort('created_at', -1))
-        
-        # Convert ObjectId to string for JSON serialization
-        history = []
-        for m in measurements:
-            history.append({
-                'id': str(m['_id']),
-                'user_id': m.get('user_id'),
-                'user_name': m.get('user_name', 'Unknown'),
-                'user_phone': m.get('user_phone', 'N/A'),
-                'frame_width_mm': m.get('frame_width_mm'),
-                'measurements': m.get('measurements', {}),
-                'created_at': m.get('created_at').isoformat() if m.get('created_at') else None
-            })
-        
-        app.logger.info(f"Returning {len(history)} measurement records")
-        return jsonify({
-            'success': True,
-            'history': history,
-            'count': len(history)
-        }), 200
+        chunks = stream_history(measurements_collection, request.args)
+        return Response(stream_with_context(chunks), mimetype='application/json'), 200
         
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         app.logger.error(f"History fetch error: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/history/<measurement_id>/landmarks', methods=['GET', 'OPTIONS'])
+def get_history_landmarks(measurement_id):
+    """
+    Landmarks of a saved measurement from the landmark archive, for the 3D viewer; no inference.
+    Takes the landmark_format / landmark_subset / landmark_encoding options of /process_image.
+    """
+    # Handle CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    archive = get_landmark_archive()
+    if archive is None:
+        return jsonify({'success': False, 'error': 'Landmark archive not configured'}), 503
+    try:
+        options = parse_options(request.args, request.accept_mimetypes)
+        slot = archive.slot_of(measurement_id)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if slot is None:
+        return jsonify({'success': False, 'error': 'No landmarks stored for this measurement'}), 404
+
+    value, indices, raw = archive.encode(slot, options)
+    _, frame_dims = archive.read(slot)
+    payload = {'id': measurement_id, 'landmarks': value, 'frameDimensions': frame_dims}
+    if indices is not None:
+        payload['landmarkIndices'] = indices
+    return payload_response(payload, raw)
+
+
+def measure_and_store(image_source, frame_width_mm, user_id=None, user_name=None, user_phone=None,
+                      landmark_options=DEFAULT_OPTIONS):
+    """
+    Analyze one image and save the measurements to MongoDB if configured.
+    Shared by the synchronous endpoint and the job queue. Returns the response payload
+    and, for binary landmark encoding, the raw landmark bytes (see landmark_payload.py).
+    """
+    measurements, landmarks, frame_dims = analyze_image(image_source, frame_width_mm=frame_width_mm)
+
+    # Save measurements to MongoDB if configured
+    _, measurements_collection = get_db_collections()
+
+    if measurements_collection is not None and user_id:
+        measurement_doc = {
+            'user_id': user_id,
+            'user_name': user_name,
+            'user_phone': user_phone,
+            'frame_width_mm': frame_width_mm,
+            'measurements': measurements,
+            'created_at': datetime.utcnow()
+        }
+        # Keep the landmarks in the archive; the record references the slot
+        with span('archive_landmarks'):
+            attach_slots([measurement_doc], [landmarks], frame_dims)
+        with span('db_insert'):
+            result = measurements_collection.insert_one(measurement_doc)
+        app.logger.info("Measurement saved to MongoDB with ID: %s", result.inserted_id)
+
+    with span('encode_landmarks'):
+        return build_payload(measurements, landmarks, frame_dims, landmark_options)
+
+
+def measure_faces_and_store(image_source, frame_width_mm, user_id=None, user_name=None, user_phone=None,
+                            landmark_options=DEFAULT_OPTIONS):
+    """
+    Multi-face variant of measure_and_store: every face in the image is measured in one pass
+    and saved as its own record, with its position and face box. Returns the JSON payload.
+    """
+    faces, frame_dims = analyze_faces(image_source, frame_width_mm=frame_width_mm)
+
+    # Save measurements to MongoDB if configured
+    _, measurements_collection = get_db_collections()
+    measured = [face for face in faces if 'measurements' in face]
+
+    if measurements_collection is not None and user_id and measured:
+        created_at = datetime.utcnow()
+        measurement_docs = [{
+            'user_id': user_id,
+            'user_name': user_name,
+            'user_phone': user_phone,
+            'frame_width_mm': frame_width_mm,
+            'measurements': face['measurements'],
+            'face_position': face['position'],
+            'face_box': face['box'],
+            'created_at': created_at
+        } for face in measured]
+        with span('archive_landmarks'):
+            attach_slots(measurement_docs, [face['landmarks'] for face in measured], frame_dims)
+        with span('db_insert'):
+            result = measurements_collection.insert_many(measurement_docs)
+        app.logger.info("Saved %d face measurements to MongoDB", len(result.inserted_ids))
+
+    with span('encode_landmarks'):
+        return build_faces_payload(faces, frame_dims, landmark_options)
+
+
+def measure_job(*args, **kwargs):
+    """Job queue entry point: the JSON payload of measure_and_store."""
+    payload, _ = measure_and_store(*args, **kwargs)
+    return payload
+
+
+def parse_frame_width_mm(text):
+    """Upload validator for frame_width_mm; runs as soon as the field has been received."""
+    try:
+        return float(text)
+    except ValueError:
+        raise ValueError('frame_width_mm must be a valid number')
+
+
 @app.route('/process_image', methods=['POST', 'OPTIONS'])
 def process_image():
     """
     Endpoint to process a single image file for optical measurements.
     Expects a multipart form with 'image' and 'frame_width_mm'.
     Saves measurements to MongoDB if configured.
+    With 'async=1' (query or form) the image is queued and a job id is returned with 202.
+    'landmark_format', 'landmark_subset' and 'landmark_encoding' (or 'Accept: application/octet-stream')
+    select a compact landmark encoding; see landmark_payload.py.
+    With 'multi_face=1' every face in the image is measured and returned under 'faces',
+    left to right, each with its position, face box and measurements.
     """
     # Handle CORS preflight
     if request.method == 'OPTIONS':
         return '', 200
     
-    if 'image' not in request.files:
-        app.logger.warning("Request received without image file.")
-        return jsonify({'error': 'Missing image file'}), 400
+    # Fields are validated as they stream in; a bad one rejects the upload before the image is read
+    try:
+        with span('parse_upload'):
+            upload = stream_upload(request, 'image', validators={'frame_width_mm': parse_frame_width_mm},
+                                   required=('frame_width_mm',))
+    except UploadError as e:
+        app.logger.warning("Upload rejected: %s", e)
+        return jsonify({'error': str(e)}), e.status
+
+    image_file = upload.file
+    frame_width_mm = upload.values['frame_width_mm']
+    # Query string first, form fields override it (as request.values did)
+    values = {**request.args.to_dict(), **upload.fields}
+    user_id = values.get('user_id', None)
+    user_name = values.get('user_name', None)
+    user_phone = values.get('user_phone', None)
+
+    try:
+        landmark_options = parse_options(values, request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    multi_face = values.get('multi_face') == '1'
+
+    if values.get('async') == '1':
+        # Job mode: queue the work and return immediately; poll /jobs/<id> for the result.
+        # Job results are polled as JSON, so binary landmarks are sent as base64 there.
+        job_options = dict(landmark_options, encoding='base64')
+        try:
+            job_id = get_job_queue().submit(measure_faces_and_store if multi_face else measure_job,
+                                            image_file.getvalue(), frame_width_mm,
+                                            user_id, user_name, user_phone, job_options)
+        except QueueFullError as e:
+            app.logger.warning("Measurement queue full, rejecting request.")
+            response = jsonify({'error': 'Server busy, please retry', 'retry_after': e.retry_after})
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+        app.logger.info("Queued measurement job %s", job_id)
+        response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/jobs/{job_id}'})
+        response.headers['Location'] = f'/jobs/{job_id}'
+        return response, 202
+
+    try:
+        app.logger.info("Analyzing image with frame width: %smm", frame_width_mm)
+        if multi_face:
+            response_data = measure_faces_and_store(image_file, frame_width_mm, user_id, user_name,
+                                                    user_phone, landmark_options)
+            with span('serialize'):
+                return jsonify(response_data)
+        # Decode straight from the in-memory upload; nothing touches the disk
+        response_data, raw_landmarks = measure_and_store(image_file, frame_width_mm, user_id, user_name,
+                                                         user_phone, landmark_options)
+        with span('serialize'):
+            return payload_response(response_data, raw_landmarks)
+    except Exception as e:
+        app.logger.error(f"Analysis failed for {upload.filename}: {e}", exc_info=True)
+        return jsonify({'error': f"Analysis Failed: {e}"}), 500
+
+
+@app.route('/process_batch', methods=['POST', 'OPTIONS'])
+def process_batch_endpoint():
+    """
+    Endpoint to process several image files in one request.
+    Expects a multipart form with one or more 'images', 'frame_width_mm', and optionally 'user_id'.
+    Images are analyzed in parallel worker processes. Results are returned in upload
+    order, each with its own 'success' flag and 'error' message on failure.
+    With 'quality_filter=1', blurred, closed-eye and turned-head frames are rejected early.
+    'best_index' points at the successful result with the highest frame-quality score.
+    """
+    # Handle CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
     
+    image_files = request.files.getlist('images')
+    if not image_files:
+        app.logger.warning("Batch request received without image files.")
+        return jsonify({'error': 'Missing images'}), 400
+    if len(image_files) > MAX_BATCH_IMAGES:
+        return jsonify({'error': f'At most {MAX_BATCH_IMAGES} images per batch'}), 400
     if 'frame_width_mm' not in request.form:
-        app.logger.warning("Request received without frame_width_mm.")
+        app.logger.warning("Batch request received without frame_width_mm.")
         return jsonify({'error': 'Missing frame_width_mm parameter'}), 400
 
-    image_file = request.files['image']
     user_id = request.form.get('user_id', None)
     user_name = request.form.get('user_name', None)
     user_phone = request.form.get('user_phone', None)
+    quality_filter = request.form.get('quality_filter', '0') == '1'
+
+    try:
+        frame_width_mm = float(request.form['frame_width_mm'])
+    except ValueError:
+        app.logger.error("Invalid format for frame_width_mm.")
+        return jsonify({'error': 'frame_width_mm must be a valid number'}), 400
+
+    try:
+        # Encoded bytes are handed to the worker processes, which decode them in parallel
+        image_bytes = [image_file.read() for image_file in image_files]
+        app.logger.info(f"Analyzing batch of {len(image_bytes)} images with frame width: {frame_width_mm}mm")
+        results = analyze_images(image_bytes, frame_width_mm=frame_width_mm, quality_filter=quality_filter)
+
+        # Save successful measurements to MongoDB if configured
+        _, measurements_collection = get_db_collections()
+        succeeded = [r for r in results if r['success']]
+
+        if measurements_collection is not None and user_id and succeeded:
+            created_at = datetime.utcnow()
+            measurement_docs = [{
+                'user_id': user_id,
+                'user_name': user_name,
+                'user_phone': user_phone,
+                'frame_width_mm': frame_width_mm,
+                'measurements': r['measurements'],
+                'created_at': created_at
+            } for r in succeeded]
+            with span('archive_landmarks'):
+                attach_slots(measurement_docs, [r['landmarks'] for r in succeeded],
+                             [r['frameDimensions'] for r in succeeded])
+            with span('db_insert'):
+                result = measurements_collection.insert_many(measurement_docs)
+            app.logger.info(f"Saved {len(result.inserted_ids)} batch measurements to MongoDB")
+
+        best = max(succeeded, key=lambda r: r['quality']['score'], default=None)
+        return jsonify({
+            'results': results,
+            'count': len(results),
+            'succeeded': len(succeeded),
+            'best_index': best['index'] if best else None
+        })
+
+    except Exception as e:
+        app.logger.error(f"Batch analysis failed: {e}", exc_info=True)
+        return jsonify({'error': f"Analysis Failed: {e}"}), 500
+
+
+@app.route('/process_video', methods=['POST', 'OPTIONS'])
+def process_video_endpoint():
+    """
+    Endpoint to measure from a short video clip instead of a single frame.
+    Expects a multipart form with 'video', 'frame_width_mm', and optionally 'user_id'.
+    Returns median measurements over the good frames plus their spread.
+    """
+    # Handle CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
     
+    if 'video' not in request.files:
+        app.logger.warning("Request received without video file.")
+        return jsonify({'error': 'Missing video file'}), 400
+    if 'frame_width_mm' not in request.form:
+        app.logger.warning("Request received without frame_width_mm.")
+        return jsonify({'error': 'Missing frame_width_mm parameter'}), 400
+
+    video_file = request.files['video']
+    user_id = request.form.get('user_id', None)
+    user_name = request.form.get('user_name', None)
+    user_phone = request.form.get('user_phone', None)
+
     try:
         frame_width_mm = float(request.form['frame_width_mm'])
     except ValueError:
         app.logger.error("Invalid format for frame_width_mm.")
         return jsonify({'error': 'frame_width_mm must be a valid number'}), 400
 
-    filename = str(uuid.uuid4()) + '.jpg'
-    image_path = os.path.join(UPLOAD_FOLDER, filename)
-    image_file.save(image_path)
-    app.logger.info(f"Image saved to {image_path}")
+    # OpenCV can only demux from a file, so the clip is written to /tmp for the duration of the request
+    suffix = os.path.splitext(video_file.filename or '')[1] or '.mp4'
+    video_path = os.path.join(tempfile.gettempdir(), str(uuid.uuid4()) + suffix)
+    with span('upload_save'):
+        video_file.save(video_path)
 
     try:
-        app.logger.info(f"Analyzing image with frame width: {frame_width_mm}mm")
-        measurements, landmarks, frame_dims = analyze_image(image_path, frame_width_mm=frame_width_mm)
-        
+        app.logger.info(f"Analyzing video with frame width: {frame_width_mm}mm")
+        response_data = analyze_video(video_path, frame_width_mm=frame_width_mm)
+        app.logger.info(f"Video analyzed: {response_data['frames']} at {response_data['processing_fps']} fps")
+
         # Save measurements to MongoDB if configured
         _, measurements_collection = get_db_collections()
-        
+
         if measurements_collection is not None and user_id:
             measurement_doc = {
                 'user_id': user_id,
                 'user_name': user_name,
                 'user_phone': user_phone,
                 'frame_width_mm': frame_width_mm,
-                'measurements': measurements,
+                'measurements': response_data['measurements'],
+                'source': 'video',
                 'created_at': datetime.utcnow()
             }
-            result = measurements_collection.insert_one(measurement_doc)
+            with span('db_insert'):
+                result = measurements_collection.insert_one(measurement_doc)
             app.logger.info(f"Measurement saved to MongoDB with ID: {result.inserted_id}")
-        
-        response_data = {
-            "measurements": measurements,
-            "landmarks": landmarks,
-            "frameDimensions": frame_dims
-        }
+
         return jsonify(response_data)
+
     except Exception as e:
-        app.logger.error(f"Analysis failed for {image_path}: {e}", exc_info=True)
+        app.logger.error(f"Video analysis failed: {e}", exc_info=True)
         return jsonify({'error': f"Analysis Failed: {e}"}), 500
     finally:
-        if os.path.exists(image_path):
-            os.remove(image_path)
-            app.logger.info(f"Cleaned up temporary file: {image_path}")
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+
+@app.route('/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+def get_job(job_id):
+    """
+    Poll a queued measurement job.
+    Returns its status ('queued', 'running', 'done' or 'failed') and, once done, the
+    same payload /process_image returns.
+    """
+    # Handle CORS preflight
+    if request.method == 'OPTIONS':
+        return '', 200
+
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job id'}), 404
+
+    response_data = {'job_id': job_id, 'status': job['status']}
+    if job['status'] == 'done':
+        response_data['result'] = job['result']
+    elif job['status'] == 'failed':
+        response_data['error'] = f"Analysis Failed: {job['error']}"
+    return jsonify(response_data), 200
 
 
 if __name__ == '__main__':
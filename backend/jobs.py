@@ -0,0 +1,211 @@
+"""
+Measurement Job Queue
+In-process, bounded job queue so measurement requests can return a job id immediately
+instead of holding a web worker for the whole inference and database insert.
+Results are polled through /jobs/<id>. No external services are required.
+
+Jobs run in the process that accepted them, but their status and results are kept in a
+SQLite table (JOB_STORE_PATH), so a poll answered by any worker process on the same host
+finds them. Serverless deployments share no disk between instances and freeze background
+threads after the response, so async=1 is not supported there.
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+# Maximum number of jobs waiting to run. Further submissions are refused with 429.
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '32'))
+
+# Threads running jobs. Match the landmarker pool so every job gets a warm detector.
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', os.getenv('LANDMARKER_POOL_SIZE', '2')))
+
+# Seconds a finished job's result stays available for polling
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', '600'))
+
+# SQLite file with job status and results, shared by the worker processes on this host
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH') or os.path.join(tempfile.gettempdir(), 'advance_filter_jobs.sqlite3')
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is full. `retry_after` is a suggested wait in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__("Measurement queue is full")
+        self.retry_after = retry_after
+
+
+class JobStore:
+    """Job status and results in a SQLite table; one connection per thread, as SQLiteStorage."""
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self.connection() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, '
+                               'created_at REAL NOT NULL, finished_at REAL, result TEXT, error TEXT)')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)')
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def create(self, job_id):
+        with self.connection() as connection:
+            connection.execute('INSERT INTO jobs (id, status, created_at) VALUES (?, ?, ?)',
+                               (job_id, 'queued', time.time()))
+
+    def delete(self, job_id):
+        with self.connection() as connection:
+            connection.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def update(self, job_id, status, result=None, error=None):
+        finished_at = time.time() if status in ('done', 'failed') else None
+        with self.connection() as connection:
+            connection.execute('UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?',
+                               (status, finished_at, None if result is None else json.dumps(result), error, job_id))
+
+    def get(self, job_id):
+        row = self.connection().execute('SELECT status, created_at, finished_at, result, error FROM jobs '
+                                        'WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, created_at, finished_at, result, error = row
+        job = {'id': job_id, 'status': status, 'created_at': created_at}
+        if finished_at is not None:
+            job['finished_at'] = finished_at
+        if result is not None:
+            job['result'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def expire(self, cutoff):
+        with self.connection() as connection:
+            connection.execute('DELETE FROM jobs WHERE finished_at < ?', (cutoff,))
+
+
+class JobQueue:
+    """A bounded FIFO of jobs executed by a fixed set of daemon worker threads."""
+
+    def __init__(self, maxsize=JOB_QUEUE_SIZE, workers=JOB_WORKERS, result_ttl=JOB_RESULT_TTL, store=None):
+        self._queue = queue.Queue(maxsize=maxsize)
+        # Opened on the first submit or poll, so /health and /metrics never touch the file
+        self._store = store
+        self._running = 0
+        self._lock = threading.Lock()
+        self._workers = []
+        self.worker_count = max(1, workers)
+        self.result_ttl = result_ttl
+        # Moving average of job run time, used for the Retry-After estimate
+        self._avg_seconds = 1.0
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = JobStore()
+        return self._store
+
+    def _start_workers(self):
+        # Started lazily so forking servers do not inherit dead threads
+        with self._lock:
+            if self._workers:
+                return
+            for i in range(self.worker_count):
+                worker = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs). Returns the job id or raises QueueFullError."""
+        self._start_workers()
+        self._expire()
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id)
+        try:
+            self._queue.put_nowait((job_id, fn, args, kwargs))
+        except queue.Full:
+            self.store.delete(job_id)
+            raise QueueFullError(self.retry_after())
+        return job_id
+
+    def get(self, job_id):
+        """Return the job's state, or None if unknown or expired. Finds jobs of every worker process."""
+        return self.store.get(job_id)
+
+    def retry_after(self):
+        """Seconds until a queue slot is likely to free up."""
+        backlog = self._queue.qsize() / self.worker_count
+        return max(1, int(round(backlog * self._avg_seconds)))
+
+    def stats(self):
+        """Queue depth and running jobs of this process (in-memory counters only)."""
+        return {
+            'queued': self._queue.qsize(),
+            'capacity': self._queue.maxsize,
+            'workers': self.worker_count,
+            'running': self._running,
+        }
+
+    def _run(self):
+        while True:
+            job_id, fn, args, kwargs = self._queue.get()
+            with self._lock:
+                self._running += 1
+            start = time.perf_counter()
+            try:
+                self.store.update(job_id, 'running')
+                result = fn(*args, **kwargs)
+                update = {'status': 'done', 'result': result}
+            except Exception as e:
+                logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+                update = {'status': 'failed', 'error': str(e)}
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+                self._running -= 1
+            try:
+                try:
+                    self.store.update(job_id, **update)
+                except (TypeError, ValueError) as e:
+                    self.store.update(job_id, 'failed', error=f"Result is not JSON serializable: {e}")
+            except sqlite3.Error as e:
+                logger.error(f"Could not store the result of job {job_id}: {e}")
+            self._queue.task_done()
+
+    def _expire(self):
+        self.store.expire(time.time() - self.result_ttl)
+
+
+# ========================================
+# Process-wide queue
+# ========================================
+_job_queue = None
+_job_queue_pid = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Get or create the process-wide job queue (a forked worker gets its own, with its own connections)."""
+    global _job_queue, _job_queue_pid
+    if _job_queue is None or _job_queue_pid != os.getpid():
+        with _job_queue_lock:
+            if _job_queue is None or _job_queue_pid != os.getpid():
+                _job_queue = JobQueue()
+                _job_queue_pid = os.getpid()
+    return _job_queue
@@ -0,0 +1,238 @@
+"""
+Landmark Archive
+Compact on-disk store of the landmarks behind each measurement record, so history can be
+re-measured or drawn in the 3D viewer without running inference again.
+
+One file of fixed-size slots, appended to and read through a memory map:
+  header  64 bytes: magic, point format ('int16' or 'float16'), points per face
+  slot    measurement id (12-byte ObjectId), frame width/height, per-axis scale and offset
+          (int16 only, as landmark_payload.quantize), then the points
+A slot is ~2.9 KB for 478 points, against ~25 KB for the same face as a BSON list of lists.
+Records reference their slot in 'landmark_slot'. Each slot also carries its record's id,
+so the id -> slot index is rebuilt from one scan of the id column and cannot drift from
+the file. Appends take an exclusive file lock, so every worker process can write.
+"""
+
+import base64
+import fcntl
+import logging
+import os
+import struct
+import threading
+
+import numpy as np
+from bson import ObjectId
+
+from landmark_payload import encode_landmarks, quantize
+
+# Directory holding the archive file. Unset disables the archive.
+LANDMARK_ARCHIVE_DIR = os.getenv('LANDMARK_ARCHIVE_DIR', '')
+
+# Point storage: int16 (per-face quantized) or float16
+LANDMARK_ARCHIVE_FORMAT = os.getenv('LANDMARK_ARCHIVE_FORMAT', 'int16')
+
+FORMATS = ('int16', 'float16')
+ARCHIVE_FILE = 'landmarks.bin'
+MAGIC = b'LMARCH01'
+HEADER_BYTES = 64
+NUM_LANDMARKS = 478
+
+logger = logging.getLogger(__name__)
+
+
+def slot_dtype(fmt, points=NUM_LANDMARKS):
+    fields = [('id', 'u1', (12,)), ('frame', '<u4', (2,))]
+    if fmt == 'int16':
+        fields += [('scale', '<f4', (3,)), ('offset', '<f4', (3,)), ('points', '<i2', (points, 3))]
+    else:
+        fields += [('points', '<f2', (points, 3))]
+    return np.dtype(fields)
+
+
+def _object_id(measurement_id):
+    """ObjectId for an ObjectId or its hex string. Raises ValueError."""
+    if isinstance(measurement_id, ObjectId):
+        return measurement_id
+    if not ObjectId.is_valid(measurement_id):
+        raise ValueError("Invalid measurement id.")
+    return ObjectId(measurement_id)
+
+
+class LandmarkArchive:
+    """Append-only slot file with a memory-mapped read side. Safe across threads and processes."""
+
+    def __init__(self, directory=LANDMARK_ARCHIVE_DIR, fmt=LANDMARK_ARCHIVE_FORMAT, points=NUM_LANDMARKS):
+        if fmt not in FORMATS:
+            raise ValueError(f"LANDMARK_ARCHIVE_FORMAT must be one of {', '.join(FORMATS)}")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, ARCHIVE_FILE)
+        self._lock = threading.Lock()
+        self._map = None
+        self._index = {}
+        self._indexed = 0
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self._fd, HEADER_BYTES, 0)
+            if not header:
+                header = struct.pack('<8s8sI', MAGIC, fmt.encode(), points).ljust(HEADER_BYTES, b'\0')
+                os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        magic, stored_fmt, stored_points = struct.unpack_from('<8s8sI', header)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a landmark archive")
+        # An existing file keeps the format it was created with
+        self.format = stored_fmt.rstrip(b'\0').decode()
+        self.points = stored_points
+        self.dtype = slot_dtype(self.format, self.points)
+
+    def __len__(self):
+        return max(0, (os.fstat(self._fd).st_size - HEADER_BYTES) // self.dtype.itemsize)
+
+    # --- Writing ---
+    def append(self, measurement_id, landmarks, frame_dims):
+        """Store one face ((points, 3) normalized landmarks) for a record. Returns its slot."""
+        return self.append_many([measurement_id], [landmarks], [frame_dims])[0]
+
+    def append_many(self, measurement_ids, landmarks, frame_dims):
+        """Store several faces with one locked write. Returns their slots, in order."""
+        slots = np.zeros(len(measurement_ids), dtype=self.dtype)
+        for slot, measurement_id, face, dims in zip(slots, measurement_ids, landmarks, frame_dims):
+            face = np.asarray(face, dtype=np.float32)
+            if face.shape != (self.points, 3):
+                raise ValueError(f"Expected ({self.points}, 3) landmarks, got {face.shape}")
+            slot['id'] = np.frombuffer(_object_id(measurement_id).binary, dtype=np.uint8)
+            slot['frame'] = (dims['width'], dims['height'])
+            if self.format == 'int16':
+                slot['points'], meta = quantize(face, 'int16')
+                slot['scale'], slot['offset'] = meta['scale'], meta['offset']
+            else:
+                slot['points'] = face
+        data = slots.tobytes()
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            first = len(self)
+            os.pwrite(self._fd, data, HEADER_BYTES + first * self.dtype.itemsize)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return list(range(first, first + len(slots)))
+
+    # --- Reading ---
+    def slots(self):
+        """The whole file as a read-only structured array; remapped when other writers have grown it."""
+        count = len(self)
+        with self._lock:
+            if self._map is None or len(self._map) < count:
+                self._map = (np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_BYTES, shape=(count,))
+                             if count else np.zeros(0, dtype=self.dtype))
+            return self._map
+
+    def record(self, slot):
+        """One slot as a zero-copy view into the memory map."""
+        slots = self.slots()
+        if not 0 <= slot < len(slots):
+            raise IndexError(f"Landmark slot {slot} out of range")
+        return slots[slot]
+
+    def decode(self, records):
+        """(landmarks float32 (B, points, 3), widths, heights) for a structured array of slots."""
+        points = records['points'].astype(np.float32)
+        if self.format == 'int16':
+            points = points * records['scale'][:, np.newaxis, :] + records['offset'][:, np.newaxis, :]
+        return points, records['frame'][:, 0], records['frame'][:, 1]
+
+    def read(self, slot):
+        """(landmarks (points, 3) float32, frame_dims) for one slot."""
+        self.record(slot)
+        landmarks, widths, heights = self.decode(self.slots()[slot:slot + 1])
+        return landmarks[0], {'width': int(widths[0]), 'height': int(heights[0])}
+
+    def measurement_id(self, slot):
+        return ObjectId(self.record(slot)['id'].tobytes())
+
+    def slot_of(self, measurement_id):
+        """Slot of a record's landmarks, or None. Raises ValueError for a malformed id."""
+        key = _object_id(measurement_id).binary
+        with self._lock:
+            slot = self._index.get(key)
+        if slot is not None:
+            return slot
+        # Index the slots appended since the last lookup (by any process)
+        slots = self.slots()
+        with self._lock:
+            start = self._indexed
+            ids = np.ascontiguousarray(slots['id'][start:]).tobytes()
+            for i in range(len(slots) - start):
+                self._index[ids[i * 12:(i + 1) * 12]] = start + i
+            self._indexed = len(slots)
+            return self._index.get(key)
+
+    def encode(self, slot, options):
+        """
+        (landmarks value, landmark indices or None, raw bytes or None) as
+        landmark_payload.encode_landmarks. When the requested format is the stored one, the
+        stored points and scale/offset are sent as they are, without decoding.
+        """
+        record = self.record(slot)
+        if options['format'] != self.format or options['subset'] != 'all':
+            landmarks, _ = self.read(slot)
+            return encode_landmarks(landmarks, options)
+        value = {'format': self.format, 'shape': list(record['points'].shape)}
+        if self.format == 'int16':
+            value.update(scale=record['scale'].tolist(), offset=record['offset'].tolist())
+        raw = record['points'].tobytes()
+        if options['encoding'] == 'binary':
+            return value, None, raw
+        value['data'] = base64.b64encode(raw).decode('ascii')
+        return value, None, None
+
+    def close(self):
+        with self._lock:
+            self._map = None
+        os.close(self._fd)
+
+
+def attach_slots(documents, landmarks, frame_dims):
+    """
+    Archive each document's landmarks and reference the slot from the document
+    ('landmark_slot'); documents get their _id here. Does nothing when the archive is off.
+    `frame_dims` is one dict for all documents or one per document. Never raises: a failed
+    write leaves the documents without a slot.
+    """
+    archive = get_landmark_archive()
+    if archive is None or not documents:
+        return
+    if isinstance(frame_dims, dict):
+        frame_dims = [frame_dims] * len(documents)
+    for document in documents:
+        document.setdefault('_id', ObjectId())
+    try:
+        slots = archive.append_many([document['_id'] for document in documents], landmarks, frame_dims)
+    except (OSError, ValueError) as e:
+        logger.error(f"Landmark archive write failed: {e}")
+        return
+    for document, slot in zip(documents, slots):
+        document['landmark_slot'] = slot
+
+
+# ========================================
+# Process-wide archive
+# ========================================
+_archive = None
+_archive_pid = None
+_archive_lock = threading.Lock()
+
+
+def get_landmark_archive():
+    """Get or open the configured archive, or None when LANDMARK_ARCHIVE_DIR is unset."""
+    global _archive, _archive_pid
+    if not LANDMARK_ARCHIVE_DIR:
+        return None
+    # File locks and descriptors are per process; a forked worker opens its own
+    if _archive is None or _archive_pid != os.getpid():
+        with _archive_lock:
+            if _archive is None or _archive_pid != os.getpid():
+                _archive = LandmarkArchive()
+                _archive_pid = os.getpid()
+    return _archive
@@ -0,0 +1,166 @@
+"""
+Landmark Payloads
+Encodes the landmarks returned by /process_image (per face in multi-face mode). Plain JSON
+lists stay the default; clients can ask for a compact form instead:
+  landmark_format   json (default), float32, float16 or int16
+  landmark_subset   all (default) or viewer - only the points the 3D viewer draws
+  landmark_encoding base64 (default) or binary; 'Accept: application/octet-stream'
+                    also selects binary
+Compact formats replace the list with
+  {"format", "shape", "data" (base64, little-endian)} plus "scale" and "offset" for int16,
+where value = q * scale + offset per axis. A viewer subset adds "landmarkIndices".
+
+A binary body is: uint32 little-endian header length, the JSON header (the usual
+response with "data" omitted, padded to 8 bytes), then the raw landmark array.
+"""
+
+import base64
+import json
+import struct
+
+import numpy as np
+from flask import Response, jsonify
+
+FORMATS = ('json', 'float32', 'float16', 'int16')
+SUBSETS = ('all', 'viewer')
+ENCODINGS = ('base64', 'binary')
+
+BINARY_MIMETYPE = 'application/octet-stream'
+
+# Face mesh contours drawn by the 3D viewer, plus the points the measurements use
+FACE_OVAL = [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377,
+             152, 148, 176, 149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
+LEFT_EYE = [263, 249, 390, 373, 374, 380, 381, 382, 362, 466, 388, 387, 386, 385, 384, 398]
+RIGHT_EYE = [33, 7, 163, 144, 145, 153, 154, 155, 133, 246, 161, 160, 159, 158, 157, 173]
+LEFT_EYEBROW = [276, 283, 282, 295, 285, 300, 293, 334, 296, 336]
+RIGHT_EYEBROW = [46, 53, 52, 65, 55, 70, 63, 105, 66, 107]
+LIPS = [61, 146, 91, 181, 84, 17, 314, 405, 321, 375, 291, 185, 40, 39, 37, 0, 267, 269, 270, 409,
+        78, 95, 88, 178, 87, 14, 317, 402, 318, 324, 308, 191, 80, 81, 82, 13, 312, 311, 310, 415]
+NOSE = [1, 2, 4, 5, 6, 19, 94, 98, 168, 195, 197, 327]
+IRISES = list(range(468, 478))
+MEASUREMENT_POINTS = [27]
+
+VIEWER_LANDMARKS = np.array(sorted(set(FACE_OVAL + LEFT_EYE + RIGHT_EYE + LEFT_EYEBROW + RIGHT_EYEBROW
+                                       + LIPS + NOSE + IRISES + MEASUREMENT_POINTS)), dtype=np.intp)
+
+DEFAULT_OPTIONS = {'format': 'json', 'subset': 'all', 'encoding': 'base64'}
+
+
+def _choice(value, allowed, name):
+    if value not in allowed:
+        raise ValueError(f"{name} must be one of: {', '.join(allowed)}")
+    return value
+
+
+def parse_options(args, accept=None):
+    """
+    Landmark options from request parameters (query string or form) and the Accept header.
+    Raises ValueError on unknown values.
+    """
+    binary_accepted = (accept is not None
+                       and accept.best_match(['application/json', BINARY_MIMETYPE]) == BINARY_MIMETYPE)
+    options = {
+        'format': _choice(args.get('landmark_format', 'json'), FORMATS, 'landmark_format'),
+        'subset': _choice(args.get('landmark_subset', 'all'), SUBSETS, 'landmark_subset'),
+        'encoding': _choice(args.get('landmark_encoding', 'binary' if binary_accepted else 'base64'),
+                            ENCODINGS, 'landmark_encoding'),
+    }
+    # A binary body carries raw arrays, so plain JSON lists become float32
+    if options['encoding'] == 'binary' and options['format'] == 'json':
+        options['format'] = 'float32'
+    return options
+
+
+def quantize(landmarks, fmt):
+    """(array, metadata) for a landmark array in a compact format."""
+    if fmt == 'float32':
+        return np.ascontiguousarray(landmarks, dtype='<f4'), {}
+    if fmt == 'float16':
+        return np.ascontiguousarray(landmarks, dtype='<f2'), {}
+    # int16: per-axis midpoint and step, so each axis spans the full int16 range
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    low, high = landmarks.min(axis=0), landmarks.max(axis=0)
+    offset = (low + high) / 2
+    scale = np.maximum((high - low) / 65534, np.finfo(np.float32).tiny)
+    quantized = np.rint((landmarks - offset) / scale).astype('<i2')
+    return quantized, {'scale': scale.tolist(), 'offset': offset.tolist()}
+
+
+def dequantize(payload, data):
+    """Inverse of quantize() for a decoded payload dict and its raw bytes. Used by the benchmarks."""
+    dtype = {'float32': '<f4', 'float16': '<f2', 'int16': '<i2'}[payload['format']]
+    array = np.frombuffer(data, dtype=dtype).reshape(payload['shape']).astype(np.float64)
+    if payload['format'] == 'int16':
+        array = array * np.asarray(payload['scale']) + np.asarray(payload['offset'])
+    return array
+
+
+def encode_landmarks(landmarks, options=DEFAULT_OPTIONS):
+    """
+    (landmarks value, landmark indices or None, raw bytes or None) for a response.
+    Raw bytes are returned instead of base64 data when the encoding is binary.
+    """
+    landmarks = np.asarray(landmarks)
+    indices = None
+    if options['subset'] == 'viewer':
+        indices = VIEWER_LANDMARKS[VIEWER_LANDMARKS < len(landmarks)]
+        landmarks = landmarks[indices]
+        indices = indices.tolist()
+
+    if options['format'] == 'json':
+        return landmarks.tolist(), indices, None
+
+    array, meta = quantize(landmarks, options['format'])
+    value = {'format': options['format'], 'shape': list(array.shape), **meta}
+    if options['encoding'] == 'binary':
+        return value, indices, array.tobytes()
+    value['data'] = base64.b64encode(array.tobytes()).decode('ascii')
+    return value, indices, None
+
+
+def build_payload(measurements, landmarks, frame_dims, options=DEFAULT_OPTIONS):
+    """(response dict, raw bytes or None) for a measurement result."""
+    value, indices, raw = encode_landmarks(landmarks, options)
+    payload = {
+        "measurements": measurements,
+        "landmarks": value,
+        "frameDimensions": frame_dims
+    }
+    if indices is not None:
+        payload['landmarkIndices'] = indices
+    return payload, raw
+
+
+def build_faces_payload(faces, frame_dims, options=DEFAULT_OPTIONS):
+    """
+    Response dict for analyze_faces() results: each face's landmarks encoded as for a single face.
+    Always JSON: a binary request is answered with base64 arrays.
+    """
+    options = dict(options, encoding='base64')
+    encoded = []
+    for face in faces:
+        value, indices, _ = encode_landmarks(face['landmarks'], options)
+        face = dict(face, landmarks=value)
+        if indices is not None:
+            face['landmarkIndices'] = indices
+        encoded.append(face)
+    return {
+        "faces": encoded,
+        "count": len(encoded),
+        "frameDimensions": frame_dims
+    }
+
+
+def binary_body(payload, raw):
+    """Length-prefixed JSON header followed by the raw landmark array."""
+    header = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    # Pad so the array starts 8-byte aligned and can be viewed as a typed array directly
+    header += b' ' * (-(4 + len(header)) % 8)
+    return struct.pack('<I', len(header)) + header + raw
+
+
+def payload_response(payload, raw):
+    """Flask response for build_payload()'s result: JSON, or the binary body when raw bytes are present."""
+    if raw is None:
+        return jsonify(payload)
+    return Response(binary_body(payload, raw), mimetype=BINARY_MIMETYPE)
@@ -0,0 +1,221 @@
+"""
+FaceLandmarker Pool
+Keeps warm MediaPipe FaceLandmarker instances alive for the lifetime of the process
+so requests no longer pay for graph setup and model load on every call.
+"""
+
+import atexit
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from metrics import span
+
+# Number of warm detectors kept per process. Each detector is checked out for
+# exclusive use because FaceLandmarker instances are not thread-safe.
+DEFAULT_POOL_SIZE = int(os.getenv('LANDMARKER_POOL_SIZE', '2'))
+
+# Seconds to wait for a free detector before giving up.
+DEFAULT_ACQUIRE_TIMEOUT = float(os.getenv('LANDMARKER_ACQUIRE_TIMEOUT', '30'))
+
+
+class PoolClosedError(RuntimeError):
+    """Raised when a detector is requested from a pool that has been shut down."""
+
+
+class LandmarkerPool:
+    """
+    A bounded pool of FaceLandmarker instances.
+    Detectors are created lazily on first demand, up to `size`, and reused afterwards.
+    """
+
+    def __init__(self, factory, size=DEFAULT_POOL_SIZE, acquire_timeout=DEFAULT_ACQUIRE_TIMEOUT):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self._factory = factory
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._discarded = 0
+        self._closed = False
+
+    def _create_or_wait(self, timeout):
+        """Return an idle detector, create a new one if below capacity, or wait for one."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                with span('model_create'):
+                    return self._factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No FaceLandmarker available after {timeout}s")
+
+    def acquire(self, timeout=None):
+        """Check out a detector for exclusive use. Pair with release()."""
+        if self._closed:
+            raise PoolClosedError("Landmarker pool has been shut down")
+        with span('pool_acquire'):
+            detector = self._create_or_wait(self.acquire_timeout if timeout is None else timeout)
+        with self._lock:
+            self._in_use += 1
+        return detector
+
+    def release(self, detector, broken=False):
+        """Return a detector to the pool. Broken detectors are closed and replaced lazily."""
+        with self._lock:
+            self._in_use -= 1
+            if broken or self._closed:
+                self._created -= 1
+                if broken:
+                    self._discarded += 1
+                close = True
+            else:
+                close = False
+        if close:
+            _close_quietly(detector)
+        else:
+            self._idle.put(detector)
+
+    @contextmanager
+    def detector(self, timeout=None):
+        """
+        Context manager that checks out a detector and returns it afterwards.
+        If the body raises a non-ValueError exception the detector is discarded,
+        since its internal graph state can no longer be trusted.
+        """
+        detector = self.acquire(timeout)
+        broken = False
+        try:
+            yield detector
+        except ValueError:
+            raise
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(detector, broken=broken)
+
+    def warm(self, count=None):
+        """Eagerly create detectors so the first requests do not pay for model load."""
+        count = self.size if count is None else min(count, self.size)
+        detectors = [self.acquire() for _ in range(count)]
+        for detector in detectors:
+            self.release(detector)
+
+    def health_check(self):
+        """Return pool statistics. `ok` is False once the pool has been shut down."""
+        with self._lock:
+            return {
+                'ok': not self._closed,
+                'size': self.size,
+                'created': self._created,
+                'in_use': self._in_use,
+                'idle': self._idle.qsize(),
+                'discarded': self._discarded,
+            }
+
+    def shutdown(self):
+        """Close every idle detector. Detectors still checked out are closed on release."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                detector = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            _close_quietly(detector)
+
+
+def _close_quietly(detector):
+    try:
+        detector.close()
+    except Exception:
+        pass
+
+
+# ========================================
+# Process-wide pools
+# ========================================
+# Pool kinds and the measurement_logic factory that builds one detector of that kind.
+POOL_FACTORIES = {
+    'landmarker': 'create_landmarker',
+    'face_detector': 'create_face_detector',
+    'multi_face': 'create_multi_face_landmarker',
+}
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(kind='landmarker'):
+    """Get or create the process-wide detector pool of the given kind."""
+    pool = _pools.get(kind)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(kind)
+            if pool is None:
+                import measurement_logic
+                factory = getattr(measurement_logic, POOL_FACTORIES[kind])
+                pool = _pools[kind] = LandmarkerPool(factory, size=DEFAULT_POOL_SIZE)
+    return pool
+
+
+def shutdown_pool():
+    """Shut down every process-wide pool that was created."""
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
+
+
+def warm_pools():
+    """
+    Create every pool's detectors up front, e.g. when a server worker starts, so the first
+    requests do not pay for model load. Failures are reported, not raised.
+    """
+    from preprocess import FACE_ROI_CROP
+
+    for kind in POOL_FACTORIES:
+        if kind == 'face_detector' and not FACE_ROI_CROP:
+            continue
+        if kind == 'multi_face':
+            # Only group fittings use it; created on first use
+            continue
+        try:
+            get_pool(kind).warm()
+        except Exception as e:
+            print(f"Warm-up of the {kind} pool failed in process {os.getpid()}: {e}")
+
+
+def pool_health():
+    """Health summary for the /health endpoint, keyed by pool kind. Does not create pools."""
+    with _pool_lock:
+        pools = dict(_pools)
+    if not pools:
+        return {'landmarker': {'ok': True, 'size': DEFAULT_POOL_SIZE, 'created': 0,
+                               'in_use': 0, 'idle': 0, 'discarded': 0}}
+    return {kind: pool.health_check() for kind, pool in pools.items()}
+
+
+atexit.register(shutdown_pool)
@@ -1,13 +1,23 @@
 from PIL import Image
 import numpy as np
-import math
+import io
 import os
-import urllib.request
+import atexit
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-# MediaPipe Tasks API
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
+# MediaPipe Tasks API is imported where it is used: it takes seconds to import and
+# the health and login paths never need it
+
+from landmarker_pool import get_pool
+from metrics import FACES_NOT_FOUND, span
+from model_assets import model_path
+from preprocess import prepare_image
+from frame_quality import FrameRejectedError, check_sharpness, score_landmarks
+from pupil_refine import PUPIL_REFINEMENT, refine_pupils
+from result_cache import get_result_cache, image_key
 
 # --- Landmark Indices (from MediaPipe Face Mesh) ---
 LEFT_PUPIL = 473
@@ -20,104 +30,457 @@ NOSE_TIP = 1
 FOREHEAD = 10
 CHIN = 152
 
-# Model file path - use /tmp for Vercel serverless (read-only filesystem)
-import tempfile
-MODEL_PATH = os.path.join(tempfile.gettempdir(), 'face_landmarker.task')
-MODEL_URL = 'https://storage.googleapis.com/mediapipe-models/face_landmarker/face_landmarker/float16/1/face_landmarker.task'
 
+# Most faces the multi-face mode looks for in one image
+MULTI_FACE_MAX_FACES = int(os.getenv('MULTI_FACE_MAX_FACES', '6'))
+
+# Measure single images in a pose-normalized frame: the landmarker also outputs the facial
+# transformation matrix, and the measured landmarks are rotated back to a frontal pose first
+POSE_CORRECTION = os.getenv('POSE_CORRECTION', '0') == '1'
 
-def download_model_if_needed():
-    """Download the face landmarker model if it doesn't exist."""
-    if not os.path.exists(MODEL_PATH):
-        print(f"Downloading face landmarker model to {MODEL_PATH}...")
-        urllib.request.urlretrieve(MODEL_URL, MODEL_PATH)
-        print("Download complete.")
-    return MODEL_PATH
+# Landmark axes to the transformation matrix's camera axes: image y points down and landmark z
+# away from the camera; the matrix's space has y up and z towards the camera
+_IMAGE_TO_CAMERA = np.array([1.0, -1.0, -1.0])
 
 
-def analyze_image(image_path, frame_width_mm):
+def create_landmarker(running_mode=None, num_faces=1, transformation_matrix=None):
     """
-    Analyzes a single image to find facial landmarks and calculate optical measurements.
-    Uses the new MediaPipe Tasks API.
+    Create a single FaceLandmarker. IMAGE mode (the default) is what the landmarker pool uses;
+    VIDEO mode keeps a face tracker between frames and needs increasing timestamps.
+    `transformation_matrix` defaults to POSE_CORRECTION.
     """
-    # Ensure model is downloaded
-    model_path = download_model_if_needed()
-    
-    # Create FaceLandmarker
-    base_options = python.BaseOptions(model_asset_path=model_path)
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+
+    base_options = python.BaseOptions(model_asset_path=model_path('face_landmarker'))
     options = vision.FaceLandmarkerOptions(
         base_options=base_options,
+        running_mode=running_mode or vision.RunningMode.IMAGE,
         output_face_blendshapes=False,
-        output_facial_transformation_matrixes=False,
-        num_faces=1
+        output_facial_transformation_matrixes=POSE_CORRECTION if transformation_matrix is None else transformation_matrix,
+        num_faces=num_faces
     )
-    
-    detector = vision.FaceLandmarker.create_from_options(options)
-    
-    # Load and process image
+    return vision.FaceLandmarker.create_from_options(options)
+
+
+def create_multi_face_landmarker():
+    """Create a FaceLandmarker that returns up to MULTI_FACE_MAX_FACES faces. Used by the multi_face pool."""
+    return create_landmarker(num_faces=MULTI_FACE_MAX_FACES)
+
+
+def create_face_detector():
+    """Create a BlazeFace FaceDetector for the face-box pass. Used by the detector pool."""
+    from mediapipe.tasks import python
+    from mediapipe.tasks.python import vision
+
+    base_options = python.BaseOptions(model_asset_path=model_path('face_detector'))
+    options = vision.FaceDetectorOptions(base_options=base_options, min_detection_confidence=0.5)
+    return vision.FaceDetector.create_from_options(options)
+
+
+def load_image_rgb(image_source):
+    """
+    Load an image as a contiguous uint8 RGB array.
+    Accepts a file path, raw encoded bytes, a readable file-like object, or an RGB NumPy array.
+    """
+    if isinstance(image_source, np.ndarray):
+        if image_source.ndim != 3 or image_source.shape[2] != 3:
+            raise ValueError("Error: Image array must have shape (height, width, 3).")
+        return np.ascontiguousarray(image_source, dtype=np.uint8)
+
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        image_source = io.BytesIO(image_source)
+
     try:
-        pil_image = Image.open(image_path)
+        pil_image = Image.open(image_source)
+        pil_image.load()
     except Exception:
         raise ValueError("Error: Could not read image file.")
 
     # Convert to RGB (MediaPipe needs RGB)
-    pil_image = pil_image.convert('RGB')
-    image_rgb = np.array(pil_image)
-    
-    frame_height_px, frame_width_px, _ = image_rgb.shape
-    frame_dims = {"width": frame_width_px, "height": frame_height_px}
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return np.asarray(pil_image)
+
+
+def pose_rotation(matrix):
+    """Rotation part of a facial transformation matrix (4x4 or 3x3, or a stack of them), orthonormalized."""
+    u, _, vt = np.linalg.svd(np.asarray(matrix, dtype=np.float64)[..., :3, :3])
+    return u @ vt
+
+
+def pose_angles(rotation):
+    """(yaw, pitch, roll) in degrees for a rotation or a stack of rotations (R = Rz(roll) Ry(yaw) Rx(pitch))."""
+    yaw = np.degrees(np.arcsin(np.clip(-rotation[..., 2, 0], -1.0, 1.0)))
+    pitch = np.degrees(np.arctan2(rotation[..., 2, 1], rotation[..., 2, 2]))
+    roll = np.degrees(np.arctan2(rotation[..., 1, 0], rotation[..., 0, 0]))
+    return yaw, pitch, roll
+
+
+def pose_normalize(points, frame_size, rotation):
+    """
+    Rotate normalized landmarks (B, K, 3) back to a frontal pose about their centroid.
+    `frame_size` is (B, 2) pixels and `rotation` (B, 3, 3). The rotation is undone in pixel
+    units (landmark z shares the x scale), and the result is normalized again, so the
+    measurement formulas apply unchanged.
+    """
+    scale = np.concatenate([frame_size, frame_size[:, :1]], axis=-1)[:, np.newaxis]
+    center = np.zeros_like(points[:, :1])
+    center[..., :2] = points[..., :2].mean(axis=1, keepdims=True)
+    camera = (points - center) * scale * _IMAGE_TO_CAMERA
+    # Row vectors: p @ R applies R's inverse (its transpose)
+    frontal = camera @ rotation
+    return frontal * _IMAGE_TO_CAMERA / scale + center
+
+
+def compute_measurements(landmarks, frame_width_px, frame_height_px, frame_width_mm, pose=None):
+    """
+    Vectorized measurement kernel.
+    `landmarks` is one face as an (N, 3) array of normalized landmarks, or a stack of
+    faces as (B, N, 3). Frame sizes and `frame_width_mm` are scalars or length-B arrays.
+    With `pose`, the face's transformation matrix (or one per face), the measured landmarks
+    are rotated to a frontal pose first and 'yaw', 'pitch' and 'roll' (degrees) are added.
+    Returns a dict of floats for a single face, or a dict of length-B arrays for a stack
+    (rows without a usable reference width are NaN).
+    """
+    landmarks = np.asarray(landmarks)
+    single = landmarks.ndim == 2
+    if single:
+        landmarks = landmarks[np.newaxis]
+
+    # Gather only the landmarks the formulas use, then work in float64
+    picked = landmarks[:, [LEFT_REFERENCE, RIGHT_REFERENCE, LEFT_PUPIL, RIGHT_PUPIL,
+                           LEFT_EYE_LOWER_LID, FOREHEAD, CHIN, NOSE_TIP]].astype(np.float64)
+
+    frame_size = np.stack(np.broadcast_arrays(
+        np.asarray(frame_width_px, dtype=np.float64),
+        np.asarray(frame_height_px, dtype=np.float64)), axis=-1)
+
+    if pose is not None:
+        rotation = np.broadcast_to(pose_rotation(pose), (len(picked), 3, 3))
+        picked = pose_normalize(picked, np.broadcast_to(frame_size, (len(picked), 2)), rotation)
+
+    left_ref, right_ref, left_pupil, right_pupil, lower_lid, forehead, chin, nose = (
+        picked[:, i] for i in range(picked.shape[1]))
+
+    # --- Pixel to MM Conversion ---
+    ref_width_px = np.hypot(*((right_ref[:, :2] - left_ref[:, :2]) * frame_size).T)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mm_per_pixel = np.where(ref_width_px > 0, np.asarray(frame_width_mm, dtype=np.float64) / ref_width_px, np.nan)
+    if single and not np.isfinite(mm_per_pixel[0]):
+        raise ValueError("Could not establish a reference width for measurement.")
+
+    # --- Measurement Calculations ---
+    pd_mm = np.hypot(*((right_pupil[:, :2] - left_pupil[:, :2]) * frame_size).T) * mm_per_pixel
+
+    eye_height_px = np.abs(lower_lid[:, 1] - left_pupil[:, 1]) * frame_size[..., 1]
+    fh_mm = eye_height_px * mm_per_pixel + FITTING_HEIGHT_OFFSET
+
+    tilt_deg = np.abs(np.degrees(np.arctan2(chin[:, 2] - forehead[:, 2], 0.2)))
+    vertex_mm = np.abs(nose[:, 2]) * 100 + 8
+
+    measurements = {
+        "pd": pd_mm,
+        "fh": fh_mm,
+        "tilt": np.minimum(tilt_deg, 15.0),
+        "vertex": np.minimum(vertex_mm, 14.0)
+    }
+    if pose is not None:
+        measurements["yaw"], measurements["pitch"], measurements["roll"] = pose_angles(rotation)
+    if single:
+        return {key: float(value[0]) for key, value in measurements.items()}
+    return measurements
+
+
+def detect_landmarks(image_source, quality_check=False, with_pose=False):
+    """
+    Run the landmarker on an image source and return (landmarks, frame_dims).
+    `landmarks` is an (N, 3) float32 array normalized to the original frame.
+    With `quality_check`, blurred frames raise FrameRejectedError before inference.
+    With `with_pose`, returns (landmarks, frame_dims, pose): the face's 4x4 transformation
+    matrix, or None when the landmarker does not output it (POSE_CORRECTION off).
+    """
+    # Decode at reduced scale and crop to the face; frame dims stay those of the original upload
+    prepared, roi = prepare_image(image_source)
+    if quality_check:
+        check_sharpness(roi.image_rgb)
+
+    import mediapipe as mp
 
     # Create MediaPipe Image (already RGB)
-    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=image_rgb)
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=roi.image_rgb)
     
-    # Detect face landmarks
-    detection_result = detector.detect(mp_image)
+    # Detect face landmarks with a pooled detector (exclusive while checked out)
+    with get_pool().detector() as detector:
+        with span('detect'):
+            detection_result = detector.detect(mp_image)
     
     if not detection_result.face_landmarks:
+        FACES_NOT_FOUND.inc()
         raise ValueError("No face detected in the image.")
     
-    # Get landmarks (first face)
+    # Get landmarks (first face), mapped from the ROI back onto the original frame
     face_landmarks = detection_result.face_landmarks[0]
-    
-    # Convert to the format expected by the rest of the code
-    class LandmarkWrapper:
-        def __init__(self, lm):
-            self.x = lm.x
-            self.y = lm.y
-            self.z = lm.z
-    
-    landmarks = [LandmarkWrapper(lm) for lm in face_landmarks]
-    
-    # --- Pixel to MM Conversion ---
-    left_ref_pt = landmarks[LEFT_REFERENCE]
-    right_ref_pt = landmarks[RIGHT_REFERENCE]
-    ref_width_px = math.sqrt(((right_ref_pt.x - left_ref_pt.x) * frame_width_px)**2 + 
-                             ((right_ref_pt.y - left_ref_pt.y) * frame_height_px)**2)
-    if ref_width_px == 0:
-        raise ValueError("Could not establish a reference width for measurement.")
-    mm_per_pixel = frame_width_mm / ref_width_px
+    points = np.array([(lm.x, lm.y, lm.z) for lm in face_landmarks], dtype=np.float64)
+    landmarks = roi.to_frame_coordinates(points).astype(np.float32)
+    if PUPIL_REFINEMENT:
+        # Eye windows are read from the decoded image, which covers the whole frame
+        with span('pupil_refine'):
+            landmarks = refine_pupils(prepared, landmarks)
+    if not with_pose:
+        return landmarks, prepared.frame_dims
+    # Cropping and downscaling move and scale the face but leave its rotation unchanged
+    matrices = detection_result.facial_transformation_matrixes
+    pose = np.asarray(matrices[0], dtype=np.float32) if matrices else None
+    return landmarks, prepared.frame_dims, pose
 
-    # --- Measurement Calculations ---
-    left_pupil_pt = landmarks[LEFT_PUPIL]
-    right_pupil_pt = landmarks[RIGHT_PUPIL]
-    pd_px = math.sqrt(((right_pupil_pt.x - left_pupil_pt.x) * frame_width_px)**2 + 
-                      ((right_pupil_pt.y - left_pupil_pt.y) * frame_height_px)**2)
-    pd_mm = pd_px * mm_per_pixel
-
-    lower_lid_pt = landmarks[LEFT_EYE_LOWER_LID]
-    eye_height_px = abs(lower_lid_pt.y - left_pupil_pt.y) * frame_height_px
-    eye_height_mm = eye_height_px * mm_per_pixel
-    fh_mm = eye_height_mm + FITTING_HEIGHT_OFFSET
-
-    forehead_z = landmarks[FOREHEAD].z
-    chin_z = landmarks[CHIN].z
-    tilt_rad = math.atan2(chin_z - forehead_z, 0.2)
-    tilt_deg = abs(math.degrees(tilt_rad))
-
-    vertex_mm = (abs(landmarks[NOSE_TIP].z) * 100) + 8 
-
-    measurements = { "pd": pd_mm, "fh": fh_mm, "tilt": min(tilt_deg, 15.0), "vertex": min(vertex_mm, 14.0) }
-    landmarks_for_3d = [[lm.x, lm.y, lm.z] for lm in landmarks]
-    
-    detector.close()
-    return measurements, landmarks_for_3d, frame_dims
\ No newline at end of file
+
+def analyze_image(image_source, frame_width_mm, pose_correction=None):
+    """
+    Analyzes a single image to find facial landmarks and calculate optical measurements.
+    `image_source` is a file path, encoded image bytes, a file-like object or an RGB NumPy array.
+    Uses the new MediaPipe Tasks API with a warm detector from the process-wide pool.
+    Repeated images are served from the result cache without running inference again.
+    Landmarks are returned as an (N, 3) float32 array; landmark_payload encodes them for the response.
+    With `pose_correction` (default POSE_CORRECTION) measurements are taken in a pose-normalized
+    frame when the landmarker provides the transformation matrix.
+    """
+    pose_correction = POSE_CORRECTION if pose_correction is None else pose_correction
+    cache = get_result_cache()
+    if not cache.enabled:
+        landmarks, frame_dims, pose = detect_landmarks(image_source, with_pose=True)
+        with span('measure'):
+            measurements = compute_measurements(landmarks, frame_dims['width'], frame_dims['height'],
+                                                frame_width_mm, pose=pose if pose_correction else None)
+        return measurements, landmarks, frame_dims
+
+    with span('cache_lookup'):
+        key, image_source = image_key(image_source)
+        entry = cache.get(key)
+    if entry is None:
+        entry = cache.put(key, *detect_landmarks(image_source, with_pose=True))
+    with span('measure'):
+        measurements = cache.measurements(entry, frame_width_mm, compute_measurements, pose_correction)
+
+    return measurements, entry.landmarks, entry.frame_dims
+
+
+# ========================================
+# Multi-Face Processing
+# ========================================
+def detect_faces(image_source):
+    """
+    Run the multi-face landmarker on an image source and return (landmarks, frame_dims).
+    `landmarks` is an (F, N, 3) float32 stack, one row per face, normalized to the original frame.
+    The face-ROI crop is skipped: it would keep only one face.
+    """
+    prepared, _ = prepare_image(image_source, roi_crop=False)
+
+    import mediapipe as mp
+
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=prepared.image_rgb)
+    with get_pool('multi_face').detector() as detector:
+        with span('detect'):
+            detection_result = detector.detect(mp_image)
+
+    if not detection_result.face_landmarks:
+        FACES_NOT_FOUND.inc()
+        raise ValueError("No face detected in the image.")
+
+    points = np.array([[(lm.x, lm.y, lm.z) for lm in face] for face in detection_result.face_landmarks],
+                      dtype=np.float64)
+    return prepared.to_frame_coordinates(points).astype(np.float32), prepared.frame_dims
+
+
+def face_boxes(landmarks, frame_dims):
+    """Pixel bounding box (left, top, right, bottom) of each face in an (F, N, 3) stack."""
+    size = np.array([frame_dims['width'], frame_dims['height']], dtype=np.float64)
+    xy = landmarks[..., :2].astype(np.float64) * size
+    low = np.clip(np.floor(xy.min(axis=1)), 0, size)
+    high = np.clip(np.ceil(xy.max(axis=1)), 0, size)
+    return np.concatenate([low, high], axis=1).astype(int)
+
+
+def analyze_faces(image_source, frame_width_mm):
+    """
+    Detect every face in one inference pass and measure all of them with one vectorized call.
+    Each face gets its own pixel-to-mm scale from its own reference landmarks.
+    Returns (faces, frame_dims). `faces` is ordered left to right; each entry has 'position',
+    'box' (pixels on the original frame), 'quality', 'landmarks' and either 'measurements'
+    or 'error'.
+    """
+    landmarks, frame_dims = detect_faces(image_source)
+    boxes = face_boxes(landmarks, frame_dims)
+    # Left to right by box centre, so 'position' matches how people stand in the picture
+    order = np.argsort(boxes[:, 0] + boxes[:, 2], kind='stable')
+    landmarks, boxes = landmarks[order], boxes[order]
+
+    with span('measure'):
+        batch = compute_measurements(landmarks, frame_dims['width'], frame_dims['height'], frame_width_mm)
+        quality = score_landmarks(landmarks)
+
+    faces = []
+    for position in range(len(landmarks)):
+        left, top, right, bottom = (int(v) for v in boxes[position])
+        face = {
+            'position': position,
+            'box': {'left': left, 'top': top, 'right': right, 'bottom': bottom},
+            'quality': {
+                'score': float(quality['score'][position]),
+                'yaw_ratio': float(quality['yaw_ratio'][position]),
+                'eye_openness': float(quality['eye_openness'][position]),
+            },
+            'landmarks': landmarks[position],
+        }
+        if np.isfinite(batch['pd'][position]):
+            face['measurements'] = {key: float(values[position]) for key, values in batch.items()}
+        else:
+            face['error'] = "Could not establish a reference width for measurement."
+        faces.append(face)
+    return faces, frame_dims
+
+
+# ========================================
+# Batch Processing
+# ========================================
+# Worker processes used by analyze_images. Each worker keeps its own warm landmarker.
+MEASUREMENT_WORKERS = int(os.getenv('MEASUREMENT_WORKERS', str(os.cpu_count() or 1)))
+MEASUREMENT_MP_START = os.getenv('MEASUREMENT_MP_START', 'spawn')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    """Process pool initializer: one warm detector per worker process."""
+    import landmarker_pool
+    landmarker_pool.DEFAULT_POOL_SIZE = 1
+    try:
+        get_pool().warm()
+    except Exception as e:
+        # Leave creation to the first task so the failure is reported per image
+        print(f"Landmarker warm-up failed in worker {os.getpid()}: {e}")
+
+
+def _detect_item(image_source, quality_check=False):
+    """Run detect_landmarks and turn the outcome into a per-item result dict."""
+    try:
+        landmarks, frame_dims = detect_landmarks(image_source, quality_check)
+    except FrameRejectedError as e:
+        return {'success': False, 'error': str(e), 'rejected': e.reason}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    return {'success': True, 'landmarks': landmarks, 'frameDimensions': frame_dims}
+
+
+def get_executor(workers=None):
+    """Get or create the process-wide measurement worker pool."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            context = multiprocessing.get_context(MEASUREMENT_MP_START)
+            _executor = ProcessPoolExecutor(
+                max_workers=workers or MEASUREMENT_WORKERS,
+                mp_context=context,
+                initializer=_init_worker
+            )
+    return _executor
+
+
+def shutdown_executor():
+    """Stop the measurement worker processes if they were started."""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def analyze_images(paths_or_arrays, frame_width_mm, executor=None, quality_filter=False):
+    """
+    Analyzes several images in parallel across worker processes.
+    `frame_width_mm` is a single value or one value per image.
+    Returns one result dict per input, in input order. A failing image yields
+    {'index': i, 'success': False, 'error': ...} and does not affect the others.
+    Every detected face gets a 'quality' entry; with `quality_filter`, blurred frames are
+    dropped before inference and closed-eye or turned-head frames before measurement,
+    with the cause in 'rejected'. Images already in the result cache skip the workers.
+    """
+    sources = list(paths_or_arrays)
+    if isinstance(frame_width_mm, (list, tuple, np.ndarray)):
+        widths = [float(w) for w in frame_width_mm]
+        if len(widths) != len(sources):
+            raise ValueError("frame_width_mm must be a single value or one value per image.")
+    else:
+        widths = [float(frame_width_mm)] * len(sources)
+
+    # Cache hits are filled in up front; only misses go to the workers
+    cache = get_result_cache()
+    results = [None] * len(sources)
+    keys = [None] * len(sources)
+    if cache.enabled:
+        for i, src in enumerate(sources):
+            keys[i], sources[i] = image_key(src)
+            entry = cache.get(keys[i])
+            # Entries detected without the blur check cannot vouch for a filtered request
+            if entry is not None and (entry.sharp or not quality_filter):
+                results[i] = {'success': True, 'landmarks': entry.landmarks, 'frameDimensions': entry.frame_dims}
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    if executor is None and (len(pending) <= 1 or MEASUREMENT_WORKERS <= 1):
+        # Not worth the inter-process round trip
+        for i in pending:
+            results[i] = _detect_item(sources[i], quality_filter)
+    elif pending:
+        executor = executor or get_executor()
+        futures = [(i, executor.submit(_detect_item, sources[i], quality_filter)) for i in pending]
+        pool_broken = False
+        for i, future in futures:
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                pool_broken = pool_broken or isinstance(e, BrokenProcessPool)
+                results[i] = {'success': False, 'error': f"Worker failed: {e}"}
+        if pool_broken and executor is _executor:
+            # A worker process died; start a fresh pool on the next call
+            shutdown_executor()
+
+    if cache.enabled:
+        for i in pending:
+            if results[i]['success']:
+                cache.put(keys[i], results[i]['landmarks'], results[i]['frameDimensions'], sharp=quality_filter)
+
+    # Workers only detect; every frame's quality and measurements come from one vectorized call each
+    detected = [i for i, r in enumerate(results) if r['success']]
+    if detected:
+        stack = np.stack([results[i]['landmarks'] for i in detected])
+        quality = score_landmarks(stack)
+        batch = compute_measurements(
+            stack,
+            [results[i]['frameDimensions']['width'] for i in detected],
+            [results[i]['frameDimensions']['height'] for i in detected],
+            [widths[i] for i in detected])
+        for row, i in enumerate(detected):
+            result = results[i]
+            reason = str(quality['reason'][row])
+            if quality_filter and reason:
+                results[i] = {'success': False, 'error': str(FrameRejectedError(reason)), 'rejected': reason}
+                continue
+            result['quality'] = {
+                'score': float(quality['score'][row]),
+                'yaw_ratio': float(quality['yaw_ratio'][row]),
+                'eye_openness': float(quality['eye_openness'][row]),
+            }
+            if not np.isfinite(batch['pd'][row]):
+                results[i] = {'success': False,
+                              'error': "Could not establish a reference width for measurement."}
+                continue
+            result['measurements'] = {key: float(values[row]) for key, values in batch.items()}
+            result['landmarks'] = result['landmarks'].tolist()
+
+    for index, result in enumerate(results):
+        result['index'] = index
+    return results
+
+
+atexit.register(shutdown_executor)
@@ -0,0 +1,305 @@
+"""
+Metrics
+Per-stage latency histograms, request and error counters, and queue/pool gauges,
+exposed in the Prometheus text format by /metrics. A span costs two perf_counter()
+calls and one bucket increment under a lock, so recording stays on in production.
+Metrics are per process; with several gunicorn workers each one reports its own.
+
+Stages are timed with `with span('detect'): ...`. Each request also gets a
+Server-Timing header with its own stage durations.
+
+With PROFILER_ENABLED=1, a request carrying 'profile=1' is sampled by a background
+thread; the response's X-Profile-Id names a collapsed-stack profile (flamegraph.pl /
+speedscope input) served by /profiles/<id>.
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter as StackCounter, OrderedDict
+
+# Record spans, counters and request timings (0 turns recording off)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+# Allow per-request sampling profiles (?profile=1). Off by default: sampling slows the request.
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+# Milliseconds between stack samples, and how many finished profiles are kept
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', '5'))
+PROFILER_KEEP = int(os.getenv('PROFILER_KEEP', '20'))
+
+PREFIX = 'advance_filter'
+
+# Seconds; covers cache hits (sub-millisecond) up to cold model loads
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label tuple."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = f'{PREFIX}_{name}'
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(series):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, ("le", le))} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per label tuple."""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = f'{PREFIX}_{name}_total'
+        self.help = help_text
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = sorted(self._series.items())
+        lines.extend(f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in series)
+        return lines
+
+
+STAGE_SECONDS = Histogram('stage_seconds', 'Time spent in each processing stage.', ('stage',))
+REQUEST_SECONDS = Histogram('request_seconds', 'Request latency by endpoint.', ('endpoint',))
+REQUESTS = Counter('requests', 'Requests by endpoint and status code.', ('endpoint', 'status'))
+ERRORS = Counter('errors', 'Error responses by endpoint and kind (client or server).', ('endpoint', 'kind'))
+FACES_NOT_FOUND = Counter('faces_not_found', 'Images in which no face was detected.')
+PUPIL_REFINEMENTS = Counter('pupil_refinements', 'Pupil refinement outcomes (refined, rejected, too_small, '
+                            'over_budget).', ('outcome',))
+
+METRICS = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, ERRORS, FACES_NOT_FOUND, PUPIL_REFINEMENTS]
+
+# Per-thread request state: stage timings for Server-Timing, and the active profiler
+_local = threading.local()
+
+
+class span:
+    """
+    Context manager timing one stage into the stage histogram, and into the current
+    request's Server-Timing header when called on a request thread.
+    """
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not METRICS_ENABLED:
+            return False
+        elapsed = time.perf_counter() - self.start
+        STAGE_SECONDS.observe(elapsed, self.stage)
+        trace = getattr(_local, 'trace', None)
+        if trace is not None:
+            trace.append((self.stage, elapsed))
+        return False
+
+
+# ========================================
+# Gauges
+# ========================================
+# (name, stats function, label name for a dict keyed by e.g. pool kind, or None)
+_gauges = []
+
+
+def register_gauges(name, stats, label=None):
+    """
+    Export the numeric values of `stats()` (a /health-style dict) as gauges named
+    <prefix>_<name>_<key>. Nested dicts are flattened; with `label`, the top-level
+    keys become that label's values instead.
+    """
+    _gauges.append((name, stats, label))
+
+
+def _flatten(stats, path=''):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{path}{key}_')
+        elif isinstance(value, (bool, int, float)):
+            yield f'{path}{key}', float(value)
+
+
+def _render_gauges():
+    lines = []
+    for name, stats, label in _gauges:
+        try:
+            data = stats()
+        except Exception as e:
+            lines.append(f'# {name} unavailable: {e}')
+            continue
+        groups = data.items() if label else [(None, data)]
+        typed = set()
+        for group, values in groups:
+            extra = (label, group) if label else None
+            for key, value in _flatten(values):
+                metric = f'{PREFIX}_{name}_{key}'
+                if metric not in typed:
+                    typed.add(metric)
+                    lines.append(f'# TYPE {metric} gauge')
+                value = int(value) if value.is_integer() else value
+                lines.append(f'{metric}{_labels((), (), extra)} {value}')
+    return lines
+
+
+def render():
+    """The /metrics body in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    lines.extend(_render_gauges())
+    return '\n'.join(lines) + '\n'
+
+
+# ========================================
+# Sampling profiler
+# ========================================
+_profiles = OrderedDict()
+_profiles_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack on an interval and counts collapsed stacks."""
+
+    def __init__(self, thread_id, interval_ms=PROFILER_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = StackCounter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        """Stop sampling and return the profile as collapsed stacks, one 'stack count' per line."""
+        self._stop.set()
+        self._thread.join()
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def get_profile(profile_id):
+    with _profiles_lock:
+        return _profiles.get(profile_id)
+
+
+def _store_profile(profile):
+    profile_id = uuid.uuid4().hex
+    with _profiles_lock:
+        _profiles[profile_id] = profile
+        while len(_profiles) > PROFILER_KEEP:
+            _profiles.popitem(last=False)
+    return profile_id
+
+
+# ========================================
+# Flask integration
+# ========================================
+def instrument_app(app):
+    """Time every request, count errors, add Server-Timing and handle ?profile=1."""
+    from flask import request
+
+    @app.before_request
+    def _start_request():
+        if not METRICS_ENABLED:
+            return
+        _local.trace = []
+        _local.start = time.perf_counter()
+        _local.profiler = None
+        if PROFILER_ENABLED and request.args.get('profile') == '1':
+            _local.profiler = SamplingProfiler(threading.get_ident()).start()
+
+    @app.after_request
+    def _finish_request(response):
+        start = getattr(_local, 'start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        REQUEST_SECONDS.observe(elapsed, endpoint)
+        REQUESTS.inc(endpoint, str(response.status_code))
+        if response.status_code >= 400:
+            ERRORS.inc(endpoint, 'server' if response.status_code >= 500 else 'client')
+
+        timings = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in _local.trace]
+        timings.append(f'total;dur={elapsed * 1000:.2f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+
+        profiler = _local.profiler
+        if profiler is not None:
+            response.headers['X-Profile-Id'] = _store_profile(profiler.stop())
+        _local.trace = _local.start = _local.profiler = None
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        # after_request is skipped when the response itself failed; never leave a sampler running
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is not None:
+            profiler.stop()
+        _local.trace = _local.start = _local.profiler = None
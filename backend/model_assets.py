@@ -0,0 +1,192 @@
+"""
+Model Assets
+Resolves the MediaPipe model files without touching the network on the request path.
+A model is loaded from, in order:
+  1. an explicit path (FACE_LANDMARKER_MODEL_PATH / FACE_DETECTOR_MODEL_PATH)
+  2. the bundled models/ directory next to this file (filled at image build time)
+  3. a copy in the temp directory, downloaded on first use unless MODEL_DOWNLOAD=0
+Each file is checked against a SHA256 once per process. Pins are read from
+model_checksums.txt next to this file (sha256sum format; written by --pin, not shipped
+with the repo) and can be overridden per model from the environment. A download that does
+not match its pin is discarded. A model without any pin falls back to the <model>.sha256
+file written when it was fetched, which catches later corruption but not a bad download.
+MediaPipe memory-maps models loaded from a path, so workers share the file's pages.
+
+Download once from a trusted network and record the pins (commit the file it writes):
+    python model_assets.py --fetch --pin
+Fetch the models into models/, refusing any model without a pin (the Dockerfile does this):
+    python model_assets.py --fetch --require-pin
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import urllib.request
+
+# Directory holding bundled model files
+MODEL_DIR = os.getenv('MODEL_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+# Allow downloading a missing model at runtime. Set to 0 where startup must stay offline.
+MODEL_DOWNLOAD = os.getenv('MODEL_DOWNLOAD', '1') == '1'
+
+# Pinned SHA256 of each model file, one '<sha256>  <filename>' line per model
+CHECKSUMS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_checksums.txt')
+
+logger = logging.getLogger(__name__)
+
+
+def read_checksums(path=CHECKSUMS_FILE):
+    """{filename: sha256} from a sha256sum-style file; empty when the file does not exist."""
+    checksums = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and not line.startswith('#'):
+                    checksums[parts[1].lstrip('*')] = parts[0].lower()
+    except FileNotFoundError:
+        pass
+    return checksums
+
+
+_pinned = read_checksums()
+
+MODELS = {
+    'face_landmarker': {
+        'filename': 'face_landmarker.task',
+        'url': 'https://storage.googleapis.com/mediapipe-models/face_landmarker/face_landmarker/float16/1/face_landmarker.task',
+        'path': os.getenv('FACE_LANDMARKER_MODEL_PATH'),
+        'sha256': os.getenv('FACE_LANDMARKER_MODEL_SHA256') or _pinned.get('face_landmarker.task'),
+    },
+    # Small BlazeFace detector used for the cheap face-box pass before landmark inference
+    'face_detector': {
+        'filename': 'blaze_face_short_range.tflite',
+        'url': 'https://storage.googleapis.com/mediapipe-models/face_detector/blaze_face_short_range/float16/1/blaze_face_short_range.tflite',
+        'path': os.getenv('FACE_DETECTOR_MODEL_PATH'),
+        'sha256': os.getenv('FACE_DETECTOR_MODEL_SHA256') or _pinned.get('blaze_face_short_range.tflite'),
+    },
+}
+
+# Paths already verified in this process, with the (size, mtime) they had
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+class ModelChecksumError(RuntimeError):
+    """Raised when a model file does not match its expected SHA256."""
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def expected_sha256(name, path):
+    """Pinned checksum (environment, else model_checksums.txt), else the sidecar written by fetch()."""
+    if MODELS[name]['sha256']:
+        return MODELS[name]['sha256'].lower()
+    sidecar = f'{path}.sha256'
+    if os.path.exists(sidecar):
+        with open(sidecar) as f:
+            return f.read().split()[0].lower()
+    return None
+
+
+def verify(name, path):
+    """Check `path` against the expected checksum once per process (again if the file changes)."""
+    stat = os.stat(path)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    if _verified.get(path) == signature:
+        return path
+    expected = expected_sha256(name, path)
+    if expected is not None:
+        actual = file_sha256(path)
+        if actual != expected:
+            raise ModelChecksumError(f"{path} has SHA256 {actual}, expected {expected}")
+    with _verified_lock:
+        _verified[path] = signature
+    return path
+
+
+def fetch(name, directory):
+    """
+    Download a model into `directory` and write its .sha256 sidecar. Returns the path.
+    Raises ModelChecksumError, keeping nothing, when the download does not match the pin.
+    """
+    spec = MODELS[name]
+    path = os.path.join(directory, spec['filename'])
+    os.makedirs(directory, exist_ok=True)
+    print(f"Downloading model to {path}...")
+    # Download to a private name first so concurrent workers never load a partial file
+    partial_path = f"{path}.{os.getpid()}.part"
+    try:
+        urllib.request.urlretrieve(spec['url'], partial_path)
+        actual = file_sha256(partial_path)
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    if spec['sha256'] and actual != spec['sha256'].lower():
+        os.remove(partial_path)
+        raise ModelChecksumError(f"Downloaded {spec['filename']} has SHA256 {actual}, expected {spec['sha256']}")
+    if not spec['sha256']:
+        logger.warning(f"No pinned SHA256 for {spec['filename']}; the download cannot be verified "
+                       f"(run python model_assets.py --fetch --pin)")
+    os.replace(partial_path, path)
+    # After the model is in place: a crash in between must not leave a sidecar next to an older file
+    with open(f'{path}.sha256', 'w') as f:
+        f.write(f"{actual}  {spec['filename']}\n")
+    print("Download complete.")
+    return path
+
+
+def model_path(name):
+    """Local, verified path for a model, downloading it to the temp directory as a last resort."""
+    spec = MODELS[name]
+    candidates = [spec['path']] if spec['path'] else [os.path.join(MODEL_DIR, spec['filename']),
+                                                      os.path.join(tempfile.gettempdir(), spec['filename'])]
+    for path in candidates:
+        if os.path.exists(path):
+            return verify(name, path)
+    if spec['path'] or not MODEL_DOWNLOAD:
+        raise FileNotFoundError(f"Model {spec['filename']} not found (looked in {', '.join(candidates)})")
+    return verify(name, fetch(name, tempfile.gettempdir()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch the MediaPipe models into the bundled model directory.")
+    parser.add_argument('--fetch', action='store_true', help='download every model')
+    parser.add_argument('--dir', default=MODEL_DIR)
+    parser.add_argument('--pin', action='store_true',
+                        help=f'download without checking the current pins and write them to {CHECKSUMS_FILE}')
+    parser.add_argument('--require-pin', action='store_true', help='fail for a model without a pinned SHA256')
+    args = parser.parse_args()
+    if not args.fetch:
+        parser.print_help()
+        return
+    unpinned = [spec['filename'] for spec in MODELS.values() if not spec['sha256']]
+    if args.require_pin and not args.pin and unpinned:
+        parser.exit(1, f"No pinned SHA256 for {', '.join(unpinned)}. Run python model_assets.py --fetch --pin "
+                       f"and commit {os.path.basename(CHECKSUMS_FILE)}, or set the *_MODEL_SHA256 variables.\n")
+    lines = []
+    for name, spec in MODELS.items():
+        if args.pin:
+            spec['sha256'] = None
+        path = fetch(name, args.dir)
+        digest = file_sha256(path)
+        print(f"{name}: {path} sha256={digest}")
+        lines.append(f"{digest}  {spec['filename']}\n")
+    if args.pin:
+        with open(CHECKSUMS_FILE, 'w') as f:
+            f.writelines(lines)
+        print(f"Pinned checksums written to {CHECKSUMS_FILE}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""
+Image Preprocessing
+Prepares uploads for landmark inference without materializing full-resolution buffers:
+JPEGs are decoded at a reduced DCT scale, other formats are box-reduced, and landmarks
+run on a face region found by a cheap face-detector pass. PreparedImage records how the
+inference image maps back onto the original frame, so landmark coordinates (and therefore
+frameDimensions and the mm math) always refer to the original upload.
+"""
+
+import io
+import logging
+import math
+import os
+from urllib.error import URLError
+
+import numpy as np
+from PIL import Image
+
+from metrics import span
+from model_assets import ModelChecksumError
+
+# Longest side, in pixels, of the image handed to the landmarker. 0 disables downscaling.
+INFERENCE_MAX_DIM = int(os.getenv('INFERENCE_MAX_DIM', '1280'))
+
+# Largest image, in pixels, accepted for decoding. Checked from the header, before any pixel data
+# is decoded; Pillow's own decompression-bomb limit is set to match.
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', str(40_000_000)))
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Run landmarks on a face crop when the face detector finds a face. Set to 0 to disable.
+FACE_ROI_CROP = os.getenv('FACE_ROI_CROP', '1') == '1'
+
+# Margin added around the detected face box, as a fraction of the box size.
+FACE_ROI_MARGIN = 0.35
+
+# Set once the face detector model turned out to be missing or invalid, so later requests skip the pass
+_face_detector_unavailable = False
+
+logger = logging.getLogger(__name__)
+
+
+class PreparedImage:
+    """
+    An RGB inference image plus the transform back to the original frame.
+    Inference pixel (u, v) corresponds to original pixel (offset_x + u * scale, offset_y + v * scale).
+    """
+
+    def __init__(self, image_rgb, frame_width, frame_height, scale=1.0, offset_x=0.0, offset_y=0.0):
+        self.image_rgb = image_rgb
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.scale = scale
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+
+    @property
+    def frame_dims(self):
+        return {"width": self.frame_width, "height": self.frame_height}
+
+    def crop(self, left, top, right, bottom):
+        """Return a PreparedImage for a pixel box of this image. Only the box is copied."""
+        roi = np.ascontiguousarray(self.image_rgb[top:bottom, left:right])
+        return PreparedImage(roi, self.frame_width, self.frame_height, self.scale,
+                             self.offset_x + left * self.scale, self.offset_y + top * self.scale)
+
+    def to_frame_coordinates(self, points):
+        """
+        Map normalized landmarks (N, 3) on the inference image to normalized coordinates
+        on the original frame. z follows MediaPipe's convention of scaling with image width.
+        """
+        height, width = self.image_rgb.shape[:2]
+        sx = width * self.scale / self.frame_width
+        sy = height * self.scale / self.frame_height
+        mapped = np.empty_like(points)
+        mapped[..., 0] = points[..., 0] * sx + self.offset_x / self.frame_width
+        mapped[..., 1] = points[..., 1] * sy + self.offset_y / self.frame_height
+        mapped[..., 2] = points[..., 2] * sx
+        return mapped
+
+
+def _reduce_factor(size, max_dim):
+    longest = max(size)
+    if not max_dim or longest <= max_dim:
+        return 1
+    return math.ceil(longest / max_dim)
+
+
+def decode_for_inference(image_source, max_dim=INFERENCE_MAX_DIM):
+    """
+    Decode an image source (path, bytes, file-like or RGB array) at the smallest scale
+    that keeps its longest side within `max_dim`.
+    """
+    if isinstance(image_source, np.ndarray):
+        if image_source.ndim != 3 or image_source.shape[2] != 3:
+            raise ValueError("Error: Image array must have shape (height, width, 3).")
+        height, width = image_source.shape[:2]
+        factor = _reduce_factor((width, height), max_dim)
+        # Strided view: no full-size copy, and the final copy is already reduced
+        image_rgb = np.ascontiguousarray(image_source[::factor, ::factor], dtype=np.uint8)
+        return PreparedImage(image_rgb, width, height, scale=float(factor))
+
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        image_source = io.BytesIO(image_source)
+
+    try:
+        pil_image = Image.open(image_source)
+    except Image.DecompressionBombError:
+        raise ValueError("Error: Image has too many pixels.")
+    except Exception:
+        raise ValueError("Error: Could not read image file.")
+    if pil_image.width * pil_image.height > MAX_IMAGE_PIXELS:
+        raise ValueError("Error: Image has too many pixels.")
+
+    try:
+        frame_width, frame_height = pil_image.size
+        scale = 1.0
+        if _reduce_factor(pil_image.size, max_dim) > 1:
+            # JPEG DCT scaling: decode directly at 1/2, 1/4 or 1/8 size. No-op for other formats.
+            target = (math.ceil(frame_width * max_dim / max(pil_image.size)),
+                      math.ceil(frame_height * max_dim / max(pil_image.size)))
+            drafted = pil_image.draft('RGB', target)
+            if drafted is not None:
+                scale = frame_width / drafted[1][2]
+        pil_image.load()
+    except Exception:
+        raise ValueError("Error: Could not read image file.")
+
+    factor = _reduce_factor(pil_image.size, max_dim)
+    if factor > 1:
+        pil_image = pil_image.reduce(factor)
+        scale *= factor
+
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    return PreparedImage(np.asarray(pil_image), frame_width, frame_height, scale=scale)
+
+
+def find_face_box(prepared, detector):
+    """
+    Cheap pass: run the face detector on the inference image and return the most
+    confident face as a (left, top, right, bottom) pixel box with margin, or None.
+    """
+    import mediapipe as mp
+
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=prepared.image_rgb)
+    result = detector.detect(mp_image)
+    if not result.detections:
+        return None
+
+    best = max(result.detections, key=lambda d: d.categories[0].score if d.categories else 0.0)
+    box = best.bounding_box
+    height, width = prepared.image_rgb.shape[:2]
+    margin_x = box.width * FACE_ROI_MARGIN
+    margin_y = box.height * FACE_ROI_MARGIN
+    left = max(0, int(box.origin_x - margin_x))
+    top = max(0, int(box.origin_y - margin_y))
+    right = min(width, int(math.ceil(box.origin_x + box.width + margin_x)))
+    bottom = min(height, int(math.ceil(box.origin_y + box.height + margin_y)))
+    if right - left < 32 or bottom - top < 32:
+        return None
+    return left, top, right, bottom
+
+
+def prepare_image(image_source, max_dim=None, roi_crop=None):
+    """
+    Decode an image for inference and, when possible, crop it to the face region.
+    Returns (full PreparedImage, PreparedImage to run landmarks on).
+    """
+    global _face_detector_unavailable
+    max_dim = INFERENCE_MAX_DIM if max_dim is None else max_dim
+    roi_crop = FACE_ROI_CROP if roi_crop is None else roi_crop
+    with span('decode'):
+        prepared = decode_for_inference(image_source, max_dim)
+    if not roi_crop or _face_detector_unavailable:
+        return prepared, prepared
+
+    from landmarker_pool import get_pool
+
+    pool = get_pool('face_detector')
+    try:
+        detector = pool.acquire()
+    except (FileNotFoundError, URLError, ModelChecksumError) as e:
+        # Detector model missing, not downloadable or corrupt: landmarks on the whole frame still work
+        logger.warning(f"Face ROI pass disabled: {e}")
+        _face_detector_unavailable = True
+        return prepared, prepared
+    except (OSError, RuntimeError) as e:
+        # Pool busy (TimeoutError) or shut down (PoolClosedError): skip the pass for this request only
+        logger.warning(f"Face ROI pass skipped: {e}")
+        return prepared, prepared
+
+    try:
+        with span('face_roi'):
+            box = find_face_box(prepared, detector)
+    except Exception as e:
+        pool.release(detector, broken=True)
+        logger.warning(f"Face ROI pass failed: {e}")
+        return prepared, prepared
+    pool.release(detector)
+
+    if box is None:
+        return prepared, prepared
+    return prepared, prepared.crop(*box)
@@ -0,0 +1,136 @@
+"""
+Pupil Refinement
+Optional sub-pixel refinement of the two iris-centre landmarks (468 and 473), which PD and
+FH are measured from. Only two small windows around the irises are gathered from the
+already-decoded inference image; the full frame is never copied. In each window the pupil
+centre is the darkness-weighted centroid of the pupil core: a disc of half the iris radius
+(from the iris boundary landmarks), recentred twice, with everything above the upper-eyelid
+landmark masked out. The lid and lashes are as dark as the pupil, so letting them into the
+weights would pull the centre up and bias FH. Both eyes are processed in one vectorized pass.
+
+The stage has a latency budget: when a call overruns it, later calls sample the windows
+with a coarser stride until they fit again.
+"""
+
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from metrics import PUPIL_REFINEMENTS
+
+# Refine the iris-centre landmarks on the decoded image before measuring. Set to 1 to enable.
+PUPIL_REFINEMENT = os.getenv('PUPIL_REFINEMENT', '0') == '1'
+
+# Milliseconds the stage may take per image before it starts sampling more coarsely
+PUPIL_REFINE_BUDGET_MS = float(os.getenv('PUPIL_REFINE_BUDGET_MS', '3'))
+
+# Most samples per side of an eye window; larger irises are sampled with a stride
+PUPIL_REFINE_WINDOW = int(os.getenv('PUPIL_REFINE_WINDOW', '48'))
+
+# Iris landmarks: centre, then four boundary points, for each eye
+RIGHT_IRIS = [468, 469, 470, 471, 472]
+LEFT_IRIS = [473, 474, 475, 476, 477]
+
+# Upper-eyelid margin above each iris (same eye order)
+UPPER_LIDS = [159, 386]
+
+# Irises smaller than this radius (inference pixels) are left as they are
+MIN_IRIS_RADIUS_PX = 2.0
+
+# A refined centre further than this fraction of the iris radius from the landmark is discarded
+MAX_SHIFT = 0.15
+
+# Only pixels within this fraction of the iris radius of the centre carry weight (the pupil core)
+CORE_RADIUS = 0.5
+
+# Pixels darker than this percentile of the visible iris disc carry the weight
+DARK_PERCENTILE = 30
+
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+# Extra stride factor, raised while the stage is over budget and lowered once it is well under.
+# Shared by the request threads; read and updated under _stride_lock.
+_stride_boost = 1
+_stride_lock = threading.Lock()
+
+
+def refine_pupils(prepared, landmarks):
+    """
+    Return a copy of `landmarks` ((N, 3), normalized to the original frame) with the x/y of
+    landmarks 468 and 473 refined on `prepared.image_rgb`. Either both eyes are refined or,
+    when a fit is not trustworthy, the landmarks are returned unchanged.
+    """
+    global _stride_boost
+    start = time.perf_counter()
+
+    image = prepared.image_rgb
+    height, width = image.shape[:2]
+    iris = landmarks[[RIGHT_IRIS, LEFT_IRIS], :2].astype(np.float64)
+    # Original-frame normalized coordinates to inference-image pixels
+    iris[..., 0] = (iris[..., 0] * prepared.frame_width - prepared.offset_x) / prepared.scale
+    iris[..., 1] = (iris[..., 1] * prepared.frame_height - prepared.offset_y) / prepared.scale
+    centers, boundary = iris[:, 0], iris[:, 1:]
+    lids = (landmarks[UPPER_LIDS, 1].astype(np.float64) * prepared.frame_height - prepared.offset_y) / prepared.scale
+    radius = np.linalg.norm(boundary - centers[:, np.newaxis], axis=-1).mean(axis=1)
+    if radius.min() < MIN_IRIS_RADIUS_PX:
+        PUPIL_REFINEMENTS.inc('too_small')
+        return landmarks
+
+    # One sample grid for both eyes; only these pixels are read from the image
+    half = math.ceil(1.25 * radius.max())
+    with _stride_lock:
+        boost = _stride_boost
+    step = max(1, math.ceil((2 * half + 1) / PUPIL_REFINE_WINDOW)) * boost
+    # Coarser than this and the pupil core is down to a handful of samples
+    step = min(step, max(1, int(CORE_RADIUS * radius.min() / 2)))
+    offsets = np.arange(-half, half + 1, step)
+    base = np.floor(centers).astype(int)
+    rows = np.clip(base[:, 1, np.newaxis] + offsets, 0, height - 1)
+    cols = np.clip(base[:, 0, np.newaxis] + offsets, 0, width - 1)
+    windows = image[rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+    gray = windows @ _LUMA
+    # Sample positions as pixel centres, in the same continuous coordinates as `centers`
+    y = rows[:, :, np.newaxis] + 0.5
+    x = cols[:, np.newaxis, :] + 0.5
+
+    # The lid and lashes are as dark as the pupil: nothing above the lid margin counts
+    below_lid = y >= lids[:, np.newaxis, np.newaxis]
+    refined = centers
+    for _ in range(2):
+        distance2 = (x - refined[:, 0, np.newaxis, np.newaxis]) ** 2 + (y - refined[:, 1, np.newaxis, np.newaxis]) ** 2
+        inside = below_lid & (distance2 <= radius[:, np.newaxis, np.newaxis] ** 2)
+        core = inside & (distance2 <= (CORE_RADIUS * radius[:, np.newaxis, np.newaxis]) ** 2)
+        if not np.all(core.any(axis=(1, 2))):
+            PUPIL_REFINEMENTS.inc('rejected')
+            return landmarks
+        # The threshold comes from the iris disc; only the pupil core is weighted
+        threshold = np.nanpercentile(np.where(inside, gray, np.nan), DARK_PERCENTILE, axis=(1, 2))
+        weight = np.where(core, np.clip(threshold[:, np.newaxis, np.newaxis] - gray, 0, None), 0.0)
+        total = weight.sum(axis=(1, 2))
+        if not np.all(total > 0):
+            PUPIL_REFINEMENTS.inc('rejected')
+            return landmarks
+        refined = np.stack([(weight * x).sum(axis=(1, 2)) / total,
+                            (weight * y).sum(axis=(1, 2)) / total], axis=-1)
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if elapsed_ms > PUPIL_REFINE_BUDGET_MS:
+        with _stride_lock:
+            _stride_boost = min(_stride_boost * 2, 8)
+        PUPIL_REFINEMENTS.inc('over_budget')
+    elif elapsed_ms < PUPIL_REFINE_BUDGET_MS / 4:
+        with _stride_lock:
+            _stride_boost = max(1, _stride_boost // 2)
+
+    if np.any(np.linalg.norm(refined - centers, axis=-1) > MAX_SHIFT * radius):
+        PUPIL_REFINEMENTS.inc('rejected')
+        return landmarks
+
+    PUPIL_REFINEMENTS.inc('refined')
+    result = landmarks.copy()
+    result[[RIGHT_IRIS[0], LEFT_IRIS[0]], 0] = (prepared.offset_x + refined[:, 0] * prepared.scale) / prepared.frame_width
+    result[[RIGHT_IRIS[0], LEFT_IRIS[0]], 1] = (prepared.offset_y + refined[:, 1] * prepared.scale) / prepared.frame_height
+    return result
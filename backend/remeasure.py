@@ -0,0 +1,329 @@
+"""
+Bulk Re-measurement
+Recomputes stored measurement records after the measurement constants change
+(FITTING_HEIGHT_OFFSET, the reference landmarks, ...) and writes them back with bulk upserts.
+Files are matched to records by name: <record id>.<ext>.
+  images DIR     - stored photos, run through the landmarker on a process pool;
+                   --save-landmarks DIR keeps each detection for later runs
+  landmarks DIR  - detections saved as .npz (result_cache.save_entry); no inference
+  archive [DIR]  - the landmark archive (landmark_archive.py, default LANDMARK_ARCHIVE_DIR),
+                   read in slot order straight from the memory map; no inference
+A record's own frame_width_mm is used; --frame-width-mm covers records without one and
+files that have no record yet (those records are created).
+
+Work is streamed in file-name (or slot) order: at most --window images are in flight and
+one write batch is held in memory. With --checkpoint, the last file or slot of every written
+batch is recorded and a rerun continues after it (--restart ignores the checkpoint).
+
+    python remeasure.py images /data/photos --save-landmarks /data/landmarks --checkpoint photos.json
+    python remeasure.py landmarks /data/landmarks --batch-size 1000
+    python remeasure.py archive --checkpoint archive.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId
+
+from landmark_archive import ARCHIVE_FILE, LANDMARK_ARCHIVE_DIR, LandmarkArchive
+from measurement_logic import POSE_CORRECTION, compute_measurements, detect_landmarks, get_executor
+from result_cache import CacheEntry, load_entry, save_entry
+from storage import get_storage
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+LANDMARK_EXTENSIONS = ('.npz',)
+
+# Failures listed in the report; the rest are only counted
+MAX_REPORTED_FAILURES = 20
+
+# Archive slots decoded at a time
+ARCHIVE_BLOCK = 1024
+
+
+def record_id(name):
+    """The record _id a file stands for: an ObjectId when the stem is one, else the stem."""
+    stem = os.path.splitext(name)[0]
+    return ObjectId(stem) if ObjectId.is_valid(stem) else stem
+
+
+def list_sources(directory, extensions, after=None):
+    """File names in `directory` with one of `extensions`, sorted, after `after` if given."""
+    names = sorted(entry.name for entry in os.scandir(directory)
+                   if entry.is_file() and entry.name.lower().endswith(extensions))
+    return [name for name in names if after is None or name > after]
+
+
+def detect_file(path):
+    """Worker task: (landmarks, frame_dims, pose) for one image, or the error message."""
+    try:
+        return detect_landmarks(path, with_pose=True)
+    except Exception as e:
+        return str(e)
+
+
+# ========================================
+# Sources
+# ========================================
+def iter_images(directory, names, workers, window):
+    """
+    Yield (name, record id, CacheEntry or error message) in `names` order. Images are
+    detected on the measurement process pool with at most `window` of them submitted at once.
+    """
+    if workers <= 1:
+        for name in names:
+            yield name, record_id(name), _entry(detect_file(os.path.join(directory, name)))
+        return
+
+    executor = get_executor(workers)
+    pending = deque()
+    remaining = iter(names)
+    while True:
+        while len(pending) < window:
+            name = next(remaining, None)
+            if name is None:
+                break
+            pending.append((name, executor.submit(detect_file, os.path.join(directory, name))))
+        if not pending:
+            return
+        name, future = pending.popleft()
+        # A dead worker takes the pool with it; stop and let a rerun resume from the checkpoint
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            result = f"Worker failed: {e}"
+        yield name, record_id(name), _entry(result)
+
+
+def _entry(result):
+    if isinstance(result, str):
+        return result
+    landmarks, frame_dims, pose = result
+    return CacheEntry(landmarks, frame_dims, pose)
+
+
+def iter_landmarks(directory, names):
+    """Yield (name, record id, CacheEntry or error message) for saved detections."""
+    for name in names:
+        try:
+            yield name, record_id(name), load_entry(os.path.join(directory, name))
+        except (OSError, ValueError, KeyError) as e:
+            yield name, record_id(name), f"Unreadable landmark file: {e}"
+
+
+def iter_archive(archive, slots):
+    """Yield (slot, record id, CacheEntry) for a range of archive slots, decoded a block at a time."""
+    for start in range(slots.start, slots.stop, ARCHIVE_BLOCK):
+        block = archive.slots()[start:min(start + ARCHIVE_BLOCK, slots.stop)]
+        landmarks, widths, heights = archive.decode(block)
+        for i, raw_id in enumerate(block['id']):
+            yield (start + i, ObjectId(raw_id.tobytes()),
+                   CacheEntry(landmarks[i], {'width': int(widths[i]), 'height': int(heights[i])}))
+
+
+# ========================================
+# Measuring and writing
+# ========================================
+def measure_batch(batch, records, default_width_mm, pose_correction, create_missing=True):
+    """
+    Measure a batch of (name, _id, CacheEntry) in one vectorized call. Without
+    `create_missing`, entries whose record does not exist are failures instead of new records.
+    Returns (updates for upsert_many, [(name, error)]).
+    """
+    rows, widths, failures = [], [], []
+    for name, _id, entry in batch:
+        record = records.get(_id)
+        if record is None and not create_missing:
+            failures.append((name, f"No record {_id}"))
+            continue
+        width = (record or {}).get('frame_width_mm') or default_width_mm
+        if not width:
+            failures.append((name, "No frame_width_mm on the record or the command line"))
+            continue
+        rows.append((name, _id, entry))
+        widths.append(float(width))
+    if not rows:
+        return [], failures
+
+    stack = np.stack([entry.landmarks for _, _, entry in rows])
+    frame_width = [entry.frame_dims['width'] for _, _, entry in rows]
+    frame_height = [entry.frame_dims['height'] for _, _, entry in rows]
+    measured = compute_measurements(stack, frame_width, frame_height, widths)
+    values = [{key: float(column[row]) for key, column in measured.items()} for row in range(len(rows))]
+
+    # Faces with a transformation matrix are measured again in the pose-normalized frame
+    posed = [row for row, (_, _, entry) in enumerate(rows) if entry.pose is not None]
+    if pose_correction and posed:
+        corrected = compute_measurements(
+            stack[posed], np.take(frame_width, posed), np.take(frame_height, posed), np.take(widths, posed),
+            pose=np.stack([rows[row][2].pose for row in posed]))
+        for i, row in enumerate(posed):
+            values[row] = {key: float(column[i]) for key, column in corrected.items()}
+
+    now = datetime.utcnow()
+    updates = []
+    for (name, _id, _), width, measurements in zip(rows, widths, values):
+        if not np.isfinite(measurements['pd']):
+            failures.append((name, "Could not establish a reference width for measurement."))
+            continue
+        fields = {'measurements': measurements, 'remeasured_at': now}
+        if _id not in records:
+            fields.update(frame_width_mm=width, created_at=now)
+        updates.append((_id, fields))
+    return updates, failures
+
+
+def read_checkpoint(path, mode, directory):
+    """The last file name (or archive slot) written by a previous run over the same source, or None."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if state.get('mode') != mode or state.get('source') != os.path.abspath(directory):
+        raise ValueError(f"Checkpoint {path} belongs to another run ({state.get('mode')} {state.get('source')})")
+    return state.get('last')
+
+
+def write_checkpoint(path, mode, directory, last, report):
+    partial_path = f'{path}.part'
+    with open(partial_path, 'w', encoding='utf-8') as f:
+        json.dump({'mode': mode, 'source': os.path.abspath(directory), 'last': last,
+                   'processed': report['processed'], 'failed': report['failed'],
+                   'updated_at': datetime.utcnow().isoformat()}, f)
+    os.replace(partial_path, path)
+
+
+class Progress:
+    """One self-overwriting status line on stderr, at most every `interval` seconds."""
+
+    def __init__(self, total, interval=1.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.start = time.perf_counter()
+        self._shown = 0.0
+
+    def update(self, done, final=False):
+        now = time.perf_counter()
+        if not final and now - self._shown < self.interval:
+            return
+        self._shown = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - done) / rate if rate > 0 else float('inf')
+        self.stream.write(f"\r{done}/{self.total} records  {rate:.1f}/s  eta {eta:.0f}s ")
+        if final:
+            self.stream.write('\n')
+        self.stream.flush()
+
+
+def run(mode, directory, frame_width_mm=None, batch_size=500, workers=1, window=None,
+        checkpoint=None, restart=False, save_landmarks=None, dry_run=False, pose_correction=None,
+        collection=None, progress=True):
+    """Re-measure every file in `directory`. Returns the report dict."""
+    pose_correction = POSE_CORRECTION if pose_correction is None else pose_correction
+    after = read_checkpoint(checkpoint, mode, directory) if checkpoint and not restart else None
+    if mode == 'archive':
+        if not os.path.exists(os.path.join(directory, ARCHIVE_FILE)):
+            raise FileNotFoundError(f"No landmark archive in {directory}")
+        archive = LandmarkArchive(directory)
+        names = range(0 if after is None else after + 1, len(archive))
+    else:
+        names = list_sources(directory, IMAGE_EXTENSIONS if mode == 'images' else LANDMARK_EXTENSIONS, after)
+    if collection is None:
+        collection = get_storage().measurements
+    if save_landmarks:
+        os.makedirs(save_landmarks, exist_ok=True)
+
+    if mode == 'images':
+        items = iter_images(directory, names, workers, window or 4 * workers)
+    elif mode == 'archive':
+        items = iter_archive(archive, names)
+    else:
+        items = iter_landmarks(directory, names)
+
+    report = {'mode': mode, 'source': os.path.abspath(directory), 'resumed_after': after,
+              'files': len(names), 'processed': 0, 'updated': 0, 'inserted': 0, 'failed': 0,
+              'failures': [], 'dry_run': dry_run}
+    meter = Progress(len(names)) if progress else None
+    start = time.perf_counter()
+
+    def flush(batch):
+        records = collection.find_by_ids([_id for _, _id, _ in batch])
+        # Archive slots belong to existing records; a slot whose record was never saved is skipped
+        updates, failures = measure_batch(batch, records, frame_width_mm, pose_correction,
+                                          create_missing=mode != 'archive')
+        if updates and not dry_run:
+            result = collection.upsert_many(updates)
+            report['updated'] += result.matched_count
+            report['inserted'] += result.upserted_count
+        fail(failures)
+        report['processed'] += len(batch)
+        if checkpoint and not dry_run:
+            write_checkpoint(checkpoint, mode, directory, batch[-1][0], report)
+
+    def fail(failures):
+        report['failed'] += len(failures)
+        room = MAX_REPORTED_FAILURES - len(report['failures'])
+        report['failures'].extend({'file': name, 'error': error} for name, error in failures[:max(room, 0)])
+
+    batch = []
+    for name, _id, entry in items:
+        if isinstance(entry, str):
+            fail([(name, entry)])
+            report['processed'] += 1
+            continue
+        if save_landmarks:
+            save_entry(os.path.join(save_landmarks, f'{os.path.splitext(name)[0]}.npz'), entry)
+        batch.append((name, _id, entry))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+        if meter:
+            meter.update(report['processed'] + len(batch))
+    if batch:
+        flush(batch)
+
+    elapsed = time.perf_counter() - start
+    if meter:
+        meter.update(report['processed'], final=True)
+    report['seconds'] = round(elapsed, 3)
+    report['records_per_sec'] = round(report['processed'] / elapsed, 2) if elapsed > 0 else None
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute stored measurement records from images or saved landmarks.")
+    parser.add_argument('mode', choices=('images', 'landmarks', 'archive'))
+    parser.add_argument('directory', nargs='?', default=LANDMARK_ARCHIVE_DIR or None,
+                        help='images or .npz files; for archive, the archive directory (default LANDMARK_ARCHIVE_DIR)')
+    parser.add_argument('--frame-width-mm', type=float, help='for records without one and files without a record')
+    parser.add_argument('--batch-size', type=int, default=500, help='records per bulk upsert')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='inference processes (images)')
+    parser.add_argument('--window', type=int, help='images in flight at most (default 4 per worker)')
+    parser.add_argument('--checkpoint', help='progress file to resume from and update')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    parser.add_argument('--save-landmarks', metavar='DIR', help='also save each detection as DIR/<id>.npz (images)')
+    parser.add_argument('--dry-run', action='store_true', help='measure but write nothing')
+    parser.add_argument('--quiet', action='store_true', help='no progress line')
+    args = parser.parse_args()
+    if args.directory is None:
+        parser.error('directory is required')
+
+    report = run(args.mode, args.directory, frame_width_mm=args.frame_width_mm, batch_size=args.batch_size,
+                 workers=args.workers, window=args.window, checkpoint=args.checkpoint, restart=args.restart,
+                 save_landmarks=args.save_landmarks, dry_run=args.dry_run, progress=not args.quiet)
+    print(json.dumps(report, indent=2, default=str))
+
+
+if __name__ == '__main__':
+    main()
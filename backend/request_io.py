@@ -0,0 +1,252 @@
+"""
+Request I/O helpers
+Keeps uploaded files in memory so images are decoded straight from the request
+instead of being spooled to disk, saved to /tmp and re-read.
+
+stream_upload() parses a multipart upload from the request stream chunk by chunk
+(UploadParser also takes chunks from an ASGI receive loop, see asgi.py):
+form fields are validated as soon as they arrive, and the image header is sniffed
+for format and dimensions after its first bytes. A bad field, an oversized body or
+an image with too many pixels is rejected without reading (or decoding) the rest.
+Clients should send the form fields before the file to get the earliest rejection.
+"""
+
+import io
+import os
+import tempfile
+
+from flask import Request
+from flask_cors import CORS
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+from preprocess import MAX_IMAGE_PIXELS
+
+# Largest request body accepted. Uploads are held in memory, so this bounds per-request memory.
+MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', str(16 * 1024 * 1024)))
+
+# Largest /process_video upload. Clips past MAX_CONTENT_LENGTH are spooled to a temporary file.
+MAX_VIDEO_BYTES = int(os.getenv('MAX_VIDEO_BYTES', str(100 * 1024 * 1024)))
+VIDEO_PATHS = ('/process_video',)
+
+# Browser origins allowed to call the API, comma-separated (e.g. the frontend's URL); * allows any
+CORS_ORIGINS = [origin.strip() for origin in os.getenv('CORS_ORIGINS', '*').split(',') if origin.strip()]
+
+# Image formats accepted by stream_upload (Pillow format names)
+UPLOAD_IMAGE_FORMATS = set(os.getenv('UPLOAD_IMAGE_FORMATS', 'JPEG,MPO,PNG,WEBP,BMP').split(','))
+
+# Bytes read from the request stream per step
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+# Largest plain form field; fields are small numbers and names
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+# The image header must be recognised within this many bytes (JPEG EXIF blocks can be large)
+MAX_SNIFF_BYTES = 512 * 1024
+
+
+def max_body_bytes(path):
+    """Request size limit for a path: MAX_VIDEO_BYTES for video uploads, else MAX_CONTENT_LENGTH."""
+    return MAX_VIDEO_BYTES if path in VIDEO_PATHS else MAX_CONTENT_LENGTH
+
+
+class InMemoryRequest(Request):
+    """
+    Request class whose multipart file parts are buffered in memory, never on disk.
+    Video uploads have their own size limit and only stay in memory while they are small.
+    """
+
+    @property
+    def max_content_length(self):
+        return max_body_bytes(self.path)
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path in VIDEO_PATHS:
+            return tempfile.SpooledTemporaryFile(max_size=MAX_CONTENT_LENGTH)
+        return io.BytesIO()
+
+
+def cors_origin(origin):
+    """Access-Control-Allow-Origin value for a request's Origin header, or None to send none."""
+    if '*' in CORS_ORIGINS:
+        return '*'
+    return origin if origin in CORS_ORIGINS else None
+
+
+def configure_app(app):
+    """Install the in-memory request class, the request size limit and CORS_ORIGINS on a Flask app."""
+    app.request_class = InMemoryRequest
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    origins = '*' if '*' in CORS_ORIGINS else CORS_ORIGINS
+    # Retry-After must be readable by the frontend to back off from 429/503
+    CORS(app, resources={r"/*": {"origins": origins}}, expose_headers=['Retry-After'])
+
+
+class UploadError(ValueError):
+    """Raised when an upload is rejected. `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class StreamedUpload:
+    """Result of stream_upload: form fields, validated values, and the image file with its header info."""
+
+    def __init__(self):
+        self.fields = {}
+        self.values = {}
+        self.filename = None
+        self.file = None
+        self.image_format = None
+        self.image_size = None
+        self.bytes_received = 0
+
+
+def sniff_image(prefix, complete):
+    """
+    (format, (width, height)) from the start of an image file, or None if more bytes are needed.
+    Pillow only parses the header here; no pixel data is decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(prefix)) as image:
+            image_format, size = image.format, image.size
+    except Image.DecompressionBombError:
+        raise UploadError("Image has too many pixels", 413)
+    except Exception:
+        if complete or len(prefix) >= MAX_SNIFF_BYTES:
+            raise UploadError("Could not read image file", 400)
+        return None
+    if image_format not in UPLOAD_IMAGE_FORMATS:
+        raise UploadError(f"Unsupported image format: {image_format}", 415)
+    if size[0] * size[1] > MAX_IMAGE_PIXELS:
+        raise UploadError(f"Image has too many pixels ({size[0]}x{size[1]})", 413)
+    return image_format, size
+
+
+class UploadParser:
+    """
+    Incremental multipart/form-data parser behind stream_upload. feed() it body chunks as they
+    arrive (from a WSGI stream or ASGI receive messages), then call finish() for the upload.
+    `validators` maps field names to functions turning the field's text into a value (stored in
+    `values`); a ValueError from one rejects the upload with its message. `required` fields
+    and `file_field` must be present. Every method raises UploadError.
+    """
+
+    def __init__(self, content_type_header, content_length=None, file_field='image', validators=None,
+                 required=()):
+        content_type, options = parse_options_header(content_type_header or '')
+        if content_type != 'multipart/form-data' or 'boundary' not in options:
+            raise UploadError("Expected a multipart/form-data upload")
+        if content_length is not None and content_length > MAX_CONTENT_LENGTH:
+            raise UploadError(f"Upload larger than {MAX_CONTENT_LENGTH} bytes", 413)
+
+        # The decoder's limit bounds its unparsed buffer: one chunk plus a partial part header
+        self.decoder = MultipartDecoder(options['boundary'].encode('latin-1'),
+                                        max_form_memory_size=UPLOAD_CHUNK_BYTES + MAX_FORM_FIELD_BYTES)
+        self.file_field = file_field
+        self.validators = validators or {}
+        self.required = required
+        self.upload = StreamedUpload()
+        self.complete = False
+        self._part, self._buffer = None, None
+
+    def feed(self, chunk):
+        """Parse the next piece of the body. Chunks larger than UPLOAD_CHUNK_BYTES are split."""
+        for offset in range(0, len(chunk), UPLOAD_CHUNK_BYTES):
+            self._receive(chunk[offset:offset + UPLOAD_CHUNK_BYTES])
+
+    def finish(self):
+        """The parsed upload, once the whole body has been fed."""
+        if not self.complete:
+            # Tell the decoder no more data is coming so it releases the held-back tail
+            self._receive(None)
+        if not self.complete:
+            raise UploadError("Incomplete multipart upload")
+        upload = self.upload
+        if upload.file is None:
+            raise UploadError(f"Missing {self.file_field} file")
+        for name in self.required:
+            if name not in upload.fields:
+                raise UploadError(f"Missing {name} parameter")
+        return upload
+
+    def _receive(self, chunk):
+        upload = self.upload
+        if self.complete:
+            return
+        upload.bytes_received += len(chunk or b'')
+        if upload.bytes_received > MAX_CONTENT_LENGTH:
+            raise UploadError(f"Upload larger than {MAX_CONTENT_LENGTH} bytes", 413)
+        try:
+            self.decoder.receive_data(chunk)
+        except RequestEntityTooLarge as e:
+            raise UploadError(f"Malformed multipart upload: {e}")
+
+        while True:
+            try:
+                event = self.decoder.next_event()
+            except (ValueError, RequestEntityTooLarge) as e:
+                raise UploadError(f"Malformed multipart upload: {e}")
+            if isinstance(event, NeedData):
+                return
+            if isinstance(event, Epilogue):
+                self.complete = True
+                return
+            part, buffer = self._part, self._buffer
+            if isinstance(event, File) and event.name == self.file_field and upload.filename is None:
+                self._part, self._buffer = event, io.BytesIO()
+                upload.filename = event.filename or ''
+            elif isinstance(event, (Field, File)):
+                # Extra files are read past and dropped
+                self._part, self._buffer = event, (bytearray() if isinstance(event, Field) else None)
+            elif isinstance(event, Data) and isinstance(part, Field):
+                buffer += event.data
+                if len(buffer) > MAX_FORM_FIELD_BYTES:
+                    raise UploadError(f"Form field {part.name} is too large", 413)
+                if not event.more_data:
+                    _finish_field(upload, part.name, bytes(buffer), self.validators)
+            elif isinstance(event, Data) and buffer is not None:
+                buffer.write(event.data)
+                if upload.image_format is None:
+                    # Only the header is needed; stop copying once it has been recognised
+                    sniffed = sniff_image(buffer.getvalue(), complete=not event.more_data)
+                    if sniffed is not None:
+                        upload.image_format, upload.image_size = sniffed
+                if not event.more_data:
+                    buffer.seek(0)
+                    upload.file = buffer
+
+
+def stream_upload(request, file_field='image', validators=None, required=()):
+    """
+    Parse a Flask request's multipart/form-data body incrementally with UploadParser.
+    Returns a StreamedUpload or raises UploadError.
+    """
+    parser = UploadParser(request.headers.get('Content-Type', ''), request.content_length, file_field,
+                          validators, required)
+    while not parser.complete:
+        try:
+            chunk = request.stream.read(UPLOAD_CHUNK_BYTES)
+        except RequestEntityTooLarge:
+            raise UploadError(f"Upload larger than {MAX_CONTENT_LENGTH} bytes", 413)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.finish()
+
+
+def _finish_field(upload, name, data, validators):
+    try:
+        text = data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise UploadError(f"Form field {name} is not valid UTF-8")
+    upload.fields[name] = text
+    validator = validators.get(name)
+    if validator is not None:
+        try:
+            upload.values[name] = validator(text)
+        except ValueError as e:
+            raise UploadError(str(e))
@@ -0,0 +1,237 @@
+"""
+Result Cache
+Content-addressed LRU cache of landmark detections, keyed by a hash of the image bytes.
+The landmark array is stored separately from the scalar measurements, so resubmitting
+the same image with a different frame_width_mm only re-runs the cheap pixel-to-mm step.
+Entries evicted from memory can optionally spill to disk as .npz files.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Memory budget for cached landmark arrays, in bytes. 0 disables the cache.
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Directory for entries evicted from memory. Unset keeps the cache memory-only.
+RESULT_CACHE_SPILL_DIR = os.getenv('RESULT_CACHE_SPILL_DIR', '')
+
+# Disk budget for spilled entries, in bytes
+RESULT_CACHE_SPILL_MAX_BYTES = int(os.getenv('RESULT_CACHE_SPILL_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Measurements memoized per entry (one per distinct frame_width_mm)
+MAX_WIDTHS_PER_ENTRY = 8
+
+# Rough per-entry overhead beyond the landmark array (dicts, key, measurements)
+ENTRY_OVERHEAD_BYTES = 512
+
+
+class CacheEntry:
+    """
+    Cached detection for one image: landmarks, frame size and per-width measurements.
+    `pose` is the face's transformation matrix when the landmarker output one.
+    `sharp` records whether the image passed the blur check before inference.
+    """
+
+    __slots__ = ('landmarks', 'frame_dims', 'pose', 'sharp', 'measurements')
+
+    def __init__(self, landmarks, frame_dims, pose=None, sharp=False):
+        self.landmarks = landmarks
+        self.frame_dims = frame_dims
+        self.pose = pose
+        self.sharp = sharp
+        self.measurements = {}
+
+    @property
+    def nbytes(self):
+        return self.landmarks.nbytes + ENTRY_OVERHEAD_BYTES
+
+
+def save_entry(path, entry):
+    """Write a CacheEntry's detection (not its measurements) to an .npz file."""
+    with open(path, 'wb') as f:
+        pose = {} if entry.pose is None else {'pose': entry.pose}
+        np.savez(f, landmarks=entry.landmarks, frame_dims=json.dumps(entry.frame_dims),
+                 sharp=entry.sharp, **pose)
+
+
+def load_entry(path):
+    """Read a CacheEntry written by save_entry. Raises OSError, ValueError or KeyError."""
+    with np.load(path) as data:
+        return CacheEntry(data['landmarks'], json.loads(str(data['frame_dims'])),
+                          data['pose'] if 'pose' in data.files else None, bool(data['sharp']))
+
+
+def image_key(image_source):
+    """
+    Hash an image source. Returns (key, source) where `source` can still be decoded:
+    file-like objects are read once and replaced by their bytes.
+    """
+    if isinstance(image_source, np.ndarray):
+        data = np.ascontiguousarray(image_source)
+        digest = hashlib.blake2b(memoryview(data).cast('B'), digest_size=16)
+        digest.update(str(data.shape).encode())
+        return digest.hexdigest(), image_source
+    if hasattr(image_source, 'read'):
+        image_source = image_source.read()
+    elif isinstance(image_source, (str, os.PathLike)):
+        with open(image_source, 'rb') as f:
+            image_source = f.read()
+    return hashlib.blake2b(image_source, digest_size=16).hexdigest(), image_source
+
+
+class ResultCache:
+    """Thread-safe LRU over CacheEntry objects, bounded by bytes, with optional disk spill."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, spill_dir=RESULT_CACHE_SPILL_DIR,
+                 spill_max_bytes=RESULT_CACHE_SPILL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir or None
+        self.spill_max_bytes = spill_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """Return the CacheEntry for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._load_spilled(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self._insert(key, entry)
+        return entry
+
+    def put(self, key, landmarks, frame_dims, pose=None, sharp=False):
+        """Store a detection and return its CacheEntry."""
+        entry = CacheEntry(landmarks, frame_dims, pose, sharp)
+        self._insert(key, entry)
+        return entry
+
+    def measurements(self, entry, frame_width_mm, compute, pose_correction=False):
+        """
+        Return memoized measurements for a width, computing them with `compute` on first use.
+        With `pose_correction` and a cached pose, `compute` also gets pose=entry.pose.
+        """
+        corrected = pose_correction and entry.pose is not None
+        width_key = (round(float(frame_width_mm), 4), corrected)
+        # Entries are shared between request threads; compute() runs outside the lock
+        with self._lock:
+            measurements = entry.measurements.get(width_key)
+        if measurements is None:
+            extra = {'pose': entry.pose} if corrected else {}
+            measurements = compute(entry.landmarks, entry.frame_dims['width'],
+                                   entry.frame_dims['height'], frame_width_mm, **extra)
+            with self._lock:
+                if width_key not in entry.measurements:
+                    if len(entry.measurements) >= MAX_WIDTHS_PER_ENTRY:
+                        entry.measurements.pop(next(iter(entry.measurements)))
+                    entry.measurements[width_key] = measurements
+        return dict(measurements)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _insert(self, key, entry):
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.nbytes
+            self._entries[key] = entry
+            self._bytes += entry.nbytes
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._bytes -= old_entry.nbytes
+                self.evictions += 1
+                evicted.append((old_key, old_entry))
+        for old_key, old_entry in evicted:
+            self._spill(old_key, old_entry)
+
+    # --- Disk spill ---
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f'{key}.npz')
+
+    def _spill(self, key, entry):
+        if not self.spill_dir:
+            return
+        try:
+            path = self._spill_path(key)
+            partial_path = f'{path}.{threading.get_ident()}.part'
+            save_entry(partial_path, entry)
+            os.replace(partial_path, path)
+            self._trim_spill_dir()
+        except OSError as e:
+            print(f"Result cache spill failed: {e}")
+
+    def _load_spilled(self, key):
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(key)
+        try:
+            entry = load_entry(path)
+            os.remove(path)
+            return entry
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _trim_spill_dir(self):
+        files = [os.path.join(self.spill_dir, name) for name in os.listdir(self.spill_dir)
+                 if name.endswith('.npz')]
+        stats = sorted(((os.stat(path), path) for path in files), key=lambda item: item[0].st_mtime)
+        total = sum(stat.st_size for stat, _ in stats)
+        for stat, path in stats:
+            if total <= self.spill_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= stat.st_size
+
+
+# ========================================
+# Process-wide cache
+# ========================================
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Get or create the process-wide result cache."""
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache()
+    return _result_cache
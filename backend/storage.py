@@ -0,0 +1,348 @@
+"""
+Storage Backends
+The collections returned by get_db_collections() come from one of two backends with the
+same small interface (name, insert_one, insert_many, history, find_by_ids, upsert_many):
+  MongoStorage  - MongoDB through database.py
+  SQLiteStorage - an embedded SQLite file for stores with poor connectivity
+STORAGE_BACKEND picks one; 'auto' uses MongoDB when MONGODB_URI is set and SQLite otherwise.
+"""
+
+import os
+import sqlite3
+import threading
+
+from bson import ObjectId, json_util
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (MONGODB_URI decides the 'auto' backend)
+load_dotenv()
+
+# mongodb, sqlite or auto
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'auto')
+
+# SQLite database file used by the sqlite backend
+SQLITE_PATH = os.getenv('SQLITE_PATH') or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       'advance_filter.sqlite3')
+
+COLLECTIONS = ('users', 'measurements')
+
+
+class InsertOneResult:
+    """Mirrors pymongo's InsertOneResult."""
+
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class InsertManyResult:
+    """Mirrors pymongo's InsertManyResult."""
+
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+
+
+class UpsertManyResult:
+    """The counts of pymongo's BulkWriteResult that upsert_many reports."""
+
+    def __init__(self, matched_count, upserted_count):
+        self.matched_count = matched_count
+        self.upserted_count = upserted_count
+
+
+# ========================================
+# MongoDB
+# ========================================
+def mongo_filter(spec):
+    """Translate a history.parse_args spec into a MongoDB filter."""
+    clauses = []
+    if spec['user_id']:
+        clauses.append({'user_id': spec['user_id']})
+    created_range = {}
+    if spec['date_from']:
+        created_range['$gte'] = spec['date_from']
+    if spec['date_to']:
+        created_range['$lte'] = spec['date_to']
+    if created_range:
+        clauses.append({'created_at': created_range})
+    if spec['after']:
+        created_at, object_id = spec['after']
+        if created_at is None:
+            clauses.append({'created_at': None, '_id': {'$lt': object_id}})
+        else:
+            # Older timestamps, or the same timestamp and a smaller _id; records without
+            # created_at sort last in descending order
+            clauses.append({'$or': [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': object_id}},
+                {'created_at': None},
+            ]})
+    return clauses[0] if len(clauses) == 1 else ({'$and': clauses} if clauses else {})
+
+
+class MongoCollection:
+    """A pymongo collection plus history(); everything else passes through."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def history(self, spec, limit):
+        """Documents for one /history page, newest first on (created_at, _id)."""
+        # created_at is always fetched because the cursor is built from it
+        projection = {field: 1 for field in spec['fields']}
+        projection['created_at'] = 1
+        return (self._collection.find(mongo_filter(spec), projection)
+                .sort([('created_at', -1), ('_id', -1)]).limit(limit).batch_size(min(limit, 500)))
+
+    def find_by_ids(self, ids):
+        """{_id: document} for the documents among `ids` that exist."""
+        return {document['_id']: document for document in self._collection.find({'_id': {'$in': list(ids)}})}
+
+    def upsert_many(self, updates):
+        """
+        Set fields on many documents in one unordered bulk write. `updates` is a list of
+        (_id, fields) pairs; documents that do not exist yet are created.
+        """
+        from pymongo import UpdateOne
+        if not updates:
+            return UpsertManyResult(0, 0)
+        result = self._collection.bulk_write(
+            [UpdateOne({'_id': _id}, {'$set': fields}, upsert=True) for _id, fields in updates], ordered=False)
+        return UpsertManyResult(result.matched_count, result.upserted_count)
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class MongoStorage:
+    name = 'mongodb'
+
+    def __init__(self):
+        from database import get_db
+        self._db = get_db()
+        self.users = MongoCollection(self._db.users)
+        self.measurements = MongoCollection(self._db.measurements)
+
+    def collection(self, name):
+        return getattr(self, name)
+
+    def ensure_indexes(self):
+        from database import ensure_indexes
+        ensure_indexes()
+
+    def warm_up(self):
+        from database import start_monitor
+        start_monitor()
+
+    def health(self):
+        """Cached status from the background monitor; never blocks on the network."""
+        from database import database_health
+        return database_health()
+
+
+# ========================================
+# SQLite
+# ========================================
+def _sql_timestamp(value):
+    # Fixed-width text so timestamps sort correctly as strings. Truncated to milliseconds, the
+    # precision of the document's BSON/extended JSON, so /history cursors match the column.
+    if not value:
+        return None
+    return value.replace(microsecond=value.microsecond // 1000 * 1000).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+class SQLiteCollection:
+    """
+    One table per collection: indexed id, user_id and created_at columns, plus the full
+    document as extended JSON. Statements use fixed SQL with ? parameters, so sqlite3's
+    per-connection statement cache prepares each one only once.
+    """
+
+    def __init__(self, storage, name):
+        self._storage = storage
+        self.name = name
+
+    def insert_one(self, document):
+        return InsertOneResult(self.insert_many([document]).inserted_ids[0])
+
+    def insert_many(self, documents, ordered=True):
+        """Insert in one transaction. Documents whose _id already exists are skipped."""
+        rows = []
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+            rows.append((str(document['_id']), document.get('user_id'),
+                         _sql_timestamp(document.get('created_at')), json_util.dumps(document)))
+        connection = self._storage.connection()
+        with connection:
+            connection.executemany(
+                f'INSERT OR IGNORE INTO {self.name} (id, user_id, created_at, document) VALUES (?, ?, ?, ?)',
+                rows)
+        return InsertManyResult([document['_id'] for document in documents])
+
+    def history(self, spec, limit):
+        """Documents for one /history page, newest first on (created_at, id)."""
+        clauses, params = [], []
+        if spec['user_id']:
+            clauses.append('user_id = ?')
+            params.append(spec['user_id'])
+        if spec['date_from']:
+            clauses.append('created_at >= ?')
+            params.append(_sql_timestamp(spec['date_from']))
+        if spec['date_to']:
+            clauses.append('created_at <= ?')
+            params.append(_sql_timestamp(spec['date_to']))
+        if spec['after']:
+            created_at, object_id = spec['after']
+            if created_at is None:
+                clauses.append('(created_at IS NULL AND id < ?)')
+                params.append(str(object_id))
+            else:
+                created_at = _sql_timestamp(created_at)
+                clauses.append('(created_at < ? OR (created_at = ? AND id < ?) OR created_at IS NULL)')
+                params.extend([created_at, created_at, str(object_id)])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        cursor = self._storage.connection().execute(
+            f'SELECT document FROM {self.name} {where} ORDER BY created_at DESC, id DESC LIMIT ?',
+            params + [limit])
+        return (json_util.loads(row[0]) for row in cursor)
+
+    def find_by_ids(self, ids):
+        """{_id: document} for the documents among `ids` that exist."""
+        return self._find_by_ids(self._storage.connection(), ids)
+
+    def _find_by_ids(self, connection, ids):
+        documents = {}
+        ids = [str(_id) for _id in ids]
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            cursor = connection.execute(
+                f"SELECT document FROM {self.name} WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+            for (row,) in cursor:
+                document = json_util.loads(row)
+                documents[document['_id']] = document
+        return documents
+
+    def upsert_many(self, updates):
+        """
+        Set fields on many documents in one transaction. `updates` is a list of
+        (_id, fields) pairs; documents that do not exist yet are created.
+        """
+        connection = self._storage.connection()
+        with connection:
+            existing = self._find_by_ids(connection, [_id for _id, _ in updates])
+            rows = []
+            for _id, fields in updates:
+                document = dict(existing.get(_id, {'_id': _id}), **fields)
+                rows.append((str(_id), document.get('user_id'), _sql_timestamp(document.get('created_at')),
+                             json_util.dumps(document)))
+            connection.executemany(
+                f'INSERT INTO {self.name} (id, user_id, created_at, document) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (id) DO UPDATE SET user_id = excluded.user_id, '
+                'created_at = excluded.created_at, document = excluded.document', rows)
+        return UpsertManyResult(len(existing), len(updates) - len(existing))
+
+
+class SQLiteStorage:
+    name = 'sqlite'
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self.users = SQLiteCollection(self, 'users')
+        self.measurements = SQLiteCollection(self, 'measurements')
+        self.ensure_indexes()
+
+    def connection(self):
+        """One connection per thread; WAL lets readers run alongside the writer."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, cached_statements=64)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def collection(self, name):
+        return getattr(self, name)
+
+    def ensure_indexes(self):
+        connection = self.connection()
+        with connection:
+            for name in COLLECTIONS:
+                connection.execute(f'CREATE TABLE IF NOT EXISTS {name} ('
+                                   'id TEXT PRIMARY KEY, user_id TEXT, created_at TEXT, document TEXT NOT NULL)')
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {name}_created_at_id ON {name} (created_at, id)')
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {name}_user_id_created_at_id '
+                                   f'ON {name} (user_id, created_at, id)')
+
+    def warm_up(self):
+        pass
+
+    def health(self):
+        try:
+            self.connection().execute('SELECT 1')
+            return {'status': 'connected'}
+        except sqlite3.Error as e:
+            print(f"SQLite connection failed: {e}")
+            return {'status': 'disconnected'}
+
+
+# ========================================
+# Process-wide storage
+# ========================================
+_storage = None
+_storage_pid = None
+_storage_lock = threading.Lock()
+_bootstrap_failed = False
+
+
+def get_storage():
+    """Get or create the configured storage backend. Raises if it cannot be configured."""
+    global _storage, _storage_pid
+    # A storage inherited from a preloading parent process is rebuilt in the worker
+    if _storage is None or _storage_pid != os.getpid():
+        with _storage_lock:
+            if _storage is None or _storage_pid != os.getpid():
+                backend = STORAGE_BACKEND
+                if backend == 'auto':
+                    backend = 'mongodb' if os.getenv('MONGODB_URI') else 'sqlite'
+                if backend == 'mongodb':
+                    _storage = MongoStorage()
+                elif backend == 'sqlite':
+                    _storage = SQLiteStorage()
+                else:
+                    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+                _storage_pid = os.getpid()
+    return _storage
+
+
+def bootstrap_in_background():
+    """
+    Connect, warm up and create indexes on a daemon thread, so an unreachable
+    database never delays startup.
+    """
+
+    def run():
+        global _bootstrap_failed
+        try:
+            storage = get_storage()
+            storage.warm_up()
+            storage.ensure_indexes()
+        except Exception as e:
+            # The error can name the database host; it goes to the log, never to /health
+            _bootstrap_failed = True
+            print(f"Storage bootstrap failed: {e}")
+
+    threading.Thread(target=run, name='storage-bootstrap', daemon=True).start()
+
+
+def storage_health():
+    """
+    (backend name, health dict) for /health. Uses only cached state: it never creates
+    the storage or waits on the network.
+    """
+    if _storage is None or _storage_pid != os.getpid():
+        if _bootstrap_failed:
+            return None, {'status': 'not_configured'}
+        return None, {'status': 'starting'}
+    return _storage.name, _storage.health()
@@ -0,0 +1,179 @@
+"""
+Video Measurement
+Measures PD/FH from an uploaded clip instead of a single client-picked frame.
+Frames are decoded lazily and sampled adaptively, landmarks run through one
+FaceLandmarker in VIDEO mode (so the face tracker carries over between frames),
+and the per-frame measurements are aggregated into robust estimates.
+OpenCV (cv2) is installed as a MediaPipe dependency.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from measurement_logic import compute_measurements, create_landmarker
+from preprocess import decode_for_inference
+from frame_quality import MIN_SHARPNESS, score_landmarks, sharpness
+
+# Target sampling rate, in frames per second of video, while the face moves normally
+VIDEO_SAMPLE_FPS = float(os.getenv('VIDEO_SAMPLE_FPS', '10'))
+
+# Stop once this many frames with a face have been collected
+VIDEO_MAX_GOOD_FRAMES = int(os.getenv('VIDEO_MAX_GOOD_FRAMES', '60'))
+
+# Mean landmark displacement (normalized units) between samples below which the
+# head is considered still, so the sampling stride may grow
+STILL_MOTION = 0.004
+
+# Fraction trimmed from each end for the trimmed mean
+TRIM_FRACTION = 0.1
+
+
+def open_video(video_path):
+    """Open a video file with OpenCV. Returns (capture, fps)."""
+    import cv2
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise ValueError("Error: Could not read video file.")
+    return capture, capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+
+def iter_sampled_frames(capture, fps, stride):
+    """
+    Generator over (timestamp_ms, rgb_frame) for sampled frames, `stride` frames apart.
+    Skipped frames are only grabbed: they are still decoded from the compressed stream, but
+    never retrieved or converted to RGB, so only sampled frames are ever held in memory.
+    Send a new stride into the generator to adapt the sampling rate.
+    """
+    import cv2
+
+    frame_index = 0
+    try:
+        while True:
+            ok, frame_bgr = capture.read()
+            if not ok:
+                return
+            timestamp_ms = int(round(frame_index * 1000.0 / fps))
+            requested = yield timestamp_ms, cv2.cvtColor(frame_bgr, cv2.COLOR_BGR2RGB)
+            if requested:
+                stride = max(1, int(requested))
+            # grab() still decodes the skipped frames; it only skips retrieve() and the colour conversion
+            for _ in range(stride - 1):
+                if not capture.grab():
+                    return
+            frame_index += stride
+    finally:
+        capture.release()
+
+
+def aggregate(values):
+    """Robust summary of one measurement across frames: median, trimmed mean and spread."""
+    values = np.sort(values[np.isfinite(values)])
+    if values.size == 0:
+        return None
+    trim = int(values.size * TRIM_FRACTION)
+    trimmed = values[trim:values.size - trim] if values.size > 2 * trim else values
+    median = float(np.median(values))
+    return {
+        'median': median,
+        'trimmed_mean': float(trimmed.mean()),
+        # Median absolute deviation scaled to be comparable with a standard deviation
+        'spread': float(1.4826 * np.median(np.abs(values - median))),
+    }
+
+
+def analyze_video(video_path, frame_width_mm, sample_fps=VIDEO_SAMPLE_FPS, max_good_frames=VIDEO_MAX_GOOD_FRAMES):
+    """
+    Analyzes a video file and returns robust measurements over its good frames.
+    The response keeps the /process_image keys ('measurements', 'landmarks',
+    'frameDimensions') and adds per-measurement statistics and frame counts.
+    """
+    import mediapipe as mp
+    from mediapipe.tasks.python import vision
+
+    start = time.perf_counter()
+    capture, fps = open_video(video_path)
+    base_stride = stride = max(1, round(fps / sample_fps))
+    try:
+        detector = create_landmarker(running_mode=vision.RunningMode.VIDEO)
+    except Exception:
+        capture.release()
+        raise
+
+    faces = []
+    frame_dims = None
+    sampled = 0
+    rejected = {'blurred': 0, 'eyes_closed': 0, 'head_turned': 0}
+    previous = None
+    frames = iter_sampled_frames(capture, fps, base_stride)
+    try:
+        item = next(frames, None)
+        while item is not None and len(faces) < max_good_frames:
+            timestamp_ms, frame_rgb = item
+            sampled += 1
+            prepared = decode_for_inference(frame_rgb)
+            frame_dims = prepared.frame_dims
+
+            # Motion-blurred frames are skipped before inference
+            if sharpness(prepared.image_rgb) < MIN_SHARPNESS:
+                rejected['blurred'] += 1
+                stride = max(1, base_stride // 2)
+                item = frames.send(stride)
+                continue
+
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=prepared.image_rgb)
+            result = detector.detect_for_video(mp_image, timestamp_ms)
+
+            if result.face_landmarks:
+                points = np.array([(lm.x, lm.y, lm.z) for lm in result.face_landmarks[0]], dtype=np.float64)
+                landmarks = prepared.to_frame_coordinates(points).astype(np.float32)
+                # Closed eyes or a turned head: keep tracking, but do not measure this frame
+                reason = score_landmarks(landmarks)['reason']
+                if reason:
+                    rejected[reason] += 1
+                else:
+                    faces.append(landmarks)
+                # Still head: consecutive frames are redundant, so sample more sparsely
+                motion = np.inf if previous is None else float(np.abs(landmarks[:, :2] - previous[:, :2]).mean())
+                stride = min(stride * 2, base_stride * 4) if motion < STILL_MOTION and not reason else base_stride
+                previous = landmarks
+            else:
+                # Face lost: sample densely until the tracker re-acquires it
+                stride = max(1, base_stride // 2)
+                previous = None
+            item = frames.send(stride)
+    except StopIteration:
+        pass
+    finally:
+        frames.close()
+        detector.close()
+
+    if not faces:
+        if any(rejected.values()):
+            raise ValueError(f"No usable frames in the video (rejected: {rejected}).")
+        raise ValueError("No face detected in the video.")
+
+    stack = np.stack(faces)
+    per_frame = compute_measurements(stack, frame_dims['width'], frame_dims['height'], frame_width_mm)
+    stats = {key: aggregate(values) for key, values in per_frame.items()}
+    if stats['pd'] is None:
+        raise ValueError("Could not establish a reference width for measurement.")
+
+    # Landmarks of the frame whose PD is closest to the robust estimate
+    best = int(np.nanargmin(np.abs(per_frame['pd'] - stats['pd']['median'])))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'measurements': {key: value['median'] for key, value in stats.items() if value is not None},
+        'statistics': stats,
+        'landmarks': stack[best].tolist(),
+        'frameDimensions': frame_dims,
+        'frames': {
+            'sampled': sampled,
+            'measured': len(faces),
+            'rejected': rejected,
+        },
+        'processing_fps': round(sampled / elapsed, 2) if elapsed > 0 else None,
+    }
@@ -0,0 +1,424 @@
+"""
+Write-Behind Persistence
+Takes database inserts off the request path. Documents get a client-side ObjectId, are
+acknowledged immediately and buffered in memory; a background thread flushes them with
+insert_many once the buffer reaches a size or age threshold. When MongoDB is unreachable
+the documents go to a local append-only journal, which is replayed once the database is
+back (and on the next start). Replays are idempotent: documents keep their _id and
+duplicate-key errors are ignored.
+
+Each process writes its own journal (<WRITE_BEHIND_JOURNAL>.<pid>), so one worker's flush
+or replay never touches documents another worker has acknowledged. A new writer adopts the
+journals of processes that are no longer running and replays them.
+
+Durability is chosen with WRITE_BEHIND_MODE:
+  sync      - insert inside the request, as before (no buffering); the default, since a
+              serverless function is frozen or killed once it has responded
+  buffered  - memory buffer, journal only on database failure; a crash loses at most
+              the unflushed buffer. Long-lived servers (gunicorn.conf.py, asgi.py) default to it.
+  journaled - every document is appended to the journal before it is acknowledged
+"""
+
+import atexit
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+from bson import ObjectId, json_util
+from pymongo.errors import BulkWriteError
+
+from storage import InsertManyResult, InsertOneResult, get_storage
+
+# Durability mode: sync, buffered or journaled
+WRITE_BEHIND_MODE = os.getenv('WRITE_BEHIND_MODE') or 'sync'
+
+# Flush when this many documents are buffered...
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv('WRITE_BEHIND_BATCH_SIZE', '100'))
+
+# ...or when the oldest buffered document is this old (milliseconds)
+WRITE_BEHIND_FLUSH_MS = int(os.getenv('WRITE_BEHIND_FLUSH_MS', '500'))
+
+# Documents held in memory at most; beyond this, inserts go straight to the journal
+WRITE_BEHIND_MAX_BUFFER = int(os.getenv('WRITE_BEHIND_MAX_BUFFER', '10000'))
+
+# Append-only journal for documents MongoDB could not take yet; each process appends '.<pid>'
+WRITE_BEHIND_JOURNAL = (os.getenv('WRITE_BEHIND_JOURNAL')
+                        or os.path.join(tempfile.gettempdir(), 'advance_filter_journal.jsonl'))
+
+# fsync the journal on every append (journaled mode) or failed flush
+WRITE_BEHIND_FSYNC = os.getenv('WRITE_BEHIND_FSYNC', '1') == '1'
+
+# Seconds to wait after a failed flush before talking to MongoDB again
+WRITE_BEHIND_RETRY_SECONDS = float(os.getenv('WRITE_BEHIND_RETRY_SECONDS', '5'))
+
+MODES = ('sync', 'buffered', 'journaled')
+DUPLICATE_KEY = 11000
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindCollection:
+    """
+    Wraps a pymongo collection: insert_one/insert_many go through the writer,
+    everything else (find, create_index, ...) is the underlying collection.
+    """
+
+    def __init__(self, collection, writer):
+        self._collection = collection
+        self._writer = writer
+
+    def insert_one(self, document):
+        document.setdefault('_id', ObjectId())
+        self._writer.add(self._collection.name, [document])
+        return InsertOneResult(document['_id'])
+
+    def insert_many(self, documents):
+        documents = list(documents)
+        for document in documents:
+            document.setdefault('_id', ObjectId())
+        self._writer.add(self._collection.name, documents)
+        return InsertManyResult([document['_id'] for document in documents])
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+
+class WriteBehindWriter:
+    """Buffers (collection name, document) pairs and flushes them from one daemon thread."""
+
+    def __init__(self, mode=WRITE_BEHIND_MODE, batch_size=WRITE_BEHIND_BATCH_SIZE,
+                 flush_ms=WRITE_BEHIND_FLUSH_MS, max_buffer=WRITE_BEHIND_MAX_BUFFER,
+                 journal_path=WRITE_BEHIND_JOURNAL, fsync=WRITE_BEHIND_FSYNC,
+                 retry_seconds=WRITE_BEHIND_RETRY_SECONDS, get_collection=None):
+        if mode not in MODES:
+            raise ValueError(f"WRITE_BEHIND_MODE must be one of {', '.join(MODES)}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000.0
+        self.max_buffer = max_buffer
+        self.journal_base = journal_path
+        self.journal_path = f'{journal_path}.{os.getpid()}'
+        self.replay_path = f'{self.journal_path}.replay'
+        self.fsync = fsync
+        self.retry_seconds = retry_seconds
+        self._get_collection = get_collection or _database_collection
+        self._buffer = []
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._replay_lock = threading.Lock()
+        # Journals of processes that exited before replaying them, now owned by this one
+        self._orphans = self._adopt_orphans()
+        # The journal holds documents that may not be in MongoDB yet
+        self._journal_dirty = (os.path.exists(self.journal_path) or os.path.exists(self.replay_path)
+                               or bool(self._orphans))
+        # Bumped on every failed flush, so a replay knows whether new failures arrived meanwhile
+        self._failure_generation = 0
+        self._retry_at = 0.0
+        self._flush_latencies = deque(maxlen=256)
+        self.counters = {'buffered': 0, 'written': 0, 'journaled': 0, 'replayed': 0, 'flushes': 0,
+                         'failed_flushes': 0}
+
+    # --- Request side ---
+    def add(self, collection_name, documents):
+        """Accept documents for `collection_name`; returns once they are buffered (or journaled)."""
+        entries = [(collection_name, document) for document in documents]
+        self._start()
+        with self._cond:
+            if self.mode == 'journaled':
+                self._append_journal(entries)
+            elif len(self._buffer) + len(entries) > self.max_buffer:
+                # Flusher is stuck on an unreachable database: keep the documents on disk
+                self._append_journal(entries)
+                return
+            if not self._buffer:
+                self._oldest = time.monotonic()
+                # Wake the flusher so it starts the age timer
+                self._cond.notify()
+            self._buffer.extend(entries)
+            self.counters['buffered'] += len(entries)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Write out everything buffered so far from the calling thread. Returns True on success."""
+        with self._cond:
+            batch, self._buffer = self._buffer, []
+        return self._write(batch) if batch else True
+
+    def stats(self):
+        with self._cond:
+            latencies = sorted(self._flush_latencies)
+            buffered_now = len(self._buffer)
+        stats = dict(self.counters, mode=self.mode, pending=buffered_now,
+                     journal_pending=self._journal_dirty)
+        if latencies:
+            stats['flush_ms'] = {
+                'last': round(self._flush_latencies[-1], 2),
+                'p50': round(latencies[len(latencies) // 2], 2),
+                'p95': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 2),
+                'max': round(latencies[-1], 2),
+            }
+        return stats
+
+    def shutdown(self):
+        """Stop the flusher and write out (or journal) whatever is still buffered."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    # --- Flusher thread ---
+    def _start(self):
+        # Started lazily so forking servers do not inherit dead threads
+        if self._thread is not None:
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def start(self):
+        """Start the flusher now, e.g. at startup so a leftover journal is replayed."""
+        self._start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping and not self._due():
+                    self._cond.wait(timeout=self._wait_seconds())
+                if self._stopping:
+                    return
+                batch, self._buffer = self._buffer, []
+            if batch:
+                self._write(batch)
+            if self._journal_dirty and time.monotonic() >= self._retry_at:
+                self.replay()
+
+    def _due(self):
+        if self._buffer and (len(self._buffer) >= self.batch_size
+                             or time.monotonic() - self._oldest >= self.flush_seconds):
+            return True
+        return self._journal_dirty and time.monotonic() >= self._retry_at
+
+    def _wait_seconds(self):
+        if self._buffer:
+            return max(0.0, self.flush_seconds - (time.monotonic() - self._oldest))
+        if self._journal_dirty:
+            return max(0.0, self._retry_at - time.monotonic())
+        return None
+
+    def _write(self, batch):
+        """insert_many per collection; on failure the batch ends up in the journal."""
+        if time.monotonic() < self._retry_at:
+            # MongoDB failed recently; do not block on it again yet
+            self._journal_failed(batch)
+            return False
+        start = time.perf_counter()
+        try:
+            for name, documents in _group(batch).items():
+                _insert_idempotent(self._get_collection(name), documents)
+        except Exception as e:
+            logger.error(f"Write-behind flush of {len(batch)} documents failed: {e}")
+            self._retry_at = time.monotonic() + self.retry_seconds
+            self.counters['failed_flushes'] += 1
+            self._journal_failed(batch)
+            return False
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._cond:
+            self._flush_latencies.append(elapsed)
+            self.counters['flushes'] += 1
+            self.counters['written'] += len(batch)
+            # Journaled mode: once everything acknowledged is in MongoDB, the journal can go
+            if self.mode == 'journaled' and not self._buffer and not self._journal_dirty:
+                self._truncate_journal()
+        return True
+
+    def _journal_failed(self, batch):
+        with self._cond:
+            if self.mode != 'journaled':
+                self._append_journal(batch)
+            self._failure_generation += 1
+            self._journal_dirty = True
+
+    # --- Journal ---
+    def _append_journal(self, entries):
+        """Append entries as extended-JSON lines. Caller holds the lock."""
+        with open(self.journal_path, 'a', encoding='utf-8') as journal:
+            for name, document in entries:
+                journal.write(json_util.dumps({'collection': name, 'document': document}) + '\n')
+            journal.flush()
+            if self.fsync:
+                os.fsync(journal.fileno())
+        self.counters['journaled'] += len(entries)
+        if self.mode != 'journaled':
+            self._journal_dirty = True
+
+    def _truncate_journal(self):
+        _remove(self.journal_path)
+
+    def _adopt_orphans(self):
+        """
+        Claim the journals of processes that are no longer running (and a journal from before
+        journals were per process) by renaming them under this process's journal path. The
+        rename is atomic, so when several workers start at once each file gets one owner.
+        """
+        directory, base = os.path.split(self.journal_base)
+        try:
+            names = os.listdir(directory or '.')
+        except OSError:
+            return []
+        adopted = []
+        for name in sorted(names):
+            if name in (base, f'{base}.replay'):
+                owner = None
+            elif name.startswith(f'{base}.'):
+                owner = name[len(base) + 1:].split('.', 1)[0]
+                if not owner.isdigit() or int(owner) == os.getpid() or _process_alive(int(owner)):
+                    continue
+            else:
+                continue
+            claimed = f'{self.journal_path}.adopted-{uuid.uuid4().hex}'
+            try:
+                os.rename(os.path.join(directory, name), claimed)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            adopted.append(claimed)
+        if adopted:
+            logger.info(f"Adopted {len(adopted)} write-behind journals of exited processes")
+        return adopted
+
+    def replay(self):
+        """Insert every journaled document into MongoDB. Returns True once the journal is empty."""
+        with self._replay_lock:
+            return self._replay()
+
+    def _replay(self):
+        with self._cond:
+            generation = self._failure_generation
+            pending = list(self._orphans)
+            if not os.path.exists(self.replay_path) and os.path.exists(self.journal_path):
+                # New appends go to a fresh journal while this one is replayed
+                os.replace(self.journal_path, self.replay_path)
+            if os.path.exists(self.replay_path):
+                pending.append(self.replay_path)
+            if not pending:
+                self._journal_dirty = False
+                return True
+        replayed = 0
+        for path in pending:
+            try:
+                with open(path, encoding='utf-8') as journal:
+                    entries = [json_util.loads(line) for line in journal if line.strip()]
+                for name, documents in _group((e['collection'], e['document']) for e in entries).items():
+                    _insert_idempotent(self._get_collection(name), documents)
+            except FileNotFoundError:
+                entries = []
+            except Exception as e:
+                logger.error(f"Write-behind journal replay failed: {e}")
+                self._retry_at = time.monotonic() + self.retry_seconds
+                return False
+            _remove(path)
+            replayed += len(entries)
+            with self._cond:
+                if path in self._orphans:
+                    self._orphans.remove(path)
+                self.counters['replayed'] += len(entries)
+        with self._cond:
+            if self.mode == 'journaled':
+                # The live journal only mirrors the buffer unless a flush failed since the rotation
+                self._journal_dirty = self._failure_generation != generation
+            else:
+                self._journal_dirty = os.path.exists(self.journal_path)
+        logger.info(f"Replayed {replayed} journaled documents into MongoDB")
+        return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _group(entries):
+    grouped = {}
+    for name, document in entries:
+        grouped.setdefault(name, []).append(document)
+    return grouped
+
+
+def _insert_idempotent(collection, documents):
+    """insert_many that treats documents already present (same _id) as written."""
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(error.get('code') != DUPLICATE_KEY for error in errors) or e.details.get('writeConcernErrors'):
+            raise
+
+
+def _database_collection(name):
+    return get_storage().collection(name)
+
+
+# ========================================
+# Process-wide writer
+# ========================================
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Get or create the process-wide writer."""
+    global _writer, _writer_pid
+    # A writer inherited from a preloading parent has no flusher thread; start over
+    if _writer is None or _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer is None or _writer_pid != os.getpid():
+                _writer = WriteBehindWriter()
+                _writer_pid = os.getpid()
+                atexit.register(_writer.shutdown)
+    return _writer
+
+
+def write_behind(collection):
+    """Wrap a collection for write-behind inserts, or return it unchanged in sync mode."""
+    if collection is None or WRITE_BEHIND_MODE == 'sync':
+        return collection
+    return WriteBehindCollection(collection, get_writer())
+
+
+def write_behind_stats():
+    """Writer stats for /health; does not create the writer."""
+    if WRITE_BEHIND_MODE == 'sync' or _writer is None or _writer_pid != os.getpid():
+        return {'mode': WRITE_BEHIND_MODE}
+    return _writer.stats()
+
+
+def start_write_behind():
+    """Start the flusher at startup when a journal from a previous run is waiting."""
+    if WRITE_BEHIND_MODE == 'sync':
+        return
+    writer = get_writer()
+    if writer._journal_dirty:
+        writer.start()